@@ -0,0 +1,201 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from utils import get_settings, user_config_dir
+
+ARCHIVE_FILE = "archive.sqlite3"
+# Формат записей, импортированных без информации о формате: подходит к любому
+ANY_FORMAT = ""
+DEFAULT_FORMAT = "best"
+
+
+def archive_key(info):
+    """Возвращает (extractor, id) так же, как их записывает --download-archive"""
+    extractor = info.get("extractor_key") or info.get("ie_key") or info.get("extractor")
+    video_id = info.get("id")
+    if not extractor or not video_id:
+        return None
+    return extractor.lower(), str(video_id)
+
+
+_extractors = None
+_extractors_lock = threading.Lock()
+
+
+def key_from_url(url):
+    """Определяет (extractor, id) по одному URL, без обращения к сети"""
+    global _extractors
+    with _extractors_lock:
+        if _extractors is None:
+            from yt_dlp.extractor import gen_extractor_classes
+
+            _extractors = [
+                ie for ie in gen_extractor_classes() if ie.ie_key() != "Generic"
+            ]
+    for ie in _extractors:
+        if ie.suitable(url):
+            video_id = ie.get_temp_id(url)
+            return (ie.ie_key().lower(), video_id) if video_id else None
+    return None
+
+
+class DownloadArchive:
+    """Архив уже скачанных видео в SQLite.
+
+    Записи хранятся по (extractor, id, формат) вместе с путем к файлу;
+    отдельная таблица связывает URL из прошлых загрузок с этими ключами,
+    поэтому повторная проверка ссылки - один запрос к индексу.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS downloads (
+                extractor TEXT NOT NULL,
+                video_id TEXT NOT NULL,
+                format TEXT NOT NULL,
+                path TEXT,
+                created REAL NOT NULL,
+                PRIMARY KEY (extractor, video_id, format)
+            );
+            CREATE TABLE IF NOT EXISTS urls (
+                url TEXT NOT NULL,
+                format TEXT NOT NULL,
+                extractor TEXT NOT NULL,
+                video_id TEXT NOT NULL,
+                PRIMARY KEY (url, format)
+            );
+            """
+        )
+
+    def find(self, url=None, key=None, format_id=None):
+        """Возвращает запись архива для URL или ключа или None.
+
+        Запись, файл которой удален, не считается скачанной.
+        """
+        format_id = format_id or DEFAULT_FORMAT
+        with self._lock:
+            if key is None and url:
+                row = self._conn.execute(
+                    "SELECT extractor, video_id FROM urls WHERE url = ? AND format = ?",
+                    (url, format_id),
+                ).fetchone()
+                key = tuple(row) if row else None
+        if key is None and url:
+            key = key_from_url(url)
+        if key is None:
+            return None
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT path FROM downloads WHERE extractor = ? AND video_id = ? "
+                "AND format IN (?, ?)",
+                (key[0], key[1], format_id, ANY_FORMAT),
+            ).fetchone()
+        if row is None or (row[0] and not os.path.exists(row[0])):
+            return None
+        return {"extractor": key[0], "id": key[1], "path": row[0]}
+
+    def add(self, info, format_id=None, path=None, urls=()):
+        """Записывает скачанное видео и URL, по которым его запрашивали"""
+        key = archive_key(info)
+        if key is None:
+            return False
+        format_id = format_id or DEFAULT_FORMAT
+        aliases = set(urls) | {info.get("webpage_url"), info.get("original_url")}
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO downloads "
+                "(extractor, video_id, format, path, created) VALUES (?, ?, ?, ?, ?)",
+                (*key, format_id, path, time.time()),
+            )
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO urls (url, format, extractor, video_id) "
+                "VALUES (?, ?, ?, ?)",
+                [(alias, format_id, *key) for alias in aliases if alias],
+            )
+            self._conn.commit()
+        return True
+
+    def import_archive_file(self, path):
+        """Импортирует файл --download-archive yt-dlp (строки "extractor id")"""
+        rows = []
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                parts = line.split(None, 1)
+                if len(parts) == 2:
+                    rows.append((parts[0].lower(), parts[1].strip()))
+        return self._import(rows)
+
+    def import_folder(self, folder):
+        """Импортирует все .info.json из папки и вложенных папок"""
+        rows = []
+        for root, _, files in os.walk(folder):
+            # Медиафайл лежит рядом с .info.json и отличается только расширением
+            media = {
+                name.rsplit(".", 1)[0]: name
+                for name in files
+                if "." in name and not name.endswith(".json")
+            }
+            for name in files:
+                if not name.endswith(".info.json"):
+                    continue
+                try:
+                    with open(os.path.join(root, name), encoding="utf-8") as f:
+                        info = json.load(f)
+                except (OSError, ValueError):
+                    continue
+                key = archive_key(info)
+                if key is None:
+                    continue
+                media_name = media.get(name[: -len(".info.json")])
+                path = os.path.join(root, media_name) if media_name else None
+                rows.append((*key, ANY_FORMAT, path))
+        return self._import(rows)
+
+    def import_path(self, path):
+        if os.path.isdir(path):
+            return self.import_folder(path)
+        return self.import_archive_file(path)
+
+    def _import(self, rows):
+        now = time.time()
+        rows = [row if len(row) == 4 else (*row, ANY_FORMAT, None) for row in rows]
+        with self._lock:
+            before = self._conn.total_changes
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO downloads "
+                "(extractor, video_id, format, path, created) VALUES (?, ?, ?, ?, ?)",
+                [(*row, now) for row in rows],
+            )
+            self._conn.commit()
+            return self._conn.total_changes - before
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM downloads").fetchone()[0]
+
+
+_archive = None
+_archive_lock = threading.Lock()
+
+
+def get_download_archive(required=False):
+    """Возвращает общий архив загрузок.
+
+    Если архив отключен в настройках, возвращает None, кроме случая
+    required=True (например, для импорта).
+    """
+    global _archive
+    if not required and not get_settings().get("download_archive", True):
+        return None
+    with _archive_lock:
+        if _archive is None:
+            _archive = DownloadArchive(os.path.join(user_config_dir(), ARCHIVE_FILE))
+        return _archive
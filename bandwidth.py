@@ -0,0 +1,241 @@
+import itertools
+import threading
+import time
+from datetime import datetime
+
+from utils import get_settings
+
+PRIORITY_LOW = 1
+PRIORITY_NORMAL = 2
+PRIORITY_HIGH = 4
+PRIORITY_LABELS = {
+    PRIORITY_HIGH: "Высокий",
+    PRIORITY_NORMAL: "Обычный",
+    PRIORITY_LOW: "Низкий",
+}
+# Названия приоритетов в командной строке и API демона
+PRIORITY_NAMES = {"high": PRIORITY_HIGH, "normal": PRIORITY_NORMAL, "low": PRIORITY_LOW}
+# Как часто пересчитывать распределение полосы между загрузками, секунды
+REALLOCATE_INTERVAL = 0.5
+# Сколько секунд трафика можно накопить впрок
+BURST_SECONDS = 0.25
+# Запас сверх измеренной скорости для загрузок, ограниченных сервером
+DEMAND_HEADROOM = 1.25
+# Постоянная сглаживания измеренной скорости, секунды
+RATE_TIME_CONSTANT = 2.0
+# Дольше этого не спим за один вызов, чтобы вовремя заметить отмену
+MAX_SLEEP = 1.0
+
+
+def parse_time(text):
+    hours, minutes = text.split(":")
+    return int(hours) * 60 + int(minutes)
+
+
+def profile_limit(profiles, now=None):
+    """Возвращает лимит в МБ/с из профиля, действующего сейчас, или None.
+
+    Профиль - словарь {"from": "HH:MM", "to": "HH:MM", "limit_mb": число};
+    интервал может переходить через полночь.
+    """
+    now = now or datetime.now()
+    minute = now.hour * 60 + now.minute
+    for profile in profiles:
+        try:
+            start = parse_time(profile["from"])
+            end = parse_time(profile["to"])
+            limit = float(profile["limit_mb"])
+        except (KeyError, ValueError, TypeError):
+            continue
+        if start <= end:
+            active = start <= minute < end
+        else:
+            active = minute >= start or minute < end
+        if active:
+            return limit
+    return None
+
+
+class BandwidthShare:
+    """Доля общей полосы одной загрузки: собственное ведро токенов"""
+
+    def __init__(self, scheduler, share_id, priority, name=""):
+        self.scheduler = scheduler
+        self.id = share_id
+        self.priority = priority
+        self.name = name
+        self.allocated = None  # байт/с, None - без ограничения
+        self.rate = 0.0  # измеренная скорость, байт/с
+        self._tokens = 0.0
+        self._updated = scheduler.clock()
+        self._rate_sample = (self._updated, 0)
+        self._counted = 0
+        # Приходилось ли ждать с прошлого пересчета; если нет, скорость
+        # ограничивает сервер, и неиспользованная доля отдается другим
+        self._throttled = True
+
+    def consume(self, nbytes):
+        """Учитывает скачанные байты и возвращает, сколько секунд подождать"""
+        return self.scheduler.consume(self, nbytes)
+
+    def set_priority(self, priority):
+        self.scheduler.set_priority(self, priority)
+
+    def release(self):
+        self.scheduler.unregister(self)
+
+
+class BandwidthScheduler:
+    """Общий для всех загрузок ограничитель скорости.
+
+    Общий лимит делится между активными загрузками пропорционально
+    приоритету; то, что загрузка не может использовать (ее ограничивает
+    сервер), перераспределяется между остальными.
+    """
+
+    def __init__(self, limit_mb=0, profiles=(), clock=time.monotonic):
+        self.clock = clock
+        self.base_limit_mb = limit_mb
+        self.profiles = list(profiles)
+        self.shares = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._allocated_at = None
+        self.limit = self._current_limit()
+
+    def _current_limit(self):
+        limit_mb = profile_limit(self.profiles)
+        if limit_mb is None:
+            limit_mb = self.base_limit_mb
+        return limit_mb * 1024**2 if limit_mb and limit_mb > 0 else None
+
+    def configure(self, limit_mb=None, profiles=None):
+        with self._lock:
+            if limit_mb is not None:
+                self.base_limit_mb = limit_mb
+            if profiles is not None:
+                self.profiles = list(profiles)
+            self._allocate(self.clock())
+
+    def register(self, priority=PRIORITY_NORMAL, name=""):
+        with self._lock:
+            share = BandwidthShare(self, next(self._ids), priority, name)
+            self.shares[share.id] = share
+            self._allocate(self.clock())
+            return share
+
+    def unregister(self, share):
+        with self._lock:
+            if self.shares.pop(share.id, None) is not None:
+                self._allocate(self.clock())
+
+    def set_priority(self, share, priority):
+        with self._lock:
+            share.priority = priority
+            self._allocate(self.clock())
+
+    def consume(self, share, nbytes):
+        with self._lock:
+            now = self.clock()
+            self._measure(share, now, nbytes)
+            if (
+                self._allocated_at is None
+                or now - self._allocated_at >= REALLOCATE_INTERVAL
+            ):
+                self._allocate(now)
+                for other in self.shares.values():
+                    other._throttled = False
+            rate = share.allocated
+            if rate is None:
+                return 0.0
+            share._tokens = min(
+                share._tokens + (now - share._updated) * rate, rate * BURST_SECONDS
+            )
+            share._updated = now
+            share._tokens -= nbytes
+            if share._tokens >= 0:
+                return 0.0
+            share._throttled = True
+            return min(-share._tokens / rate, MAX_SLEEP)
+
+    def _measure(self, share, now, nbytes):
+        share._counted += nbytes
+        last_time, last_counted = share._rate_sample
+        dt = now - last_time
+        if dt < 0.2:
+            return
+        sample = (share._counted - last_counted) / dt
+        alpha = min(dt / RATE_TIME_CONSTANT, 1.0)
+        share.rate += alpha * (sample - share.rate)
+        share._rate_sample = (now, share._counted)
+
+    def _allocate(self, now):
+        # Взвешенное распределение max-min: загрузки, которым хватает меньше
+        # их доли, получают столько, сколько используют, остальные делят остаток
+        self._allocated_at = now
+        self.limit = self._current_limit()
+        shares = list(self.shares.values())
+        if self.limit is None:
+            for share in shares:
+                share.allocated = None
+            return
+        demand = {}
+        for share in shares:
+            if share._throttled or not share.allocated:
+                demand[share.id] = float("inf")
+            else:
+                demand[share.id] = max(share.rate * DEMAND_HEADROOM, 64 * 1024)
+        remaining = self.limit
+        pending = shares
+        while pending:
+            weight = sum(share.priority for share in pending)
+            satisfied = [
+                share
+                for share in pending
+                if demand[share.id] <= remaining * share.priority / weight
+            ]
+            if not satisfied:
+                for share in pending:
+                    share.allocated = remaining * share.priority / weight
+                break
+            for share in satisfied:
+                share.allocated = demand[share.id]
+                remaining -= share.allocated
+            pending = [share for share in pending if share not in satisfied]
+
+    def snapshot(self):
+        """Текущее распределение для отображения в интерфейсе"""
+        with self._lock:
+            return {
+                "limit": self.limit,
+                "profile": profile_limit(self.profiles) is not None,
+                "shares": {
+                    share.id: (share.allocated, share.rate)
+                    for share in self.shares.values()
+                },
+            }
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_bandwidth_scheduler():
+    """Возвращает общий планировщик полосы, настроенный из настроек"""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            settings = get_settings()
+            _scheduler = BandwidthScheduler(
+                settings.get("bandwidth_limit_mb", 0),
+                settings.get("bandwidth_profiles", []),
+            )
+
+            def on_setting_changed(key, value):
+                if key == "bandwidth_limit_mb":
+                    _scheduler.configure(limit_mb=value)
+                elif key == "bandwidth_profiles":
+                    _scheduler.configure(profiles=value)
+
+            settings.subscribe(on_setting_changed)
+        return _scheduler
@@ -0,0 +1,372 @@
+import os
+from collections import deque
+
+from PySide6.QtCore import QObject, Signal
+from PySide6.QtGui import QIcon
+from PySide6.QtWidgets import (
+    QAbstractItemView,
+    QComboBox,
+    QDialog,
+    QFileDialog,
+    QHBoxLayout,
+    QHeaderView,
+    QLabel,
+    QMessageBox,
+    QPlainTextEdit,
+    QPushButton,
+    QTableWidget,
+    QTableWidgetItem,
+    QVBoxLayout,
+)
+
+from bandwidth import PRIORITY_LOW, PRIORITY_NORMAL
+from loading import VideoInfoWorker
+from playlist import PLAYLIST_FORMATS, format_duration
+from utils import get_settings, parse_urls
+
+ICON_PATH = "app.ico"
+# Сколько ссылок обрабатывать одновременно
+DEFAULT_PREFETCH_WORKERS = 4
+
+ROW_WAITING = "waiting"
+ROW_READY = "ready"
+ROW_PLAYLIST = "playlist"
+ROW_ERROR = "error"
+ROW_QUEUED = "queued"
+
+
+class PrefetchPool(QObject):
+    """Получает информацию о многих ссылках параллельно.
+
+    Одновременно работает не больше workers потоков VideoInfoWorker;
+    результаты приходят сигналами по мере готовности, в любом порядке.
+    """
+
+    resolved = Signal(str, object, str)  # url, info, error
+    # Для плейлиста вместо resolved: заголовок, страницы записей и окончание
+    playlist_found = Signal(str, object)  # url, info плейлиста без записей
+    entries_found = Signal(str, list)  # url, страница записей
+    playlist_finished = Signal(str, str)  # url, error
+
+    def __init__(self, workers=DEFAULT_PREFETCH_WORKERS, parent=None):
+        super().__init__(parent)
+        self.workers = max(1, workers)
+        self.pending = deque()
+        self.active = []
+        # Потоки, которые уже сообщили результат, но еще не завершились
+        self._finishing = []
+
+    def add(self, urls):
+        self.pending.extend(urls)
+        self._fill()
+
+    def cancel(self):
+        """Отменяет все ссылки и возвращает потоки, которые еще работают"""
+        self.pending.clear()
+        for worker in self.active:
+            worker.cancel()
+        self._finishing.extend(self.active)
+        self.active = []
+        self._finishing = [w for w in self._finishing if w.isRunning()]
+        return list(self._finishing)
+
+    def _fill(self):
+        self._finishing = [w for w in self._finishing if w.isRunning()]
+        while self.pending and len(self.active) < self.workers:
+            worker = VideoInfoWorker(self.pending.popleft())
+            # Слоты - методы пула, поэтому вызываются в потоке GUI
+            worker.finished.connect(self._on_finished)
+            worker.playlist_found.connect(self._on_playlist_found)
+            worker.entries_found.connect(self._on_entries_found)
+            worker.playlist_finished.connect(self._on_playlist_finished)
+            self.active.append(worker)
+            worker.start()
+
+    def _release(self, worker):
+        self.active.remove(worker)
+        self._finishing.append(worker)
+        self._fill()
+
+    def _active_sender(self):
+        # Сигналы отмененных потоков уже никому не нужны
+        worker = self.sender()
+        return worker if worker in self.active else None
+
+    def _on_finished(self, info, error):
+        worker = self._active_sender()
+        if worker is None:
+            return
+        self._release(worker)
+        self.resolved.emit(worker.url, info, error or "")
+
+    def _on_playlist_found(self, info):
+        worker = self._active_sender()
+        if worker is not None:
+            self.playlist_found.emit(worker.url, info)
+
+    def _on_entries_found(self, entries):
+        worker = self._active_sender()
+        if worker is not None:
+            self.entries_found.emit(worker.url, entries)
+
+    def _on_playlist_finished(self, error):
+        worker = self._active_sender()
+        if worker is None:
+            return
+        self._release(worker)
+        self.playlist_finished.emit(worker.url, error)
+
+
+class BatchRow:
+    def __init__(self, url):
+        self.url = url
+        self.title = url
+        self.status = ROW_WAITING
+        self.info = None
+        self.entries = []
+        self.error = ""
+
+
+class BatchDialog(QDialog):
+    """Список ссылок, информация о которых загружается параллельно.
+
+    Строки заполняются по мере готовности; готовые видео и плейлисты
+    добавляются в очередь загрузок вместе с уже полученной информацией.
+    """
+
+    entries_selected = Signal(list, object)  # записи, формат
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.settings = get_settings()
+        size = self.settings.get("batch_dialog_size")
+        if size:
+            self.resize(size[0], size[1])
+        self.setWindowTitle("Список ссылок")
+        self.setMinimumSize(640, 460)
+        if os.path.exists(ICON_PATH):
+            self.setWindowIcon(QIcon(ICON_PATH))
+        self.rows = []
+        self.row_by_url = {}
+        self.pool = PrefetchPool(
+            self.settings.get("prefetch_workers", DEFAULT_PREFETCH_WORKERS), self
+        )
+        self.pool.resolved.connect(self.on_resolved)
+        self.pool.playlist_found.connect(self.on_playlist_found)
+        self.pool.entries_found.connect(self.on_entries_found)
+        self.pool.playlist_finished.connect(self.on_playlist_finished)
+        self.setup_ui()
+        self.update_status()
+
+    def setup_ui(self):
+        layout = QVBoxLayout(self)
+        self.links_edit = QPlainTextEdit()
+        self.links_edit.setPlaceholderText("Вставьте ссылки, по одной в строке")
+        self.links_edit.setMaximumHeight(90)
+        layout.addWidget(self.links_edit)
+
+        input_layout = QHBoxLayout()
+        add_button = QPushButton("Добавить ссылки")
+        add_button.clicked.connect(self.add_from_text)
+        input_layout.addWidget(add_button)
+        file_button = QPushButton("Из файла…")
+        file_button.clicked.connect(self.add_from_file)
+        input_layout.addWidget(file_button)
+        input_layout.addStretch(1)
+        clear_button = QPushButton("Очистить")
+        clear_button.clicked.connect(self.clear)
+        input_layout.addWidget(clear_button)
+        layout.addLayout(input_layout)
+
+        self.table = QTableWidget(0, 3)
+        self.table.setHorizontalHeaderLabels(["Название", "Длительность", "Статус"])
+        self.table.setSelectionBehavior(QAbstractItemView.SelectionBehavior.SelectRows)
+        self.table.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+        self.table.verticalHeader().setVisible(False)
+        header = self.table.horizontalHeader()
+        header.setSectionResizeMode(0, QHeaderView.ResizeMode.Stretch)
+        header.setSectionResizeMode(1, QHeaderView.ResizeMode.ResizeToContents)
+        header.setSectionResizeMode(2, QHeaderView.ResizeMode.ResizeToContents)
+        layout.addWidget(self.table)
+
+        self.status_label = QLabel()
+        self.status_label.setObjectName("StatusLabel")
+        layout.addWidget(self.status_label)
+
+        button_layout = QHBoxLayout()
+        button_layout.addWidget(QLabel("Формат:"))
+        self.format_combo = QComboBox()
+        for text, format_id in PLAYLIST_FORMATS:
+            self.format_combo.addItem(text, format_id)
+        button_layout.addWidget(self.format_combo)
+        button_layout.addStretch(1)
+        self.queue_button = QPushButton("Добавить в очередь")
+        self.queue_button.clicked.connect(self.accept_ready)
+        button_layout.addWidget(self.queue_button)
+        close_button = QPushButton("Закрыть")
+        close_button.clicked.connect(self.close)
+        button_layout.addWidget(close_button)
+        layout.addLayout(button_layout)
+
+    def add_urls(self, urls):
+        """Добавляет новые ссылки в список и ставит их на получение информации"""
+        urls = [url for url in urls if url not in self.row_by_url]
+        if not urls:
+            return
+        self.table.setUpdatesEnabled(False)
+        for url in urls:
+            row = BatchRow(url)
+            self.row_by_url[url] = len(self.rows)
+            self.rows.append(row)
+            self.table.insertRow(self.table.rowCount())
+            self.update_row(row)
+        self.table.setUpdatesEnabled(True)
+        self.pool.add(urls)
+        self.update_status()
+
+    def add_from_text(self):
+        self.add_urls(parse_urls(self.links_edit.toPlainText()))
+        self.links_edit.clear()
+
+    def add_from_file(self):
+        path, _ = QFileDialog.getOpenFileName(
+            self,
+            "Файл со ссылками",
+            "",
+            "Текстовые файлы (*.txt);;Все файлы (*)",
+        )
+        if not path:
+            return
+        try:
+            with open(path, encoding="utf-8") as f:
+                self.add_urls(parse_urls(f.read()))
+        except (OSError, UnicodeDecodeError) as e:
+            QMessageBox.critical(self, "Ошибка", f"Не удалось прочитать файл:\n{e}")
+
+    def clear(self):
+        self.pool.cancel()
+        self.rows = []
+        self.row_by_url = {}
+        self.table.setRowCount(0)
+        self.update_status()
+
+    def row_for(self, url):
+        index = self.row_by_url.get(url)
+        return self.rows[index] if index is not None else None
+
+    def on_resolved(self, url, info, error):
+        row = self.row_for(url)
+        if row is None:
+            return
+        if error or not info:
+            row.status = ROW_ERROR
+            row.error = error or "Не удалось получить информацию о видео"
+        else:
+            row.status = ROW_READY
+            row.info = info
+            row.title = info.get("title") or url
+        self.update_row(row)
+        self.update_status()
+
+    def on_playlist_found(self, url, info):
+        row = self.row_for(url)
+        if row is not None:
+            row.status = ROW_PLAYLIST
+            row.title = info.get("title") or info.get("id") or url
+            self.update_row(row)
+
+    def on_entries_found(self, url, entries):
+        row = self.row_for(url)
+        if row is not None:
+            row.entries.extend(entries)
+            self.update_row(row)
+
+    def on_playlist_finished(self, url, error):
+        row = self.row_for(url)
+        if row is None:
+            return
+        if error and not row.entries:
+            row.status = ROW_ERROR
+            row.error = error
+        else:
+            row.status = ROW_READY
+        self.update_row(row)
+        self.update_status()
+
+    def status_text(self, row):
+        if row.status == ROW_WAITING:
+            return "Ожидание"
+        if row.status == ROW_ERROR:
+            return f"Ошибка: {row.error}"
+        if row.status == ROW_QUEUED:
+            return "В очереди"
+        if row.status == ROW_PLAYLIST:
+            return f"Плейлист: {len(row.entries)}…"
+        if row.entries:
+            return f"Плейлист: {len(row.entries)}"
+        return "Готово"
+
+    def update_row(self, row):
+        index = self.row_by_url[row.url]
+        title_item = QTableWidgetItem(row.title)
+        title_item.setToolTip(row.url)
+        self.table.setItem(index, 0, title_item)
+        duration = (row.info or {}).get("duration")
+        self.table.setItem(index, 1, QTableWidgetItem(format_duration(duration)))
+        status_item = QTableWidgetItem(self.status_text(row))
+        if row.error:
+            status_item.setToolTip(row.error)
+        self.table.setItem(index, 2, status_item)
+
+    def update_status(self):
+        counts = {}
+        for row in self.rows:
+            counts[row.status] = counts.get(row.status, 0) + 1
+        waiting = counts.get(ROW_WAITING, 0) + counts.get(ROW_PLAYLIST, 0)
+        self.status_label.setText(
+            f"Ссылок: {len(self.rows)}, готово: {counts.get(ROW_READY, 0)}, "
+            f"ошибок: {counts.get(ROW_ERROR, 0)}, в работе: {waiting}, "
+            f"добавлено в очередь: {counts.get(ROW_QUEUED, 0)}"
+        )
+
+    def accept_ready(self):
+        ready = [row for row in self.rows if row.status == ROW_READY]
+        if not ready:
+            QMessageBox.warning(self, "Ошибка", "Нет готовых ссылок")
+            return
+        entries = []
+        for row in ready:
+            if row.entries:
+                # Видео плейлистов полностью извлекаются уже при загрузке
+                entries.extend(
+                    {
+                        "url": entry["url"],
+                        "title": entry["title"],
+                        "info": None,
+                        "priority": PRIORITY_LOW,
+                    }
+                    for entry in row.entries
+                )
+            else:
+                entries.append(
+                    {
+                        "url": row.url,
+                        "title": row.title,
+                        "info": row.info,
+                        "priority": PRIORITY_NORMAL,
+                    }
+                )
+            row.status = ROW_QUEUED
+            self.update_row(row)
+        self.update_status()
+        format_id = self.format_combo.currentData()
+        selected_format = {"format_id": format_id} if format_id else None
+        self.entries_selected.emit(entries, selected_format)
+
+    def closeEvent(self, event):
+        # Информация продолжает загружаться в фоне и будет в списке при повторном открытии
+        self.settings["batch_dialog_size"] = [
+            self.size().width(),
+            self.size().height(),
+        ]
+        super().closeEvent(event)
@@ -0,0 +1,419 @@
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+SCENARIOS = ("progressive", "segmented", "hls", "dash", "gui")
+CHUNK_SIZE = 64 * 1024
+# Байт на позиции p равен p % 256, поэтому любой диапазон - срез этого блока
+PATTERN = bytes(range(256)) * (CHUNK_SIZE // 256 + 1)
+DASH_INIT_SIZE = 1024
+# Длительность одного сегмента HLS/DASH в манифестах, секунды
+SEGMENT_DURATION = 4
+
+
+def segment_count(config):
+    return max(1, -(-config["size"] // config["segment_size"]))
+
+
+def segment_size(config, index):
+    return min(config["segment_size"], config["size"] - index * config["segment_size"])
+
+
+def hls_playlist(config):
+    lines = [
+        "#EXTM3U",
+        "#EXT-X-VERSION:3",
+        f"#EXT-X-TARGETDURATION:{SEGMENT_DURATION}",
+        "#EXT-X-MEDIA-SEQUENCE:0",
+    ]
+    for index in range(segment_count(config)):
+        lines += [f"#EXTINF:{SEGMENT_DURATION}.0,", f"seg{index}.ts"]
+    lines.append("#EXT-X-ENDLIST")
+    return "\n".join(lines) + "\n"
+
+
+def dash_manifest(config):
+    duration = segment_count(config) * SEGMENT_DURATION
+    bandwidth = config["segment_size"] * 8 // SEGMENT_DURATION
+    return f"""<?xml version="1.0" encoding="UTF-8"?>
+<MPD xmlns="urn:mpeg:dash:schema:mpd:2011" type="static" minBufferTime="PT2S"
+     mediaPresentationDuration="PT{duration}S"
+     profiles="urn:mpeg:dash:profile:isoff-live:2011">
+  <Period>
+    <AdaptationSet mimeType="video/mp4" segmentAlignment="true">
+      <Representation id="main" codecs="avc1.4d401f,mp4a.40.2"
+                      bandwidth="{bandwidth}" width="1280" height="720">
+        <SegmentTemplate timescale="1" duration="{SEGMENT_DURATION}"
+                         startNumber="0" initialization="init.mp4"
+                         media="seg$Number$.m4s"/>
+      </Representation>
+    </AdaptationSet>
+  </Period>
+</MPD>
+"""
+
+
+class MediaHandler(BaseHTTPRequestHandler):
+    """Отдает синтетические файлы и манифесты с заданной задержкой и скоростью.
+
+    /media.mp4 - один файл (с поддержкой Range), /hls/index.m3u8 и
+    /dash/manifest.mpd - те же данные, разбитые на сегменты.
+    """
+
+    protocol_version = "HTTP/1.1"
+    config = None  # задается в serve()
+
+    def log_message(self, format, *args):
+        pass
+
+    def handle(self):
+        try:
+            super().handle()
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # клиент закрыл соединение, например при отмене загрузки
+
+    def do_HEAD(self):
+        self.respond(head=True)
+
+    def do_GET(self):
+        self.respond()
+
+    def route(self, path):
+        """Возвращает (Content-Type, текст или размер синтетических данных)"""
+        config = self.config
+        if path == "/media.mp4":
+            return "video/mp4", config["size"]
+        if path == "/hls/index.m3u8":
+            return "application/vnd.apple.mpegurl", hls_playlist(config).encode()
+        if path == "/dash/manifest.mpd":
+            return "application/dash+xml", dash_manifest(config).encode()
+        if path == "/dash/init.mp4":
+            return "video/mp4", DASH_INIT_SIZE
+        for prefix, ext, content_type in (
+            ("/hls/seg", ".ts", "video/mp2t"),
+            ("/dash/seg", ".m4s", "video/iso.segment"),
+        ):
+            if path.startswith(prefix) and path.endswith(ext):
+                try:
+                    index = int(path[len(prefix) : -len(ext)])
+                except ValueError:
+                    return None
+                if 0 <= index < segment_count(config):
+                    return content_type, segment_size(config, index)
+        return None
+
+    def respond(self, head=False):
+        found = self.route(self.path.split("?", 1)[0])
+        if found is None:
+            self.send_error(404)
+            return
+        content_type, body = found
+        time.sleep(self.config["latency"])
+        size = body if isinstance(body, int) else len(body)
+        start, end = 0, size - 1
+        requested = self.headers.get("Range", "")
+        if requested.startswith("bytes=") and size:
+            first, _, last = requested[len("bytes=") :].partition("-")
+            if first:
+                start = int(first)
+                end = min(int(last), size - 1) if last else size - 1
+            else:
+                start = max(size - int(last), 0)
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        else:
+            self.send_response(200)
+        length = max(end - start + 1, 0)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(length))
+        self.send_header("Accept-Ranges", "bytes")
+        self.end_headers()
+        if head:
+            return
+        if isinstance(body, int):
+            self.send_pattern(start, length)
+        else:
+            self.wfile.write(body[start : end + 1])
+
+    def send_pattern(self, offset, length):
+        bandwidth = self.config["bandwidth"]
+        started = time.monotonic()
+        view = memoryview(PATTERN)
+        sent = 0
+        while sent < length:
+            position = (offset + sent) % 256
+            size = min(CHUNK_SIZE, length - sent)
+            self.wfile.write(view[position : position + size])
+            sent += size
+            if bandwidth:
+                # Скорость ограничивается на каждое соединение отдельно
+                delay = sent / bandwidth - (time.monotonic() - started)
+                if delay > 0:
+                    time.sleep(delay)
+
+
+def serve(config, port=0, ready=None):
+    handler = type("ConfiguredMediaHandler", (MediaHandler,), {"config": config})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    if ready is not None:
+        ready.put(server.server_address[1])
+    server.serve_forever()
+
+
+def start_server(config):
+    """Запускает сервер в отдельном процессе, чтобы его работа не входила в замеры"""
+    ready = multiprocessing.Queue()
+    process = multiprocessing.Process(
+        target=serve, args=(config, 0, ready), daemon=True
+    )
+    process.start()
+    port = ready.get(timeout=30)
+    return process, f"http://127.0.0.1:{port}"
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux сообщает килобайты, macOS - байты
+    return peak / 1024**2 if sys.platform == "darwin" else peak / 1024
+
+
+def folder_size(folder):
+    return sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, files in os.walk(folder)
+        for name in files
+    )
+
+
+def warm_up():
+    # Импорт yt-dlp и реестр экстракторов не должны попасть в первый замер
+    import yt_dlp
+    from yt_dlp.extractor import gen_extractor_classes
+
+    for _ in gen_extractor_classes():
+        pass
+    with yt_dlp.YoutubeDL({"quiet": True}):
+        pass
+
+
+def run_engine(url, folder, engine=None):
+    from engine import DownloadJob
+
+    signals = [0]
+
+    def on_progress(*args):
+        signals[0] += 1
+
+    job = DownloadJob(
+        url, folder, use_archive=False, on_progress=on_progress, engine=engine
+    )
+    if job.run() and job.postprocessing is not None:
+        # С ffmpeg HLS исправляется после скачивания; замер включает и это
+        job.wait_postprocess()
+    return job, signals[0]
+
+
+def run_gui(url, folder):
+    # Тот же путь, что в приложении: хук в потоке загрузки -> сигнал -> слот
+    # update_progress окна загрузки в потоке GUI
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from PySide6.QtCore import QEventLoop, QObject
+    from PySide6.QtWidgets import QApplication
+
+    from downloader import DownloadDialog, DownloadWorker
+
+    class SignalCounter(QObject):
+        count = 0
+
+        def on_progress(self, *args):
+            self.count += 1
+
+    app = QApplication.instance() or QApplication([])
+    worker = DownloadWorker(url, folder)
+    worker.job.use_archive = False
+    dialog = DownloadDialog(None, url, folder, None, worker=worker)
+    counter = SignalCounter()
+    worker.progress.connect(counter.on_progress)
+    loop = QEventLoop()
+    for signal in (worker.finished, worker.error, worker.cancelled):
+        signal.connect(loop.quit)
+    worker.start()
+    loop.exec()
+    worker.wait()
+    app.processEvents()
+    dialog.deleteLater()
+    return worker.job, counter.count
+
+
+def run_scenario(name, base_url, config):
+    url = {
+        "progressive": f"{base_url}/media.mp4",
+        "segmented": f"{base_url}/media.mp4",
+        "gui": f"{base_url}/media.mp4",
+        "hls": f"{base_url}/hls/index.m3u8",
+        "dash": f"{base_url}/dash/manifest.mpd",
+    }[name]
+    expected = config["size"] + (DASH_INIT_SIZE if name == "dash" else 0)
+    folder = tempfile.mkdtemp(prefix="vd-bench-")
+    try:
+        cpu = time.process_time()
+        started = time.perf_counter()
+        if name == "gui":
+            job, signals = run_gui(url, folder)
+        else:
+            # progressive всегда идет обычным загрузчиком yt-dlp для сравнения
+            engine = "segmented" if name == "segmented" else "yt-dlp"
+            job, signals = run_engine(url, folder, engine)
+        wall = time.perf_counter() - started
+        cpu = time.process_time() - cpu
+        size = folder_size(folder)
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+    metrics = job.metrics.as_dict()
+    return {
+        "scenario": name,
+        "ok": metrics["outcome"] == "done" and size == expected,
+        "size_mb": round(size / 1024**2, 2),
+        "seconds": round(wall, 3),
+        "mb_per_s": round(size / 1024**2 / wall, 2),
+        "cpu_per_gb": round(cpu / (size / 1024**3), 2) if size else None,
+        "progress_per_s": round(signals / wall, 1),
+        "hooks": job.reporter.updates,
+        "ttfb": metrics["phases"]["ttfb"],
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def summarize(runs):
+    """Медиана по повторам; RSS - максимум за весь процесс"""
+    summary = dict(runs[-1])
+    summary["ok"] = all(run["ok"] for run in runs)
+    for key in ("seconds", "mb_per_s", "cpu_per_gb", "progress_per_s", "ttfb"):
+        values = [run[key] for run in runs if run[key] is not None]
+        summary[key] = round(statistics.median(values), 3) if values else None
+    return summary
+
+
+def print_table(results):
+    header = (
+        f"{'Сценарий':<12} {'МБ/с':>8} {'CPU с/ГБ':>9} {'Сигн./с':>8} "
+        f"{'TTFB, с':>8} {'RSS, МБ':>8}  Проверка"
+    )
+    print(header)
+    for r in results:
+        rss = f"{r['peak_rss_mb']:.0f}" if r["peak_rss_mb"] is not None else "-"
+        ttfb = f"{r['ttfb']:.3f}" if r["ttfb"] is not None else "-"
+        cpu = f"{r['cpu_per_gb']:.2f}" if r["cpu_per_gb"] is not None else "-"
+        print(
+            f"{r['scenario']:<12} {r['mb_per_s']:>8.2f} {cpu:>9} "
+            f"{r['progress_per_s']:>8.1f} {ttfb:>8} {rss:>8}  "
+            f"{'ok' if r['ok'] else 'ОШИБКА'}"
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Замеры скорости загрузки и накладных расходов интерфейса "
+        "на локальном сервере с синтетическими файлами, без доступа к сети."
+    )
+    parser.add_argument(
+        "scenarios",
+        nargs="*",
+        choices=[[], *SCENARIOS],
+        help=f"сценарии ({', '.join(SCENARIOS)}); по умолчанию все",
+    )
+    parser.add_argument(
+        "--size", type=float, default=100, metavar="MB", help="размер файла, МБ"
+    )
+    parser.add_argument(
+        "--segment-size",
+        type=float,
+        default=1,
+        metavar="MB",
+        help="размер сегмента HLS/DASH, МБ",
+    )
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0,
+        metavar="MS",
+        help="задержка перед ответом на каждый запрос, мс",
+    )
+    parser.add_argument(
+        "--bandwidth",
+        type=float,
+        default=0,
+        metavar="MB",
+        help="скорость отдачи на соединение, МБ/с (0 - без ограничения)",
+    )
+    parser.add_argument(
+        "-n", "--repeat", type=int, default=1, help="число повторов каждого сценария"
+    )
+    parser.add_argument(
+        "--json", action="store_true", help="выводить результаты строками JSON"
+    )
+    parser.add_argument(
+        "--serve",
+        type=int,
+        metavar="PORT",
+        help="только запустить сервер на заданном порту (для ручной проверки)",
+    )
+    args = parser.parse_args(argv)
+    config = {
+        "size": int(args.size * 1024**2),
+        "segment_size": max(int(args.segment_size * 1024**2), 1),
+        "latency": args.latency / 1000,
+        "bandwidth": args.bandwidth * 1024**2,
+    }
+    if args.serve is not None:
+        print(
+            f"Сервер: http://127.0.0.1:{args.serve}/media.mp4, /hls/index.m3u8, "
+            "/dash/manifest.mpd"
+        )
+        serve(config, args.serve)
+        return 0
+
+    from bandwidth import get_bandwidth_scheduler
+    from metrics import get_metrics_recorder
+
+    # Замеры не должны зависеть от лимита скорости и попадать в журнал загрузок
+    get_bandwidth_scheduler().configure(limit_mb=0, profiles=[])
+    get_metrics_recorder().configure(path="", prometheus_path="")
+
+    warm_up()
+    process, base_url = start_server(config)
+    results = []
+    try:
+        for name in args.scenarios or SCENARIOS:
+            runs = [
+                run_scenario(name, base_url, config) for _ in range(max(1, args.repeat))
+            ]
+            result = summarize(runs)
+            results.append(result)
+            if args.json:
+                print(json.dumps(result, ensure_ascii=False), flush=True)
+    finally:
+        process.terminate()
+        process.join()
+    if not args.json:
+        print_table(results)
+    return 0 if all(result["ok"] for result in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
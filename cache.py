@@ -0,0 +1,169 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+from utils import MEDIA_URL_MAX_AGE, PLAYLIST_TYPES, get_settings, user_cache_dir
+
+CACHE_FILE = "metadata.sqlite3"
+DEFAULT_TTL = 24 * 60 * 60
+DEFAULT_MAX_MB = 100
+# Сколько секунд ждать, пока базу держит другой процесс (демон, очередь заданий)
+BUSY_TIMEOUT = 5
+
+
+class MetadataCache:
+    """Кэш результатов extract_info на диске с TTL и вытеснением LRU.
+
+    Записи хранятся по ключу (extractor, id); любой URL, по которому
+    было получено видео, ссылается на эту запись. Плейлисты не кэшируются:
+    их записи перечисляются лениво при каждом открытии.
+    """
+
+    def __init__(
+        self, path, ttl=DEFAULT_TTL, max_bytes=DEFAULT_MAX_MB * 1024**2, media_ttl=None
+    ):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        # Отдельный короткий срок для подписанных ссылок на медиа
+        self.media_ttl = media_ttl if media_ttl is not None else MEDIA_URL_MAX_AGE
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            path, timeout=BUSY_TIMEOUT, check_same_thread=False
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                extractor TEXT NOT NULL,
+                video_id TEXT NOT NULL,
+                data BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                created REAL NOT NULL,
+                accessed REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed);
+            CREATE TABLE IF NOT EXISTS urls (
+                url TEXT PRIMARY KEY,
+                key TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS urls_key ON urls (key);
+            """
+        )
+
+    def get(self, url):
+        """Возвращает info для URL или None, если записи нет или она устарела"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT e.key, e.data, e.created FROM urls u "
+                "JOIN entries e ON e.key = u.key WHERE u.url = ?",
+                (url,),
+            ).fetchone()
+            if row is None or now - row[2] > self.ttl:
+                self.misses += 1
+                return None
+            self._conn.execute(
+                "UPDATE entries SET accessed = ? WHERE key = ?", (now, row[0])
+            )
+            self._conn.commit()
+            self.hits += 1
+        info = json.loads(zlib.decompress(row[1]))
+        # Такие записи могли остаться от прежних версий
+        if info.get("_type") in PLAYLIST_TYPES:
+            return None
+        return info
+
+    def put(self, url, info):
+        """Сохраняет info под ключом (extractor, id) и привязывает к нему URL"""
+        if info.get("_type") in PLAYLIST_TYPES:
+            return
+        extractor = info.get("extractor_key") or info.get("extractor")
+        video_id = info.get("id")
+        if not extractor or not video_id:
+            return
+        import yt_dlp
+
+        key = f"{extractor}:{video_id}"
+        data = zlib.compress(
+            json.dumps(
+                yt_dlp.YoutubeDL.sanitize_info(info), ensure_ascii=False, default=str
+            ).encode("utf-8")
+        )
+        now = time.time()
+        aliases = {url, info.get("webpage_url"), info.get("original_url")}
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries "
+                "(key, extractor, video_id, data, size, created, accessed) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, extractor, video_id, data, len(data), now, now),
+            )
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO urls (url, key) VALUES (?, ?)",
+                [(alias, key) for alias in aliases if alias],
+            )
+            self._evict(now)
+            self._conn.commit()
+
+    def _evict(self, now):
+        self._conn.execute("DELETE FROM entries WHERE created < ?", (now - self.ttl,))
+        total = self._conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM entries"
+        ).fetchone()[0]
+        if total > self.max_bytes:
+            # Удаляем самые давно использованные записи, пока не уложимся в лимит
+            for key, size in self._conn.execute(
+                "SELECT key, size FROM entries ORDER BY accessed"
+            ).fetchall():
+                self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                total -= size
+                if total <= self.max_bytes:
+                    break
+        self._conn.execute(
+            "DELETE FROM urls WHERE key NOT IN (SELECT key FROM entries)"
+        )
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM entries")
+            self._conn.execute("DELETE FROM urls")
+            self._conn.commit()
+
+    def stats(self):
+        with self._lock:
+            entries, size = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries"
+            ).fetchone()
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": entries,
+            "size": size,
+        }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_metadata_cache():
+    """Возвращает общий для приложения кэш метаданных"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            settings = get_settings()
+            _cache = MetadataCache(
+                os.path.join(user_cache_dir(), CACHE_FILE),
+                ttl=settings.get("metadata_cache_ttl", DEFAULT_TTL),
+                max_bytes=settings.get("metadata_cache_max_mb", DEFAULT_MAX_MB)
+                * 1024**2,
+                media_ttl=settings.get("media_url_ttl", MEDIA_URL_MAX_AGE),
+            )
+        return _cache
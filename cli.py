@@ -0,0 +1,269 @@
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from archive import get_download_archive
+from bandwidth import PRIORITY_NAMES, get_bandwidth_scheduler
+from engine import DownloadJob
+from logs import LOG_LEVELS
+from metrics import get_metrics_recorder
+from postprocess import shutdown_postprocess_pool
+from segmented import ENGINES
+from sessions import close_session_pool
+from utils import get_settings, parse_urls
+
+DEFAULT_JOBS = 2
+
+
+def read_urls(source):
+    """Читает ссылки из файла или stdin (-) так же, как окно пакетной загрузки"""
+    if source == "-":
+        return parse_urls(sys.stdin.read())
+    with open(source, encoding="utf-8") as f:
+        return parse_urls(f.read())
+
+
+class EventPrinter:
+    """Печатает события загрузок построчно в формате JSON"""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self._lock = threading.Lock()
+
+    def emit(self, event, **fields):
+        line = json.dumps({"event": event, **fields}, ensure_ascii=False)
+        with self._lock:
+            self.stream.write(line + "\n")
+            self.stream.flush()
+
+
+def run_job(job_id, job, printer):
+    printer.emit("start", job=job_id, url=job.url)
+    try:
+        if job.run():
+            if job.skipped:
+                printer.emit(
+                    "archived", job=job_id, url=job.url, path=job.archived_path
+                )
+                return "archived"
+            if job.postprocessing is not None:
+                # Слот свободен для следующей ссылки, обработку дождется main()
+                printer.emit("downloaded", job=job_id, url=job.url)
+                return "processing"
+            printer.emit("done", job=job_id, url=job.url)
+            return "done"
+        printer.emit("cancelled", job=job_id, url=job.url)
+        return "cancelled"
+    except Exception as e:
+        return job_failed(job_id, job, printer, e)
+
+
+def finish_job(job_id, job, printer):
+    """Дожидается обработки файла, скачанного run_job"""
+    try:
+        if job.wait_postprocess():
+            printer.emit("done", job=job_id, url=job.url)
+            return "done"
+        printer.emit("cancelled", job=job_id, url=job.url)
+        return "cancelled"
+    except Exception as e:
+        return job_failed(job_id, job, printer, e)
+
+
+def job_failed(job_id, job, printer, error):
+    if job.is_cancelled:
+        printer.emit("cancelled", job=job_id, url=job.url)
+        return "cancelled"
+    printer.emit("error", job=job_id, url=job.url, message=str(error))
+    return "error"
+
+
+def make_job(job_id, url, args, printer):
+    def on_progress(percent, text, downloaded_bytes, total_bytes):
+        printer.emit(
+            "progress",
+            job=job_id,
+            percent=percent,
+            downloaded=downloaded_bytes,
+            total=total_bytes,
+            speed=job.reporter.speed,
+            eta=job.reporter.eta,
+        )
+
+    def on_log(message, log_type):
+        printer.emit("log", job=job_id, level=log_type, message=message)
+
+    def on_file(path):
+        printer.emit("file", job=job_id, path=path)
+
+    job = DownloadJob(
+        url,
+        args.output,
+        args.format,
+        on_progress=on_progress,
+        on_log=on_log,
+        on_file=on_file,
+        use_archive=not args.no_archive,
+        priority=PRIORITY_NAMES[args.priority],
+        max_height=args.max_height,
+        max_size=args.max_size * 1024**2 if args.max_size else None,
+        # Без -v выводятся только ошибки, остальное отбрасывается до форматирования
+        log_level=args.log_level or ("debug" if args.verbose else "error"),
+        engine=args.engine,
+    )
+    return job
+
+
+def main(argv=None):
+    settings = get_settings()
+    parser = argparse.ArgumentParser(
+        description="Пакетная загрузка видео без графического интерфейса. "
+        "События выводятся в stdout построчно в формате JSON."
+    )
+    parser.add_argument(
+        "input",
+        nargs="?",
+        help="файл со ссылками (можно несколько в строке); - или пусто для stdin",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        default=settings.get("save_path", os.path.expanduser("~/Downloads")),
+        help="папка для сохранения",
+    )
+    parser.add_argument("-f", "--format", help="формат yt-dlp (по умолчанию best)")
+    parser.add_argument(
+        "--max-height",
+        type=int,
+        metavar="P",
+        help="лучший формат не выше заданной высоты, например 720",
+    )
+    parser.add_argument(
+        "--max-size",
+        type=float,
+        metavar="MB",
+        help="лучший формат, размер которого известен и не больше заданного, МБ",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=settings.get("download_slots", DEFAULT_JOBS),
+        help="число одновременных загрузок",
+    )
+    parser.add_argument(
+        "-v", "--verbose", action="store_true", help="выводить лог yt-dlp"
+    )
+    parser.add_argument(
+        "--log-level",
+        choices=LOG_LEVELS,
+        help="наименьший уровень событий log (по умолчанию error, с -v - debug)",
+    )
+    parser.add_argument(
+        "--limit",
+        type=float,
+        metavar="MB",
+        help="общий лимит скорости в МБ/с для этого запуска (0 - без ограничения)",
+    )
+    parser.add_argument(
+        "--engine",
+        choices=ENGINES,
+        help="загрузчик прямых файлов: yt-dlp или segmented - частями в несколько "
+        "соединений (по умолчанию из настройки download_engine)",
+    )
+    parser.add_argument(
+        "--priority",
+        choices=PRIORITY_NAMES,
+        default="normal",
+        help="приоритет загрузок при общем лимите скорости",
+    )
+    parser.add_argument(
+        "--no-archive",
+        action="store_true",
+        help="не пропускать видео из архива загрузок и не записывать их в него",
+    )
+    parser.add_argument(
+        "--import-archive",
+        action="append",
+        default=[],
+        metavar="PATH",
+        help="импортировать в архив файл --download-archive yt-dlp "
+        "или папку с .info.json; можно указать несколько раз",
+    )
+    parser.add_argument(
+        "--metrics",
+        metavar="FILE",
+        help="файл JSON lines для замеров фаз каждой загрузки "
+        "(по умолчанию из настроек; пустая строка - не записывать)",
+    )
+    parser.add_argument(
+        "--prometheus",
+        metavar="FILE",
+        help="текстовый файл метрик Prometheus, обновляется после каждой загрузки",
+    )
+    args = parser.parse_args(argv)
+
+    printer = EventPrinter(sys.stdout)
+    if args.import_archive:
+        archive = get_download_archive(required=True)
+        for path in args.import_archive:
+            printer.emit("imported", path=path, added=archive.import_path(path))
+        # Только импорт, если ссылки не переданы явно
+        if args.input is None:
+            return 0
+
+    if args.limit is not None:
+        # Только для этого процесса, настройки приложения не меняются
+        get_bandwidth_scheduler().configure(limit_mb=args.limit, profiles=[])
+
+    if args.metrics is not None or args.prometheus is not None:
+        get_metrics_recorder().configure(args.metrics, args.prometheus)
+
+    urls = read_urls(args.input or "-")
+    os.makedirs(args.output, exist_ok=True)
+    jobs = [make_job(i, url, args, printer) for i, url in enumerate(urls, 1)]
+    results = []
+    futures = []
+    executor = ThreadPoolExecutor(max_workers=max(1, args.jobs))
+    try:
+        futures = [
+            executor.submit(run_job, i, job, printer) for i, job in enumerate(jobs, 1)
+        ]
+        # Обработка в пуле идет параллельно, здесь только ждем ее по порядку
+        for job_id, (job, future) in enumerate(zip(jobs, futures), 1):
+            status = future.result()
+            if status == "processing":
+                status = finish_job(job_id, job, printer)
+            results.append(status)
+    except KeyboardInterrupt:
+        # Недокачанные файлы остаются: повторный запуск продолжит их
+        for job in jobs:
+            job.cancel(keep_partial=True)
+        executor.shutdown(wait=True, cancel_futures=True)
+        # Необработанные файлы считаем отмененными: их дорожки остались на диске
+        results = [
+            "cancelled" if future.result() == "processing" else future.result()
+            for future in futures
+            if future.done() and not future.cancelled()
+        ]
+    finally:
+        executor.shutdown(wait=True)
+        shutdown_postprocess_pool()
+        close_session_pool()
+    summary = {
+        status: results.count(status)
+        for status in ("done", "archived", "error", "cancelled")
+    }
+    summary["skipped"] = len(jobs) - len(results)
+    printer.emit("summary", **summary)
+    return 0 if summary["done"] + summary["archived"] == len(jobs) else 1
+
+
+if __name__ == "__main__":
+    # Пул обработки запускает процессы, в том числе из собранного exe
+    multiprocessing.freeze_support()
+    sys.exit(main())
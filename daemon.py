@@ -0,0 +1,909 @@
+import argparse
+import hmac
+import itertools
+import json
+import multiprocessing
+import os
+import queue
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from bandwidth import PRIORITY_NAMES, get_bandwidth_scheduler
+from engine import DownloadJob
+from logs import LOG_LEVELS
+from postprocess import shutdown_postprocess_pool
+from segmented import ENGINES
+from sessions import close_session_pool
+from utils import get_settings
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8770
+DEFAULT_SLOTS = 2
+API_VERSION = 1
+# Сколько строк лога хранить для каждой загрузки
+JOB_LOG_LIMIT = 500
+# Больше запрос с сотней ссылок не бывает
+MAX_BODY = 1024**2
+# Сколько событий может ждать отправки медленному подписчику, прежде чем
+# его поток событий будет закрыт
+SUBSCRIBER_QUEUE = 1000
+# Пустой комментарий SSE, чтобы прокси и клиенты не закрывали тихий поток
+KEEPALIVE_INTERVAL = 15
+# Сколько ждать загрузки при остановке демона, секунды
+SHUTDOWN_TIMEOUT = 10
+# Ответ на запрос клиента, секунды; поток событий ждет дольше keepalive
+CLIENT_TIMEOUT = 10
+EVENTS_TIMEOUT = KEEPALIVE_INTERVAL * 4
+LOOPBACK_HOSTS = ("127.0.0.1", "localhost", "::1", "[::1]")
+
+STATUS_QUEUED = "queued"
+STATUS_ACTIVE = "active"
+# Файл скачан и обрабатывается ffmpeg; слот загрузки уже свободен
+STATUS_PROCESSING = "processing"
+STATUS_PAUSED = "paused"
+STATUS_DONE = "done"
+STATUS_ERROR = "error"
+STATUS_CANCELLED = "cancelled"
+FINISHED_STATUSES = (STATUS_DONE, STATUS_ERROR, STATUS_CANCELLED)
+PRIORITY_KEYS = {priority: name for name, priority in PRIORITY_NAMES.items()}
+
+
+def daemon_url(settings=None):
+    """Адрес демона на этой машине по настройкам"""
+    settings = settings or get_settings()
+    return settings.get("daemon_url") or (
+        f"http://{DEFAULT_HOST}:{settings.get('daemon_port', DEFAULT_PORT)}"
+    )
+
+
+class DaemonJob:
+    """Загрузка в очереди демона.
+
+    Для каждого запуска (после паузы или ошибки) создается новый DownloadJob,
+    а состояние, которое видят клиенты, хранится здесь.
+    """
+
+    def __init__(self, job_id, request):
+        self.id = job_id
+        self.url = request["url"]
+        self.save_path = request["output"]
+        self.format_id = request.get("format")
+        self.engine = request.get("engine")
+        self.priority = request["priority"]
+        self.max_height = request.get("max_height")
+        self.max_size = request.get("max_size")
+        self.use_archive = request.get("archive", True)
+        self.title = request.get("title") or self.url
+        self.thumbnail = request.get("thumbnail")
+        self.status = STATUS_QUEUED
+        self.percent = 0
+        self.progress_text = ""
+        self.downloaded = 0
+        self.total = 0
+        self.speed = None
+        self.eta = None
+        self.filename = None
+        self.archived = False
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+        self.job = None
+        self.thread = None
+        self.log = deque(maxlen=JOB_LOG_LIMIT)
+
+    @property
+    def is_finished(self):
+        return self.status in FINISHED_STATUSES
+
+    def to_dict(self, log=False):
+        data = {
+            "id": self.id,
+            "url": self.url,
+            "title": self.title,
+            "thumbnail": self.thumbnail,
+            "output": self.save_path,
+            "format": self.format_id,
+            "engine": self.engine,
+            "priority": PRIORITY_KEYS.get(self.priority, "normal"),
+            "status": self.status,
+            "percent": self.percent,
+            "text": self.progress_text,
+            "downloaded": self.downloaded,
+            "total": self.total,
+            "speed": self.speed,
+            "eta": self.eta,
+            "file": self.filename,
+            "archived": self.archived,
+            "error": self.error,
+            "created": self.created,
+            "finished": self.finished,
+        }
+        if log:
+            data["log"] = [
+                {"level": level, "message": message} for message, level in self.log
+            ]
+        return data
+
+
+class Subscription:
+    def __init__(self):
+        self.queue = queue.Queue(SUBSCRIBER_QUEUE)
+        self.closed = False
+
+
+class EventHub:
+    """Рассылает события загрузок подписчикам потока /events"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = set()
+
+    def subscribe(self):
+        subscription = Subscription()
+        with self._lock:
+            self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def publish(self, event, **fields):
+        data = {"event": event, **fields}
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            try:
+                subscription.queue.put_nowait(data)
+            except queue.Full:
+                # Клиент не успевает читать: закрываем его поток, а не
+                # копим события в памяти; переподключившись, он получит снимок
+                subscription.closed = True
+                self.unsubscribe(subscription)
+
+
+class JobManager:
+    """Очередь загрузок демона с ограниченным числом одновременных слотов.
+
+    Работает так же, как очередь окна приложения, но без Qt: каждая загрузка
+    идет в своем потоке через DownloadJob, а изменения состояния
+    публикуются в EventHub под общей блокировкой, поэтому снимок для нового
+    подписчика и следующие за ним события согласованы.
+    """
+
+    def __init__(self, slots=DEFAULT_SLOTS, hub=None, save_path=None, log_level=None):
+        self.slots = max(1, slots)
+        self.hub = hub or EventHub()
+        self.save_path = save_path or get_settings().get(
+            "save_path", os.path.expanduser("~/Downloads")
+        )
+        self.log_level = log_level
+        self.jobs = {}
+        self.order = []
+        self._ids = itertools.count(1)
+        # Колбэки загрузки (лог при удалении .part) вызываются и под блокировкой
+        self._lock = threading.RLock()
+        self._closing = False
+        # Число потоков загрузок; последний завершившийся выставляет _idle
+        self._running = 0
+        self._idle = threading.Event()
+        self._idle.set()
+
+    def parse_request(self, data):
+        """Проверяет описание загрузки из запроса и дополняет значениями по умолчанию"""
+        if not isinstance(data, dict):
+            raise ValueError("Ожидается объект JSON")
+        url = data.get("url")
+        if not isinstance(url, str) or not url.strip():
+            raise ValueError("Не указана ссылка url")
+        request = {
+            "url": url.strip(),
+            "output": data.get("output") or self.save_path,
+            "format": data.get("format") or None,
+            "title": data.get("title"),
+            "thumbnail": data.get("thumbnail"),
+            "archive": bool(data.get("archive", True)),
+        }
+        if not isinstance(request["output"], str):
+            raise ValueError("output должен быть путем к папке")
+        priority = data.get("priority", "normal")
+        if not isinstance(priority, str) or priority not in PRIORITY_NAMES:
+            raise ValueError(f"Неизвестный приоритет: {priority}")
+        request["priority"] = PRIORITY_NAMES[priority]
+        engine = data.get("engine")
+        if engine is not None and (
+            not isinstance(engine, str) or engine not in ENGINES
+        ):
+            raise ValueError(f"Неизвестный загрузчик: {engine}")
+        request["engine"] = engine
+        try:
+            if data.get("max_height"):
+                request["max_height"] = int(data["max_height"])
+            if data.get("max_size"):
+                request["max_size"] = int(float(data["max_size"]) * 1024**2)
+        except (TypeError, ValueError):
+            raise ValueError("max_height и max_size должны быть числами") from None
+        return request
+
+    def submit(self, data):
+        """Ставит в очередь одну загрузку или несколько (ключ urls)"""
+        if isinstance(data, dict) and "urls" in data:
+            urls = data["urls"]
+            if not isinstance(urls, list) or not urls:
+                raise ValueError("urls должен быть непустым списком")
+            common = {k: v for k, v in data.items() if k != "urls"}
+            requests = [
+                self.parse_request(
+                    {**common, **(url if isinstance(url, dict) else {"url": url})}
+                )
+                for url in urls
+            ]
+        else:
+            requests = [self.parse_request(data)]
+        for request in requests:
+            try:
+                os.makedirs(request["output"], exist_ok=True)
+            except OSError as e:
+                raise ValueError(
+                    f"Не удалось создать папку {request['output']}: {e.strerror}"
+                ) from None
+        with self._lock:
+            if self._closing:
+                raise ValueError("Демон останавливается")
+            jobs = []
+            for request in requests:
+                record = DaemonJob(next(self._ids), request)
+                self.jobs[record.id] = record
+                self.order.append(record.id)
+                jobs.append(record)
+                self._publish_job(record)
+            self._schedule()
+            return [record.to_dict() for record in jobs]
+
+    def get(self, job_id, log=False):
+        with self._lock:
+            return self._record(job_id).to_dict(log)
+
+    def list(self):
+        with self._lock:
+            return [self.jobs[job_id].to_dict() for job_id in self.order]
+
+    def state(self):
+        with self._lock:
+            return self._state()
+
+    def subscribe(self):
+        """Подписка на события и снимок очереди на момент подписки"""
+        with self._lock:
+            return self.hub.subscribe(), self._state()
+
+    def stats(self):
+        with self._lock:
+            counts = {}
+            for record in self.jobs.values():
+                counts[record.status] = counts.get(record.status, 0) + 1
+            return {"slots": self.slots, "jobs": counts}
+
+    def pause(self, job_id):
+        with self._lock:
+            record = self._record(job_id)
+            if record.status == STATUS_ACTIVE:
+                # Поток завершится отменой; .part остается для продолжения
+                record.status = STATUS_PAUSED
+                record.job.cancel(keep_partial=True)
+            elif record.status == STATUS_QUEUED:
+                record.status = STATUS_PAUSED
+            self._publish_job(record)
+            return record.to_dict()
+
+    def resume(self, job_id):
+        with self._lock:
+            record = self._record(job_id)
+            running = record.thread is not None and record.thread.is_alive()
+            if (
+                record.status in (STATUS_PAUSED, STATUS_ERROR, STATUS_CANCELLED)
+                and not running
+            ):
+                record.status = STATUS_QUEUED
+                record.error = None
+                self._publish_job(record)
+                self._schedule()
+            return record.to_dict()
+
+    def cancel(self, job_id):
+        with self._lock:
+            record = self._record(job_id)
+            if record.is_finished:
+                return record.to_dict()
+            was_running = record.status in (STATUS_ACTIVE, STATUS_PROCESSING)
+            record.status = STATUS_CANCELLED
+            record.finished = time.time()
+            if was_running:
+                record.job.cancel()
+            elif record.job is not None and not record.thread.is_alive():
+                # Загрузка на паузе оставила недокачанные файлы
+                record.job.discard_partial()
+            self._publish_job(record)
+            self._schedule()
+            return record.to_dict()
+
+    def set_priority(self, job_id, priority):
+        if not isinstance(priority, str) or priority not in PRIORITY_NAMES:
+            raise ValueError(f"Неизвестный приоритет: {priority}")
+        with self._lock:
+            record = self._record(job_id)
+            record.priority = PRIORITY_NAMES[priority]
+            if record.job is not None and record.status == STATUS_ACTIVE:
+                record.job.set_priority(record.priority)
+            self._publish_job(record)
+            return record.to_dict()
+
+    def move(self, job_id, delta):
+        """Сдвигает загрузку в очереди на delta позиций"""
+        try:
+            delta = int(delta)
+        except (TypeError, ValueError):
+            raise ValueError("delta должно быть целым числом") from None
+        with self._lock:
+            self._record(job_id)
+            index = self.order.index(job_id)
+            new_index = min(max(index + delta, 0), len(self.order) - 1)
+            if new_index != index:
+                self.order.insert(new_index, self.order.pop(index))
+                self._publish_order()
+            return self.order.index(job_id)
+
+    def remove_finished(self):
+        with self._lock:
+            removed = [i for i in self.order if self.jobs[i].is_finished]
+            self.order = [i for i in self.order if not self.jobs[i].is_finished]
+            for job_id in removed:
+                del self.jobs[job_id]
+            if removed:
+                self._publish_order()
+            return removed
+
+    def set_slots(self, slots):
+        with self._lock:
+            self.slots = max(1, slots)
+            self._schedule()
+            self.hub.publish("config", slots=self.slots)
+
+    def shutdown(self, timeout=SHUTDOWN_TIMEOUT):
+        """Останавливает загрузки, оставляя .part для продолжения, и ждет потоки.
+
+        Возвращает True, если все потоки завершились за timeout.
+        """
+        with self._lock:
+            self._closing = True
+            for record in self.jobs.values():
+                if record.status in (STATUS_ACTIVE, STATUS_PROCESSING):
+                    record.job.cancel(keep_partial=True)
+        # Event.wait, а не Thread.join: join, прерванный Ctrl+C, в Python 3.11
+        # может счесть работающий поток завершенным. Ожидание идет короткими
+        # отрезками, чтобы Ctrl+C доходил и на Windows
+        deadline = time.monotonic() + timeout
+        while not self._idle.wait(min(max(deadline - time.monotonic(), 0), 0.5)):
+            if time.monotonic() >= deadline:
+                return False
+        return True
+
+    def _record(self, job_id):
+        record = self.jobs.get(job_id)
+        if record is None:
+            raise KeyError(job_id)
+        return record
+
+    def _state(self):
+        return {
+            "slots": self.slots,
+            "jobs": [self.jobs[job_id].to_dict() for job_id in self.order],
+        }
+
+    def _publish_job(self, record):
+        self.hub.publish("job", job=record.to_dict())
+
+    def _publish_order(self):
+        self.hub.publish("order", order=list(self.order))
+
+    def _schedule(self):
+        if self._closing:
+            return
+        free = self.slots - sum(
+            1 for record in self.jobs.values() if record.status == STATUS_ACTIVE
+        )
+        for job_id in self.order:
+            if free <= 0:
+                break
+            record = self.jobs[job_id]
+            if record.status == STATUS_QUEUED:
+                self._start(record)
+                free -= 1
+
+    def _start(self, record):
+        record.status = STATUS_ACTIVE
+        record.percent = 0
+        record.progress_text = ""
+        record.speed = None
+        record.eta = None
+        job = DownloadJob(
+            record.url,
+            record.save_path,
+            record.format_id,
+            on_progress=lambda *args: self._on_progress(record, job, *args),
+            on_log=lambda message, level: self._on_log(record, message, level),
+            on_file=lambda path: self._on_file(record, path),
+            use_archive=record.use_archive,
+            priority=record.priority,
+            max_height=record.max_height,
+            max_size=record.max_size,
+            log_level=self.log_level,
+            engine=record.engine,
+        )
+        record.job = job
+        self._running += 1
+        self._idle.clear()
+        record.thread = threading.Thread(
+            target=self._run, args=(record, job), daemon=True
+        )
+        self._publish_job(record)
+        record.thread.start()
+
+    def _run(self, record, job):
+        try:
+            self._run_job(record, job)
+        finally:
+            with self._lock:
+                self._running -= 1
+                if not self._running:
+                    self._idle.set()
+
+    def _run_job(self, record, job):
+        try:
+            done = job.run()
+            if done and job.postprocessing is not None:
+                self._processing(record)
+                done = job.wait_postprocess()
+            self._finish(record, STATUS_DONE if done else None)
+        except Exception as e:
+            if job.is_cancelled:
+                self._on_log(record, "Загрузка остановлена", "warning")
+                self._finish(record, None)
+            else:
+                self._on_log(record, f"Ошибка: {e}", "error")
+                self._finish(record, STATUS_ERROR, str(e))
+
+    def _processing(self, record):
+        with self._lock:
+            if record.status != STATUS_ACTIVE:
+                return
+            # Обработка не занимает слот: следующая загрузка начинается сразу
+            record.status = STATUS_PROCESSING
+            record.progress_text = "Обработка файла..."
+            self._publish_job(record)
+            self._schedule()
+
+    def _finish(self, record, status, error=None):
+        with self._lock:
+            # Пауза или отмена уже выставили нужный статус
+            if status is not None and record.status in (
+                STATUS_ACTIVE,
+                STATUS_PROCESSING,
+            ):
+                record.status = status
+                record.error = error
+            elif record.status in (STATUS_ACTIVE, STATUS_PROCESSING):
+                record.status = STATUS_CANCELLED
+            if record.status == STATUS_DONE:
+                record.percent = 100
+                record.archived = record.job.skipped
+                if record.job.skipped:
+                    record.filename = record.job.archived_path
+            if record.is_finished:
+                record.finished = time.time()
+            record.speed = None
+            record.eta = None
+            self._publish_job(record)
+            self._schedule()
+
+    def _on_progress(self, record, job, percent, text, downloaded, total):
+        with self._lock:
+            record.percent = percent
+            record.progress_text = text
+            record.downloaded = downloaded
+            record.total = total
+            record.speed = job.reporter.speed
+            record.eta = job.reporter.eta
+            self.hub.publish(
+                "progress",
+                job=record.id,
+                percent=percent,
+                text=text,
+                downloaded=downloaded,
+                total=total,
+                speed=record.speed,
+                eta=record.eta,
+            )
+
+    def _on_log(self, record, message, level):
+        with self._lock:
+            record.log.append((message, level))
+            self.hub.publish("log", job=record.id, level=level, message=message)
+
+    def _on_file(self, record, path):
+        with self._lock:
+            record.filename = path
+            self.hub.publish("file", job=record.id, path=path)
+
+
+class ApiHandler(BaseHTTPRequestHandler):
+    """HTTP API демона; manager и token задаются в serve()"""
+
+    manager = None
+    token = None
+    loopback = True
+    server_version = "VideoDownloaderDaemon/1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def do_DELETE(self):
+        self._dispatch("DELETE")
+
+    def _dispatch(self, method):
+        url = urlsplit(self.path)
+        self.query = parse_qs(url.query)
+        parts = [part for part in url.path.split("/") if part]
+        if not self._authorized():
+            return
+        try:
+            if method == "GET" and parts == ["health"]:
+                self._send_json(
+                    200,
+                    {
+                        "status": "ok",
+                        "version": API_VERSION,
+                        "pid": os.getpid(),
+                        **self.manager.stats(),
+                    },
+                )
+            elif method == "GET" and parts == ["events"]:
+                self._stream_events()
+            elif parts == ["jobs"]:
+                if method == "GET":
+                    self._send_json(200, {"jobs": self.manager.list()})
+                elif method == "POST":
+                    self._send_json(201, {"jobs": self.manager.submit(self._body())})
+                else:
+                    self._send_json(200, {"removed": self.manager.remove_finished()})
+            elif len(parts) >= 2 and parts[0] == "jobs" and parts[1].isdigit():
+                self._job_request(method, int(parts[1]), parts[2:])
+            elif method == "POST" and parts == ["config"]:
+                self._configure(self._body())
+            else:
+                self._send_json(404, {"error": "Неизвестный запрос"})
+        except KeyError:
+            self._send_json(404, {"error": "Загрузка не найдена"})
+        except ValueError as e:
+            self._send_json(400, {"error": str(e)})
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def _job_request(self, method, job_id, action):
+        manager = self.manager
+        if method == "GET" and not action:
+            self._send_json(200, manager.get(job_id, log=True))
+            return
+        if method != "POST" or len(action) != 1:
+            self._send_json(404, {"error": "Неизвестный запрос"})
+            return
+        action = action[0]
+        if action == "pause":
+            result = manager.pause(job_id)
+        elif action == "resume":
+            result = manager.resume(job_id)
+        elif action == "cancel":
+            result = manager.cancel(job_id)
+        elif action == "priority":
+            result = manager.set_priority(job_id, self._body().get("priority"))
+        elif action == "move":
+            result = {"position": manager.move(job_id, self._body().get("delta"))}
+        else:
+            self._send_json(404, {"error": "Неизвестное действие"})
+            return
+        self._send_json(200, result)
+
+    def _configure(self, data):
+        try:
+            slots = int(data["slots"]) if "slots" in data else None
+            limit = (
+                float(data["limit_mb"]) if data.get("limit_mb") is not None else None
+            )
+        except (TypeError, ValueError):
+            raise ValueError("slots и limit_mb должны быть числами") from None
+        if slots is not None:
+            self.manager.set_slots(slots)
+        if limit is not None:
+            # Только для этого процесса, как --limit в cli.py
+            get_bandwidth_scheduler().configure(limit_mb=limit)
+        self._send_json(200, self.manager.stats())
+
+    def _authorized(self):
+        # API не для веб-страниц: любая открытая в браузере страница могла бы
+        # отправить запрос на localhost. Браузер всегда передает Origin в
+        # запросах с других сайтов, а подмена Host ловит DNS rebinding
+        host = (self.headers.get("Host") or "").rsplit(":", 1)[0]
+        if self.headers.get("Origin") or (self.loopback and host not in LOOPBACK_HOSTS):
+            self._send_json(403, {"error": "Запрос отклонен"})
+            return False
+        if self.token:
+            header = self.headers.get("Authorization", "")
+            supplied = header[len("Bearer ") :] if header.startswith("Bearer ") else ""
+            supplied = supplied or self.query.get("token", [""])[0]
+            if not hmac.compare_digest(supplied.encode(), self.token.encode()):
+                self._send_json(401, {"error": "Неверный токен"})
+                return False
+        return True
+
+    def _body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > MAX_BODY:
+            raise ValueError("Слишком большой запрос")
+        if not length:
+            return {}
+        try:
+            data = json.loads(self.rfile.read(length))
+        except (UnicodeDecodeError, json.JSONDecodeError) as e:
+            raise ValueError(f"Неверный JSON: {e}") from None
+        if not isinstance(data, dict):
+            raise ValueError("Ожидается объект JSON")
+        return data
+
+    def _send_json(self, status, data):
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _stream_events(self):
+        """Поток Server-Sent Events: снимок очереди, затем все изменения.
+
+        С параметром job передаются только события одной загрузки.
+        """
+        job_filter = self.query.get("job", [None])[0]
+        job_filter = int(job_filter) if job_filter and job_filter.isdigit() else None
+        subscription, state = self.manager.subscribe()
+        try:
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream; charset=utf-8")
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            if job_filter is not None:
+                state["jobs"] = [j for j in state["jobs"] if j["id"] == job_filter]
+            self._send_event({"event": "jobs", **state})
+            while not subscription.closed:
+                try:
+                    event = subscription.queue.get(timeout=KEEPALIVE_INTERVAL)
+                except queue.Empty:
+                    self.wfile.write(b": keepalive\n\n")
+                    self.wfile.flush()
+                    continue
+                if job_filter is not None and event_job_id(event) != job_filter:
+                    continue
+                self._send_event(event)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            self.manager.hub.unsubscribe(subscription)
+
+    def _send_event(self, event):
+        data = json.dumps(event, ensure_ascii=False)
+        self.wfile.write(f"event: {event['event']}\ndata: {data}\n\n".encode())
+        self.wfile.flush()
+
+
+def event_job_id(event):
+    job = event.get("job")
+    return job.get("id") if isinstance(job, dict) else job
+
+
+def serve(manager, host=DEFAULT_HOST, port=DEFAULT_PORT, token=None):
+    """Создает HTTP-сервер API; запускать через serve_forever()"""
+    handler = type(
+        "Handler",
+        (ApiHandler,),
+        {
+            "manager": manager,
+            "token": token or None,
+            "loopback": host in LOOPBACK_HOSTS,
+        },
+    )
+    server = ThreadingHTTPServer((host, port), handler)
+    # Потоки событий не должны задерживать остановку
+    server.daemon_threads = True
+    return server
+
+
+def warm_up():
+    """Загружает реестр экстракторов до первого запроса"""
+    from yt_dlp.extractor import gen_extractor_classes
+
+    for _ in gen_extractor_classes():
+        pass
+
+
+class DaemonClient:
+    """Клиент API демона без зависимости от Qt"""
+
+    def __init__(self, url=None, token=None):
+        settings = get_settings()
+        self.url = (url or daemon_url(settings)).rstrip("/")
+        self.token = token if token is not None else settings.get("daemon_token")
+
+    def request(self, method, path, data=None, timeout=CLIENT_TIMEOUT):
+        """Выполняет запрос и возвращает ответ JSON.
+
+        Ошибка API выбрасывается как Exception с ее текстом, недоступность
+        демона - как OSError.
+        """
+        body = None if data is None else json.dumps(data).encode("utf-8")
+        request = urllib.request.Request(
+            self.url + path, data=body, method=method, headers=self._headers()
+        )
+        if body is not None:
+            request.add_header("Content-Type", "application/json")
+        try:
+            with urllib.request.urlopen(request, timeout=timeout) as response:
+                return json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            try:
+                message = json.loads(e.read()).get("error")
+            except (ValueError, AttributeError):
+                message = None
+            raise Exception(message or f"Демон ответил {e.code}") from None
+
+    def health(self):
+        return self.request("GET", "/health")
+
+    def submit(self, url=None, **fields):
+        if url is not None:
+            fields["url"] = url
+        return self.request("POST", "/jobs", fields)["jobs"]
+
+    def jobs(self):
+        return self.request("GET", "/jobs")["jobs"]
+
+    def job(self, job_id):
+        return self.request("GET", f"/jobs/{job_id}")
+
+    def action(self, job_id, action, **data):
+        return self.request("POST", f"/jobs/{job_id}/{action}", data)
+
+    def remove_finished(self):
+        return self.request("DELETE", "/jobs")["removed"]
+
+    def configure(self, **data):
+        return self.request("POST", "/config", data)
+
+    def events(self, job_id=None, on_response=None):
+        """Генератор событий из потока /events.
+
+        on_response(response) вызывается после подключения: закрыв ответ из
+        другого потока, можно прервать ожидание события.
+        """
+        path = "/events" if job_id is None else f"/events?job={job_id}"
+        request = urllib.request.Request(self.url + path, headers=self._headers())
+        with urllib.request.urlopen(request, timeout=EVENTS_TIMEOUT) as response:
+            if on_response:
+                on_response(response)
+            data = []
+            for line in response:
+                line = line.decode("utf-8").rstrip("\r\n")
+                if line.startswith("data:"):
+                    data.append(line[5:].lstrip())
+                elif not line and data:
+                    yield json.loads("\n".join(data))
+                    data = []
+
+    def _headers(self):
+        headers = {"Accept": "application/json"}
+        if self.token:
+            headers["Authorization"] = f"Bearer {self.token}"
+        return headers
+
+
+def main(argv=None):
+    settings = get_settings()
+    parser = argparse.ArgumentParser(
+        description="Демон загрузок с локальным HTTP API. Ссылки ставятся в "
+        "очередь запросом POST /jobs, ход загрузок передается потоком /events."
+    )
+    parser.add_argument(
+        "--host",
+        default=DEFAULT_HOST,
+        help="адрес для подключений (по умолчанию только с этой машины)",
+    )
+    parser.add_argument(
+        "--port",
+        type=int,
+        default=settings.get("daemon_port", DEFAULT_PORT),
+        help="порт API",
+    )
+    parser.add_argument(
+        "--token",
+        default=settings.get("daemon_token"),
+        help="токен, без которого запросы отклоняются (по умолчанию из настроек)",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        default=settings.get("save_path", os.path.expanduser("~/Downloads")),
+        help="папка для сохранения, если в запросе не указана output",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=settings.get("download_slots", DEFAULT_SLOTS),
+        help="число одновременных загрузок",
+    )
+    parser.add_argument(
+        "--log-level",
+        choices=LOG_LEVELS,
+        help="наименьший уровень сообщений в логе загрузок (по умолчанию из настроек)",
+    )
+    parser.add_argument(
+        "--limit",
+        type=float,
+        metavar="MB",
+        help="общий лимит скорости в МБ/с (0 - без ограничения)",
+    )
+    args = parser.parse_args(argv)
+
+    if args.host not in LOOPBACK_HOSTS and not args.token:
+        parser.error("для подключений не только с этой машины нужен --token")
+    if args.limit is not None:
+        get_bandwidth_scheduler().configure(limit_mb=args.limit, profiles=[])
+
+    manager = JobManager(args.jobs, save_path=args.output, log_level=args.log_level)
+    try:
+        server = serve(manager, args.host, args.port, args.token)
+    except OSError as e:
+        print(f"Не удалось открыть порт {args.port}: {e}", file=sys.stderr)
+        return 1
+    # Реестр экстракторов грузится, пока демон уже принимает ссылки
+    threading.Thread(target=warm_up, daemon=True).start()
+    host, port = server.server_address[:2]
+    print(f"Демон загрузок: http://{host}:{port}", file=sys.stderr, flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        # Недокачанные файлы остаются: их можно поставить в очередь снова
+        manager.shutdown()
+        shutdown_postprocess_pool()
+        close_session_pool()
+    return 0
+
+
+if __name__ == "__main__":
+    # Пул обработки запускает процессы, в том числе из собранного exe
+    multiprocessing.freeze_support()
+    sys.exit(main())
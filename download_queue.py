@@ -0,0 +1,974 @@
+import itertools
+import os
+import threading
+from collections import deque
+from queue import SimpleQueue
+
+from PySide6.QtCore import QObject, Qt, QTimer, Signal
+from PySide6.QtGui import QIcon
+from PySide6.QtWidgets import (
+    QAbstractItemView,
+    QComboBox,
+    QDoubleSpinBox,
+    QFileDialog,
+    QHBoxLayout,
+    QHeaderView,
+    QLabel,
+    QMessageBox,
+    QProgressBar,
+    QPushButton,
+    QSpinBox,
+    QTableWidget,
+    QTableWidgetItem,
+    QVBoxLayout,
+    QWidget,
+)
+
+from archive import get_download_archive
+from bandwidth import (
+    PRIORITY_HIGH,
+    PRIORITY_LABELS,
+    PRIORITY_LOW,
+    PRIORITY_NAMES,
+    PRIORITY_NORMAL,
+    get_bandwidth_scheduler,
+)
+from daemon import PRIORITY_KEYS
+from downloader import DownloadDialog, DownloadWorker
+from progress import format_speed
+from thumbnails import ICON_SIZE, TableThumbnails, thumbnail_url
+from utils import get_settings, reveal_file
+
+ICON_PATH = "app.ico"
+DEFAULT_SLOTS = 2
+# Сколько строк лога хранить для каждого элемента очереди
+ITEM_LOG_LIMIT = 500
+# Наибольшая пауза между попытками переподключиться к демону, секунды
+RECONNECT_MAX_DELAY = 10
+
+STATUS_QUEUED = "queued"
+STATUS_ACTIVE = "active"
+# Файл скачан и обрабатывается ffmpeg; слот загрузки уже свободен
+STATUS_PROCESSING = "processing"
+STATUS_PAUSED = "paused"
+STATUS_DONE = "done"
+STATUS_ERROR = "error"
+STATUS_CANCELLED = "cancelled"
+
+COLUMN_TITLE = 0
+COLUMN_STATUS = 1
+COLUMN_PRIORITY = 2
+COLUMN_SPEED = 3
+COLUMN_PROGRESS = 4
+
+STATUS_LABELS = {
+    STATUS_QUEUED: "В очереди",
+    STATUS_ACTIVE: "Загрузка",
+    STATUS_PROCESSING: "Обработка",
+    STATUS_PAUSED: "Пауза",
+    STATUS_DONE: "Готово",
+    STATUS_ERROR: "Ошибка",
+    STATUS_CANCELLED: "Отменено",
+}
+
+
+class QueueItem:
+    def __init__(
+        self,
+        item_id,
+        url,
+        save_path,
+        selected_format=None,
+        info=None,
+        title=None,
+        priority=PRIORITY_NORMAL,
+        thumbnail=None,
+    ):
+        self.id = item_id
+        self.url = url
+        self.save_path = save_path
+        self.selected_format = selected_format
+        self.info = info
+        self.title = (info or {}).get("title") or title or url
+        self.priority = priority
+        # Записи плейлиста ставятся в очередь без info, но с обложкой
+        self.thumbnail = thumbnail_url(info, ICON_SIZE[0]) or thumbnail
+        self.status = STATUS_QUEUED
+        self.percent = 0
+        self.progress_text = ""
+        self.filename = None
+        self.worker = None
+        # Скорость загрузки в демоне, у нее нет локального потока
+        self.speed = None
+        self.log = deque(maxlen=ITEM_LOG_LIMIT)
+
+    @property
+    def format_id(self):
+        if self.selected_format:
+            return self.selected_format.get("format_id")
+        return None
+
+    @property
+    def engine(self):
+        # None - загрузчик из настроек
+        if self.selected_format:
+            return self.selected_format.get("engine")
+        return None
+
+    @property
+    def is_finished(self):
+        return self.status in (STATUS_DONE, STATUS_ERROR, STATUS_CANCELLED)
+
+
+class DownloadQueue(QObject):
+    """Очередь загрузок с ограниченным числом одновременных слотов"""
+
+    item_added = Signal(int)
+    item_changed = Signal(int)
+    order_changed = Signal()
+
+    def __init__(self, slots=DEFAULT_SLOTS, parent=None):
+        super().__init__(parent)
+        self.slots = max(1, slots)
+        self.items = {}
+        self.order = []
+        self._ids = itertools.count(1)
+        get_settings().subscribe(self._on_setting_changed)
+
+    def _on_setting_changed(self, key, value):
+        if key == "download_slots":
+            self.set_slots(value)
+
+    def add(
+        self,
+        url,
+        save_path,
+        selected_format=None,
+        info=None,
+        title=None,
+        priority=PRIORITY_NORMAL,
+        thumbnail=None,
+    ):
+        item = QueueItem(
+            next(self._ids),
+            url,
+            save_path,
+            selected_format,
+            info,
+            title,
+            priority,
+            thumbnail,
+        )
+        self.items[item.id] = item
+        self.order.append(item.id)
+        self.item_added.emit(item.id)
+        self._schedule()
+        return item.id
+
+    def add_many(self, entries):
+        """Ставит в очередь несколько загрузок; entries - словари аргументов add()"""
+        return [self.add(**entry) for entry in entries]
+
+    def set_slots(self, slots):
+        self.slots = max(1, slots)
+        self._schedule()
+
+    def active_items(self):
+        return [item for item in self.items.values() if item.status == STATUS_ACTIVE]
+
+    def pause(self, item_id):
+        item = self.items[item_id]
+        if item.status == STATUS_ACTIVE:
+            # Поток сообщит об остановке сигналом cancelled; .part остается,
+            # и после возобновления загрузка продолжится с того же места
+            item.status = STATUS_PAUSED
+            item.worker.cancel(keep_partial=True)
+        elif item.status == STATUS_QUEUED:
+            item.status = STATUS_PAUSED
+        self.item_changed.emit(item_id)
+
+    def resume(self, item_id):
+        item = self.items[item_id]
+        if item.status in (STATUS_PAUSED, STATUS_ERROR, STATUS_CANCELLED):
+            if item.worker and item.worker.isRunning():
+                return
+            item.status = STATUS_QUEUED
+            self.item_changed.emit(item_id)
+            self._schedule()
+
+    def cancel(self, item_id):
+        item = self.items[item_id]
+        if item.is_finished:
+            return
+        was_running = item.status in (STATUS_ACTIVE, STATUS_PROCESSING)
+        item.status = STATUS_CANCELLED
+        if was_running:
+            item.worker.cancel()
+        elif item.worker and not item.worker.isRunning():
+            # Загрузка на паузе оставила недокачанные файлы
+            item.worker.job.discard_partial()
+        self.item_changed.emit(item_id)
+        self._schedule()
+
+    def set_priority(self, item_id, priority):
+        """Меняет долю полосы загрузки, в том числе уже идущей"""
+        item = self.items[item_id]
+        item.priority = priority
+        if item.worker and item.status == STATUS_ACTIVE:
+            item.worker.job.set_priority(priority)
+        self.item_changed.emit(item_id)
+
+    def move(self, item_id, delta):
+        """Сдвигает элемент в очереди на delta позиций"""
+        index = self.order.index(item_id)
+        new_index = min(max(index + delta, 0), len(self.order) - 1)
+        if new_index == index:
+            return
+        self.order.insert(new_index, self.order.pop(index))
+        self.order_changed.emit()
+
+    def remove_finished(self):
+        self.order = [
+            item_id for item_id in self.order if not self.items[item_id].is_finished
+        ]
+        self.items = {item_id: self.items[item_id] for item_id in self.order}
+        self.order_changed.emit()
+
+    def shutdown(self):
+        """Останавливает все активные загрузки перед выходом.
+
+        Не ждет потоки, а возвращает их: вызывающий ждет их вместе с другими
+        с общим сроком. Недокачанные файлы остаются для продолжения загрузки.
+        """
+        workers = [
+            item.worker
+            for item in self.items.values()
+            if item.status in (STATUS_ACTIVE, STATUS_PROCESSING)
+        ]
+        for worker in workers:
+            worker.cancel(keep_partial=True)
+        return workers
+
+    def _schedule(self):
+        free = self.slots - len(self.active_items())
+        for item_id in self.order:
+            if free <= 0:
+                break
+            item = self.items[item_id]
+            if item.status == STATUS_QUEUED:
+                self._start(item)
+                free -= 1
+
+    def _start(self, item):
+        item.status = STATUS_ACTIVE
+        worker = DownloadWorker(
+            item.url,
+            item.save_path,
+            item.format_id,
+            item.info,
+            item.priority,
+            item.engine,
+        )
+        worker.item_id = item.id
+        # Слоты - методы очереди, поэтому вызываются в потоке GUI
+        worker.progress.connect(self._on_worker_progress)
+        worker.log.connect(self._on_worker_log)
+        worker.finished.connect(self._on_worker_finished)
+        worker.error.connect(self._on_worker_error)
+        worker.cancelled.connect(self._on_worker_cancelled)
+        worker.processing.connect(self._on_worker_processing)
+        worker.file_downloaded = lambda path: setattr(item, "filename", path)
+        item.worker = worker
+        self.item_changed.emit(item.id)
+        worker.start()
+
+    def _sender_item(self):
+        return self.items.get(getattr(self.sender(), "item_id", None))
+
+    def _on_worker_progress(self, percent, text, downloaded_bytes, total_bytes):
+        item = self._sender_item()
+        if item is None:
+            return
+        item.percent = percent
+        item.progress_text = text
+        self.item_changed.emit(item.id)
+
+    def _on_worker_log(self, text, log_type):
+        item = self._sender_item()
+        if item is not None:
+            item.log.append((text, log_type))
+
+    def _on_worker_processing(self):
+        item = self._sender_item()
+        if item is None or item.status != STATUS_ACTIVE:
+            return
+        # Обработка не занимает слот: следующая загрузка начинается сразу
+        item.status = STATUS_PROCESSING
+        item.progress_text = "Обработка файла..."
+        self.item_changed.emit(item.id)
+        self._schedule()
+
+    def _on_worker_finished(self, message):
+        self._finish(self._sender_item(), STATUS_DONE)
+
+    def _on_worker_error(self, message):
+        self._finish(self._sender_item(), STATUS_ERROR)
+
+    def _on_worker_cancelled(self):
+        # Пауза или отмена уже выставили нужный статус
+        item = self._sender_item()
+        if (
+            item is not None
+            and item.status == STATUS_CANCELLED
+            and item.worker.job.keep_partial
+        ):
+            # Отмена пришла, пока поставленная на паузу загрузка еще
+            # останавливалась: .part, оставленные для продолжения, не нужны
+            item.worker.job.discard_partial()
+        self._finish(item, None)
+
+    def _finish(self, item, status):
+        if item is None:
+            return
+        if status is not None:
+            item.status = status
+        if item.status == STATUS_DONE:
+            item.percent = 100
+        self.item_changed.emit(item.id)
+        self._schedule()
+
+
+class RemoteQueue(QObject):
+    """Очередь загрузок демона (daemon.py) для окна очереди.
+
+    Окно работает с ней так же, как с DownloadQueue, но загрузки идут в
+    процессе демона и продолжаются после закрытия приложения. Команды
+    отправляются запросами API, а состояние приходит потоком событий
+    /events, который читается в фоновом потоке и переподключается после
+    обрыва. Запросы выполняются по одному в фоновом потоке, чтобы медленный
+    или недоступный демон не останавливал окно. Номера элементов - номера
+    загрузок демона; пока демон не ответил, у загрузки временный
+    отрицательный номер, а загрузки, которые не удалось ему передать,
+    остаются в окне с ошибкой, пока их не продолжат.
+    """
+
+    item_added = Signal(int)
+    item_changed = Signal(int)
+    order_changed = Signal()
+    connection_changed = Signal(bool, str)  # есть связь, текст ошибки
+    # События из потока чтения; слот выполняется в потоке GUI
+    event_received = Signal(object)
+    request_finished = Signal(object, object, object)  # колбэк, результат, ошибка
+
+    def __init__(self, client, parent=None):
+        super().__init__(parent)
+        self.client = client
+        self.slots = DEFAULT_SLOTS
+        self.items = {}
+        self.order = []
+        # None - еще не подключались: первый же обрыв будет показан
+        self.connected = None
+        self._local_ids = itertools.count(-1, -1)
+        self._stop = threading.Event()
+        self._response = None
+        self._requests = SimpleQueue()
+        self.event_received.connect(self._on_event)
+        self.request_finished.connect(self._on_request_finished)
+        get_settings().subscribe(self._on_setting_changed)
+        self._thread = threading.Thread(target=self._read_events, daemon=True)
+        self._thread.start()
+        threading.Thread(target=self._run_requests, daemon=True).start()
+
+    def _on_setting_changed(self, key, value):
+        if key == "download_slots":
+            self.set_slots(value)
+        elif key == "bandwidth_limit_mb":
+            self._configure(limit_mb=value)
+
+    def add(
+        self,
+        url,
+        save_path,
+        selected_format=None,
+        info=None,
+        title=None,
+        priority=PRIORITY_NORMAL,
+        thumbnail=None,
+    ):
+        item = self._new_item(
+            url, save_path, selected_format, info, title, priority, thumbnail
+        )
+        self._submit([item])
+        return item.id
+
+    def add_many(self, entries):
+        """Ставит в очередь несколько загрузок одним запросом к демону"""
+        items = [self._new_item(**entry) for entry in entries]
+        if items:
+            self._submit(items)
+        return [item.id for item in items]
+
+    def _new_item(
+        self,
+        url,
+        save_path,
+        selected_format=None,
+        info=None,
+        title=None,
+        priority=PRIORITY_NORMAL,
+        thumbnail=None,
+    ):
+        item = QueueItem(
+            next(self._local_ids),
+            url,
+            save_path,
+            selected_format,
+            info,
+            title,
+            priority,
+            thumbnail,
+        )
+        item.progress_text = "Передается демону..."
+        self.items[item.id] = item
+        self.order.append(item.id)
+        self.item_added.emit(item.id)
+        return item
+
+    def _submit(self, items):
+        # info не передается: DownloadJob в демоне на этой же машине возьмет
+        # его из общего кэша метаданных, если ссылки на форматы не устарели
+        jobs = [
+            {
+                "url": item.url,
+                "output": item.save_path,
+                "format": item.format_id,
+                "engine": item.engine,
+                "priority": PRIORITY_KEYS[item.priority],
+                "title": item.title,
+                "thumbnail": item.thumbnail,
+            }
+            for item in items
+        ]
+        self._request(
+            lambda: self.client.submit(urls=jobs),
+            lambda result, error: self._on_submitted(items, result, error),
+        )
+
+    def _on_submitted(self, items, jobs, error):
+        if error is not None:
+            for item in items:
+                item.status = STATUS_ERROR
+                item.progress_text = f"Демон недоступен: {error}"
+                item.log.append((item.progress_text, "error"))
+                if item.id in self.items:
+                    self.item_changed.emit(item.id)
+            return
+        for item, job in zip(items, jobs):
+            local_id = item.id
+            # Элемент могли отменить или продолжить заново, пока шел запрос
+            if item.status == STATUS_CANCELLED:
+                self._call(job["id"], "cancel")
+            if self.items.pop(local_id, None) is None:
+                continue
+            index = self.order.index(local_id)
+            # Событие о новой загрузке могло прийти раньше ответа
+            if job["id"] in self.items:
+                del self.order[index]
+                continue
+            item.id = job["id"]
+            self._apply(item, job)
+            self.items[item.id] = item
+            self.order[index] = item.id
+        self.order_changed.emit()
+
+    def set_slots(self, slots):
+        self.slots = max(1, slots)
+        self._configure(slots=self.slots)
+
+    def pause(self, item_id):
+        if item_id > 0:
+            self._call(item_id, "pause")
+
+    def resume(self, item_id):
+        if item_id > 0:
+            self._call(item_id, "resume")
+            return
+        item = self.items[item_id]
+        if item.status not in (STATUS_ERROR, STATUS_CANCELLED):
+            return
+        self.order.remove(item_id)
+        del self.items[item_id]
+        self.order_changed.emit()
+        self.add(
+            item.url,
+            item.save_path,
+            item.selected_format,
+            item.info,
+            item.title,
+            item.priority,
+            item.thumbnail,
+        )
+
+    def cancel(self, item_id):
+        if item_id > 0:
+            self._call(item_id, "cancel")
+            return
+        self.items[item_id].status = STATUS_CANCELLED
+        self.item_changed.emit(item_id)
+
+    def set_priority(self, item_id, priority):
+        if item_id > 0:
+            self._call(item_id, "priority", priority=PRIORITY_KEYS[priority])
+
+    def move(self, item_id, delta):
+        if item_id > 0:
+            self._call(item_id, "move", delta=delta)
+
+    def remove_finished(self):
+        self._request(self.client.remove_finished)
+        # Порядок после удаления в демоне придет событием order
+        local = [
+            item_id
+            for item_id in self.order
+            if item_id < 0 and self.items[item_id].is_finished
+        ]
+        for item_id in local:
+            del self.items[item_id]
+        if local:
+            self._set_order([item_id for item_id in self.order if item_id > 0])
+
+    def shutdown(self):
+        """Отключается от демона; загрузки в нем продолжаются.
+
+        Локальных потоков загрузки нет, поэтому список пуст.
+        """
+        self._stop.set()
+        self._requests.put((None, None))
+        response = self._response
+        if response is not None:
+            try:
+                response.close()
+            except Exception:
+                pass
+        return []
+
+    def _call(self, item_id, action, **data):
+        def done(result, error):
+            item = self.items.get(item_id)
+            if error is not None and item is not None:
+                item.log.append((f"Ошибка запроса к демону: {error}", "error"))
+
+        self._request(lambda: self.client.action(item_id, action, **data), done)
+
+    def _configure(self, **data):
+        self._request(lambda: self.client.configure(**data))
+
+    def _request(self, call, on_done=None):
+        """Выполняет запрос к демону в фоновом потоке.
+
+        Запросы идут по одному в порядке вызова; on_done(result, error)
+        вызывается в потоке GUI.
+        """
+        self._requests.put((call, on_done))
+
+    def _run_requests(self):
+        while True:
+            call, on_done = self._requests.get()
+            if call is None:
+                break
+            try:
+                result, error = call(), None
+            except Exception as e:
+                result, error = None, e
+            if on_done is not None and not self._stop.is_set():
+                self.request_finished.emit(on_done, result, error)
+
+    def _on_request_finished(self, on_done, result, error):
+        on_done(result, error)
+
+    def _read_events(self):
+        delay = 1
+        while not self._stop.is_set():
+            try:
+                for event in self.client.events(on_response=self._set_response):
+                    delay = 1
+                    self.event_received.emit(event)
+                message = "Демон закрыл соединение"
+            except Exception as e:
+                message = str(e)
+            self._response = None
+            if self._stop.is_set():
+                break
+            self.event_received.emit({"event": "disconnected", "message": message})
+            self._stop.wait(delay)
+            delay = min(delay * 2, RECONNECT_MAX_DELAY)
+
+    def _set_response(self, response):
+        self._response = response
+        if self._stop.is_set():
+            response.close()
+
+    def _on_event(self, event):
+        name = event.get("event")
+        if name == "jobs":
+            self.slots = event.get("slots", self.slots)
+            for job in event["jobs"]:
+                self._update_job(job, notify=False)
+            self._set_order([job["id"] for job in event["jobs"]])
+            self._set_connected(True, "")
+        elif name == "disconnected":
+            self._set_connected(False, event.get("message", ""))
+        elif name == "job":
+            self._update_job(event["job"])
+        elif name == "order":
+            self._set_order(event["order"])
+        elif name == "config":
+            self.slots = event.get("slots", self.slots)
+        else:
+            item = self.items.get(event.get("job"))
+            if item is None:
+                return
+            if name == "progress":
+                item.percent = event["percent"]
+                item.progress_text = event["text"]
+                item.speed = event.get("speed")
+                self.item_changed.emit(item.id)
+            elif name == "log":
+                item.log.append((event["message"], event["level"]))
+            elif name == "file":
+                item.filename = event["path"]
+
+    def _update_job(self, job, notify=True):
+        item = self.items.get(job["id"])
+        if item is not None:
+            self._apply(item, job)
+            if notify:
+                self.item_changed.emit(item.id)
+            return
+        # Загрузка поставлена другим клиентом демона
+        selected_format = None
+        if job.get("format") or job.get("engine"):
+            selected_format = {
+                "format_id": job.get("format"),
+                "engine": job.get("engine"),
+            }
+        item = QueueItem(
+            job["id"],
+            job["url"],
+            job["output"],
+            selected_format,
+            title=job.get("title"),
+            thumbnail=job.get("thumbnail"),
+        )
+        self._apply(item, job)
+        self.items[item.id] = item
+        if notify:
+            self.order.append(item.id)
+            self.item_added.emit(item.id)
+
+    def _apply(self, item, job):
+        item.status = job["status"]
+        item.percent = job["percent"]
+        item.progress_text = job.get("error") or job.get("text") or ""
+        item.speed = job.get("speed")
+        item.filename = job.get("file") or item.filename
+        item.priority = PRIORITY_NAMES.get(job.get("priority"), item.priority)
+        item.title = job.get("title") or item.title
+
+    def _set_order(self, order):
+        # Элементы, которые не удалось передать демону, остаются в конце
+        order = [item_id for item_id in order if item_id in self.items]
+        order += [
+            item_id for item_id in self.order if item_id < 0 and item_id in self.items
+        ]
+        self.order = order
+        self.items = {item_id: self.items[item_id] for item_id in order}
+        self.order_changed.emit()
+
+    def _set_connected(self, connected, message):
+        if connected != self.connected:
+            self.connected = connected
+            self.connection_changed.emit(connected, message)
+
+
+class QueueWindow(QWidget):
+    """Немодальное окно со списком всех загрузок"""
+
+    def __init__(self, queue, parent=None):
+        super().__init__(parent, Qt.WindowType.Window)
+        self.queue = queue
+        self.settings = get_settings()
+        size = self.settings.get("queue_window_size")
+        if size:
+            self.resize(size[0], size[1])
+        client = getattr(queue, "client", None)
+        if client is not None:
+            self.setWindowTitle(f"Очередь загрузок: демон {client.url}")
+        else:
+            self.setWindowTitle("Очередь загрузок")
+        self.setMinimumSize(700, 360)
+        if os.path.exists(ICON_PATH):
+            self.setWindowIcon(QIcon(ICON_PATH))
+        self.setup_ui()
+        self.queue.item_added.connect(self.append_row)
+        self.queue.order_changed.connect(self.refresh)
+        self.queue.item_changed.connect(self.update_row)
+        self.refresh()
+        # Распределение полосы меняется и без событий прогресса
+        self.bandwidth_timer = QTimer(self)
+        self.bandwidth_timer.timeout.connect(self.update_bandwidth)
+
+    def setup_ui(self):
+        layout = QVBoxLayout(self)
+
+        slots_layout = QHBoxLayout()
+        slots_layout.addWidget(QLabel("Одновременных загрузок:"))
+        self.slots_spin = QSpinBox()
+        self.slots_spin.setRange(1, 16)
+        self.slots_spin.setValue(self.queue.slots)
+        self.slots_spin.valueChanged.connect(self.change_slots)
+        slots_layout.addWidget(self.slots_spin)
+        slots_layout.addWidget(QLabel("Лимит скорости, МБ/с:"))
+        self.limit_spin = QDoubleSpinBox()
+        self.limit_spin.setRange(0, 1000)
+        self.limit_spin.setDecimals(1)
+        self.limit_spin.setSingleStep(0.5)
+        self.limit_spin.setSpecialValueText("без ограничения")
+        self.limit_spin.setValue(self.settings.get("bandwidth_limit_mb", 0))
+        self.limit_spin.valueChanged.connect(self.change_limit)
+        slots_layout.addWidget(self.limit_spin)
+        self.bandwidth_label = QLabel("")
+        self.bandwidth_label.setObjectName("StatusLabel")
+        slots_layout.addWidget(self.bandwidth_label)
+        slots_layout.addStretch(1)
+        import_button = QPushButton("Импорт архива…")
+        import_button.setToolTip(
+            "Добавить в архив загрузок видео из папки с файлами .info.json"
+        )
+        import_button.clicked.connect(self.import_archive)
+        slots_layout.addWidget(import_button)
+        layout.addLayout(slots_layout)
+
+        self.table = QTableWidget(0, 5)
+        self.table.setHorizontalHeaderLabels(
+            ["Название", "Статус", "Приоритет", "Скорость", "Прогресс"]
+        )
+        self.table.setSelectionBehavior(QAbstractItemView.SelectionBehavior.SelectRows)
+        self.table.setSelectionMode(QAbstractItemView.SelectionMode.SingleSelection)
+        self.table.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+        self.table.verticalHeader().setVisible(False)
+        header = self.table.horizontalHeader()
+        header.setSectionResizeMode(COLUMN_TITLE, QHeaderView.ResizeMode.Stretch)
+        for column in (COLUMN_STATUS, COLUMN_PRIORITY, COLUMN_SPEED):
+            header.setSectionResizeMode(column, QHeaderView.ResizeMode.ResizeToContents)
+        # Ширина по содержимому только видимых строк: иначе каждое изменение
+        # ячейки пересчитывает всю колонку длинной очереди
+        header.setResizeContentsPrecision(0)
+        header.setSectionResizeMode(COLUMN_PROGRESS, QHeaderView.ResizeMode.Fixed)
+        self.table.setColumnWidth(COLUMN_PROGRESS, 180)
+        self.table.cellDoubleClicked.connect(lambda row, _: self.show_details(row))
+        self.table.itemSelectionChanged.connect(self.sync_priority)
+        layout.addWidget(self.table)
+        self.thumbnails = TableThumbnails(
+            self.table, COLUMN_TITLE, self.thumbnail_for_row
+        )
+
+        button_layout = QHBoxLayout()
+        button_layout.addWidget(QLabel("Приоритет:"))
+        self.priority_combo = QComboBox()
+        for priority in (PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW):
+            self.priority_combo.addItem(PRIORITY_LABELS[priority], priority)
+        self.priority_combo.activated.connect(self.change_priority)
+        button_layout.addWidget(self.priority_combo)
+        for text, handler in (
+            ("Пауза", self.pause_selected),
+            ("Продолжить", self.resume_selected),
+            ("Вверх", lambda: self.move_selected(-1)),
+            ("Вниз", lambda: self.move_selected(1)),
+            ("Отменить", self.cancel_selected),
+            ("Открыть папку", self.open_selected_folder),
+            ("Очистить завершенные", self.queue.remove_finished),
+        ):
+            button = QPushButton(text)
+            button.clicked.connect(handler)
+            button_layout.addWidget(button)
+        layout.addLayout(button_layout)
+
+    def refresh(self):
+        selected = self.selected_id()
+        self.table.setRowCount(len(self.queue.order))
+        for row, item_id in enumerate(self.queue.order):
+            self.fill_row(row, item_id)
+            if item_id == selected:
+                self.table.selectRow(row)
+        self.thumbnails.refresh()
+
+    def append_row(self, item_id):
+        # Новые загрузки добавляются в конец: перестраивать всю таблицу ради
+        # каждой из сотен записей плейлиста незачем
+        row = self.table.rowCount()
+        if self.queue.order.index(item_id) != row:
+            self.refresh()
+            return
+        self.table.insertRow(row)
+        self.fill_row(row, item_id)
+        self.thumbnails.refresh()
+
+    def fill_row(self, row, item_id):
+        title_item = QTableWidgetItem(self.queue.items[item_id].title)
+        title_item.setData(Qt.ItemDataRole.UserRole, item_id)
+        self.table.setItem(row, COLUMN_TITLE, title_item)
+        for column in (COLUMN_STATUS, COLUMN_PRIORITY, COLUMN_SPEED):
+            self.table.setItem(row, column, QTableWidgetItem())
+        if self.table.cellWidget(row, COLUMN_PROGRESS) is None:
+            self.table.setCellWidget(row, COLUMN_PROGRESS, QProgressBar())
+        self.update_row(item_id)
+
+    def thumbnail_for_row(self, row):
+        if row >= len(self.queue.order):
+            return None
+        return self.queue.items[self.queue.order[row]].thumbnail
+
+    def update_row(self, item_id):
+        if item_id not in self.queue.items:
+            return
+        row = self.queue.order.index(item_id)
+        item = self.queue.items[item_id]
+        status_item = self.table.item(row, COLUMN_STATUS)
+        progress_bar = self.table.cellWidget(row, COLUMN_PROGRESS)
+        if status_item is None or progress_bar is None:
+            return
+        status_item.setText(STATUS_LABELS[item.status])
+        status_item.setToolTip(item.progress_text)
+        self.table.item(row, COLUMN_PRIORITY).setText(PRIORITY_LABELS[item.priority])
+        self.table.item(row, COLUMN_SPEED).setText(self.speed_text(item))
+        progress_bar.setValue(item.percent)
+
+    def speed_text(self, item, shares=None):
+        """Текущая скорость и выделенная загрузке полоса"""
+        if item.worker is None:
+            # Загрузка идет в демоне: скорость приходит с его событиями
+            if item.status != STATUS_ACTIVE or not item.speed:
+                return ""
+            return format_speed(item.speed)
+        share = item.worker.job.share
+        if item.status != STATUS_ACTIVE or share is None:
+            return ""
+        if shares is None:
+            shares = get_bandwidth_scheduler().snapshot()["shares"]
+        allocated, rate = shares.get(share.id, (None, 0))
+        if allocated is None:
+            return format_speed(rate)
+        return f"{format_speed(rate)} из {format_speed(allocated)}"
+
+    def update_bandwidth(self):
+        snapshot = get_bandwidth_scheduler().snapshot()
+        limit = snapshot["limit"]
+        if limit is None:
+            text = "Общая скорость не ограничена"
+        else:
+            text = f"Общий лимит: {format_speed(limit)}"
+            if snapshot["profile"]:
+                text += " (по расписанию)"
+        self.bandwidth_label.setText(text)
+        for row, item_id in enumerate(self.queue.order):
+            item = self.queue.items[item_id]
+            speed_item = self.table.item(row, COLUMN_SPEED)
+            if speed_item is not None:
+                speed_item.setText(self.speed_text(item, snapshot["shares"]))
+
+    def selected_id(self):
+        rows = self.table.selectionModel().selectedRows()
+        if not rows:
+            return None
+        return self.table.item(rows[0].row(), COLUMN_TITLE).data(
+            Qt.ItemDataRole.UserRole
+        )
+
+    def sync_priority(self):
+        item_id = self.selected_id()
+        if item_id is not None:
+            priority = self.queue.items[item_id].priority
+            self.priority_combo.setCurrentIndex(self.priority_combo.findData(priority))
+
+    def change_priority(self, index):
+        item_id = self.selected_id()
+        if item_id is not None:
+            self.queue.set_priority(item_id, self.priority_combo.itemData(index))
+
+    def pause_selected(self):
+        item_id = self.selected_id()
+        if item_id is not None:
+            self.queue.pause(item_id)
+
+    def resume_selected(self):
+        item_id = self.selected_id()
+        if item_id is not None:
+            self.queue.resume(item_id)
+
+    def cancel_selected(self):
+        item_id = self.selected_id()
+        if item_id is not None:
+            self.queue.cancel(item_id)
+
+    def move_selected(self, delta):
+        item_id = self.selected_id()
+        if item_id is not None:
+            self.queue.move(item_id, delta)
+
+    def open_selected_folder(self):
+        item_id = self.selected_id()
+        if item_id is not None:
+            item = self.queue.items[item_id]
+            reveal_file(item.filename, item.save_path)
+
+    def show_details(self, row):
+        item = self.queue.items[self.queue.order[row]]
+        if item.worker is None:
+            return
+        dialog = DownloadDialog(
+            self,
+            item.url,
+            item.save_path,
+            item.selected_format,
+            item.info,
+            worker=item.worker,
+            history=list(item.log),
+        )
+        dialog.last_downloaded_file = item.filename
+        dialog.open_folder_button.setEnabled(item.is_finished)
+        dialog.show()
+
+    def import_archive(self):
+        folder = QFileDialog.getExistingDirectory(
+            self,
+            "Папка с уже скачанными видео",
+            self.settings.get("save_path", os.path.expanduser("~/Downloads")),
+        )
+        if not folder:
+            return
+        added = get_download_archive(required=True).import_folder(folder)
+        QMessageBox.information(
+            self, "Архив загрузок", f"Добавлено в архив видео: {added}"
+        )
+
+    def change_slots(self, value):
+        # Очередь подписана на изменение настройки и сама обновит число слотов
+        self.settings["download_slots"] = value
+
+    def change_limit(self, value):
+        # Планировщик подписан на изменение настройки
+        self.settings["bandwidth_limit_mb"] = value
+
+    def showEvent(self, event):
+        self.bandwidth_timer.start(1000)
+        self.update_bandwidth()
+        super().showEvent(event)
+
+    def closeEvent(self, event):
+        self.bandwidth_timer.stop()
+        self.settings["queue_window_size"] = [
+            self.size().width(),
+            self.size().height(),
+        ]
+        super().closeEvent(event)
@@ -1,178 +1,107 @@
 import os
-import subprocess
-import sys
 
 from PySide6.QtCore import Qt, QThread, Signal
-from PySide6.QtGui import QColor, QIcon, QTextCursor
+from PySide6.QtGui import QIcon
 from PySide6.QtWidgets import (
     QDialog,
     QLabel,
     QProgressBar,
     QPushButton,
-    QTextEdit,
     QVBoxLayout,
 )
 
-from utils import load_settings, save_settings
+from bandwidth import PRIORITY_NORMAL
+from engine import ARCHIVED_MESSAGE, SUCCESS_MESSAGE, DownloadJob
+from log_view import DEFAULT_MAX_LINES, LogView
+from utils import get_settings, reveal_file, wait_threads
 
 ICON_PATH = "app.ico"
 
 
-class YTDLLogger:
-    def __init__(self, log_callback):
-        self.log_callback = log_callback
-
-    def debug(self, msg):
-        if msg.startswith("[download]"):
-            return
-        if msg.startswith("[debug]"):
-            if any(
-                x in msg.lower()
-                for x in [
-                    "looking for embeds",
-                    "formats sorted by",
-                    "downloading format",
-                ]
-            ):
-                return
-            clean_msg = msg.replace("[debug]", "").strip()
-            self.log_callback(f"Отладка: {clean_msg}", "debug")
-        elif "[retry]" in msg.lower() or "retrying" in msg.lower():
-            self.log_callback(f"Повторная попытка: {msg}", "warning")
-        else:
-            self.log_callback(msg, "info")
-
-    def warning(self, msg):
-        if "[generic]" in msg:
-            clean_msg = msg.replace("[generic]", "").strip()
-            if "Falling back on generic information extractor" in clean_msg:
-                self.log_callback(
-                    "Используем стандартный метод получения информации", "warning"
-                )
-            elif "Untested major version" in clean_msg:
-                self.log_callback(
-                    "Внимание: используется новая версия плеера", "warning"
-                )
-            else:
-                self.log_callback(f"Предупреждение: {clean_msg}", "warning")
-        else:
-            self.log_callback(f"Предупреждение: {msg}", "warning")
-
-    def error(self, msg):
-        clean_msg = msg.replace("[error]", "").strip()
-        self.log_callback(f"Ошибка: {clean_msg}", "error")
-
-
 class DownloadWorker(QThread):
     progress = Signal(int, str, int, int)  # добавил downloaded_bytes, total_bytes
     finished = Signal(str)
     error = Signal(str)
+    cancelled = Signal()
+    # Файл скачан, идет обработка ffmpeg в пуле; слот загрузки уже свободен
+    processing = Signal()
     log = Signal(str, str)  # message, type
     file_downloaded = None  # Новый callback
 
-    def __init__(self, url, save_path, format_id=None):
+    def __init__(
+        self,
+        url,
+        save_path,
+        format_id=None,
+        info=None,
+        priority=PRIORITY_NORMAL,
+        engine=None,
+    ):
         super().__init__()
         self.url = url
         self.save_path = save_path
         self.format_id = format_id
-        self._is_cancelled = False
+        self.info = info  # Уже извлеченная информация, если есть
+        # Сама загрузка не зависит от Qt, поток лишь передает ее события сигналами
+        self.job = DownloadJob(
+            url,
+            save_path,
+            format_id,
+            info,
+            on_progress=self.progress.emit,
+            on_log=self.log.emit,
+            on_file=self._on_file,
+            priority=priority,
+            engine=engine,
+        )
+
+    @property
+    def reporter(self):
+        return self.job.reporter
 
     def run(self):
         try:
-            ydl_opts = {
-                "format": self.format_id if self.format_id else "best",
-                "outtmpl": os.path.join(self.save_path, "%(title)s.%(ext)s"),
-                "progress_hooks": [self._progress_hook],
-                "logger": YTDLLogger(self.log.emit),
-                "noprogress": False,
-                "ignoreerrors": True,
-                "no_warnings": False,
-                "extract_flat": False,
-                "quiet": False,
-                "verbose": True,
-                "nocheckcertificate": True,
-                "geo_bypass": True,
-                "geo_bypass_country": "RU",
-                "socket_timeout": 30,
-                "retries": 10,  # Добавлено: количество попыток
-                "fragment_retries": 10,  # Для фрагментированных видео
-                "http_headers": {
-                    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
-                    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
-                    "Accept-Language": "en-us,en;q=0.5",
-                    "Sec-Fetch-Mode": "navigate",
-                },
-            }
-            import yt_dlp
-
-            self.log.emit("Начинаем загрузку...", "info")
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                self.log.emit("Получаем информацию о видео...", "info")
-                info = ydl.extract_info(self.url, download=False)
-                if self._is_cancelled:
-                    return
-                if not info:
-                    raise Exception("Не удалось получить информацию о видео")
-                title = info.get("title", "Без названия")
-                duration = info.get("duration", 0)
-                duration_str = f"{duration // 60}:{duration % 60:02d}"
-                self.log.emit(f"Название: {title}", "info")
-                self.log.emit(f"Длительность: {duration_str}", "info")
-                formats = info.get("formats", [])
-                if formats:
-                    self.log.emit(f"Доступно форматов: {len(formats)}", "info")
-                    best_format = formats[0]
-                    if "height" in best_format:
-                        self.log.emit(
-                            f"Лучшее качество: {best_format['height']}p", "info"
-                        )
-                self.log.emit("Начинаем скачивание...", "info")
-                ydl.download([self.url])
-                if self._is_cancelled:
-                    return
-            self.log.emit("Загрузка завершена успешно!", "success")
-            self.finished.emit("Загрузка завершена успешно!")
+            done = self.job.run()
+            if done and self.job.postprocessing is not None:
+                self.processing.emit()
+                done = self.job.wait_postprocess()
+            if done:
+                self.finished.emit(
+                    ARCHIVED_MESSAGE if self.job.skipped else SUCCESS_MESSAGE
+                )
+            else:
+                self.cancelled.emit()
         except Exception as e:
-            if not self._is_cancelled:
+            if self.job.is_cancelled:
+                self.log.emit("Загрузка остановлена", "warning")
+                self.cancelled.emit()
+            else:
                 error_msg = str(e)
                 self.log.emit(f"Ошибка: {error_msg}", "error")
                 self.error.emit(error_msg)
 
-    def _progress_hook(self, d):
-        if d["status"] == "downloading":
-            try:
-                total = d.get("total_bytes") or d.get("total_bytes_estimate")
-                downloaded = d.get("downloaded_bytes", 0)
-                percent = int(downloaded / total * 100) if total else 0
-                speed = d.get("speed")
-                eta = d.get("eta")
-                speed_str = f"{speed / 1024 / 1024:.2f} МБ/с" if speed else "N/A"
-                eta_str = f"{eta // 60}:{eta % 60:02d}" if eta else "N/A"
-                filename = d.get("filename", "").split("/")[-1]
-                info = f"Файл: {filename}\nПрогресс: {percent}% | Скорость: {speed_str} | Осталось: {eta_str}"
-                self.progress.emit(percent, info, downloaded, total or 0)
-                if percent % 10 == 0:
-                    self.log.emit(
-                        f"Прогресс: {percent}% | Скорость: {speed_str} | Осталось: {eta_str}",
-                        "info",
-                    )
-                if "filename" in d and self.file_downloaded:
-                    self.file_downloaded(d["filename"])
-            except Exception as e:
-                self.log.emit(f"Ошибка при обновлении прогресса: {str(e)}", "error")
-                self.log.emit(f"Данные прогресса: {d}", "debug")
-        elif d["status"] == "finished":
-            self.log.emit("Загрузка завершена, обрабатываем файл...", "info")
+    def _on_file(self, filename):
+        if self.file_downloaded:
+            self.file_downloaded(filename)
 
-    def cancel(self):
-        """Отменяет выполнение потока"""
-        self._is_cancelled = True
+    def cancel(self, keep_partial=False):
+        """Отменяет загрузку; поток завершится через один блок данных"""
+        self.job.cancel(keep_partial)
 
 
 class DownloadDialog(QDialog):
-    def __init__(self, parent, url, save_path, selected_format):
+    def __init__(
+        self,
+        parent,
+        url,
+        save_path,
+        selected_format,
+        info=None,
+        worker=None,
+        history=(),
+    ):
         super().__init__(parent)
-        self.settings = load_settings()
+        self.settings = get_settings()
         size = self.settings.get("download_dialog_size")
         if size:
             self.resize(size[0], size[1])
@@ -183,11 +112,17 @@ class DownloadDialog(QDialog):
         self.url = url
         self.save_path = save_path
         self.selected_format = selected_format
+        self.info = info
         self.worker = None
         self.last_downloaded_file = None
         self.had_error = False  # Новый флаг
+        # Диалог управляет потоком, только если сам его запустил
+        self.owns_worker = worker is None
         self.setup_ui()
-        self.start_download()
+        if worker is None:
+            self.start_download()
+        else:
+            self.attach_worker(worker, history)
 
     def setup_ui(self):
         layout = QVBoxLayout(self)
@@ -198,10 +133,11 @@ class DownloadDialog(QDialog):
         layout.addWidget(self.size_label)
         self.progress_info = QLabel("")
         layout.addWidget(self.progress_info)
-        self.log_text = QTextEdit()
-        self.log_text.setReadOnly(True)
+        self.log_text = LogView(
+            max_lines=self.settings.get("log_max_lines", DEFAULT_MAX_LINES)
+        )
         self.log_text.setMinimumHeight(120)
-        self.log_text.setLineWrapMode(QTextEdit.LineWrapMode.NoWrap)
+        self.log_text.setLineWrapMode(LogView.LineWrapMode.NoWrap)
         layout.addWidget(self.log_text)
         self.open_folder_button = QPushButton("Открыть папку")
         self.open_folder_button.setEnabled(False)
@@ -209,17 +145,32 @@ class DownloadDialog(QDialog):
         layout.addWidget(self.open_folder_button, alignment=Qt.AlignmentFlag.AlignRight)
 
     def start_download(self):
-        format_id = (
-            self.selected_format.get("format_id") if self.selected_format else None
+        selected = self.selected_format or {}
+        self.worker = DownloadWorker(
+            self.url,
+            self.save_path,
+            selected.get("format_id"),
+            self.info,
+            engine=selected.get("engine"),
         )
-        self.worker = DownloadWorker(self.url, self.save_path, format_id)
-        self.worker.progress.connect(self.update_progress)
-        self.worker.finished.connect(self.download_finished)
-        self.worker.error.connect(self.download_error)
-        self.worker.log.connect(self.append_log)
         self.worker.file_downloaded = self.set_last_downloaded_file
+        self.connect_worker(self.worker)
         self.worker.start()
 
+    def attach_worker(self, worker, history=()):
+        """Подключает диалог к уже идущей загрузке (например, из очереди)"""
+        self.worker = worker
+        for text, log_type in history:
+            self.append_log(text, log_type)
+        self.connect_worker(worker)
+
+    def connect_worker(self, worker):
+        worker.progress.connect(self.update_progress)
+        worker.finished.connect(self.download_finished)
+        worker.error.connect(self.download_error)
+        worker.processing.connect(self.download_processing)
+        worker.log.connect(self.append_log)
+
     def update_progress(self, value, info, downloaded_bytes=0, total_bytes=0):
         self.progress_bar.setValue(value)
         self.progress_info.setText(info)
@@ -238,19 +189,18 @@ class DownloadDialog(QDialog):
         else:
             self.size_label.setText("")
 
+    def download_processing(self):
+        self.progress_bar.setValue(100)
+        self.progress_info.setText("Файл скачан, идет обработка...")
+
     def download_finished(self, message):
         if self.had_error:
             return  # Не показываем успех, если была ошибка
-        # Проверяем, не был ли файл уже скачан
-        if (
-            "already been downloaded" in message.lower()
-            or "already downloaded" in message.lower()
-        ):
-            self.progress_info.setText("Файл уже был скачан.")
-            self.append_log("Файл уже был скачан.", "success")
-        else:
-            self.progress_info.setText(message)
-            self.append_log(message, "success")
+        # Видео из архива загрузок не скачивалось, прогресс сразу полный
+        if message == ARCHIVED_MESSAGE:
+            self.progress_bar.setValue(100)
+        self.progress_info.setText(message)
+        self.append_log(message, "success")
         self.open_folder_button.setEnabled(True)
 
     def download_error(self, error_message):
@@ -260,68 +210,23 @@ class DownloadDialog(QDialog):
         self.open_folder_button.setEnabled(True)
 
     def append_log(self, text, log_type="info"):
-        if log_type == "success" and any(
-            "успешно" in line.lower() or "уже был скачан" in line.lower()
-            for line in self.log_text.toPlainText().splitlines()
-        ):
-            return
-        cursor = self.log_text.textCursor()
-        cursor.movePosition(QTextCursor.MoveOperation.End)
-        if log_type == "error":
-            color = QColor("#ef4444")
-        elif log_type == "warning":
-            color = QColor("#f59e0b")
-        elif log_type == "success":
-            color = QColor("#22c55e")
-        elif log_type == "debug":
-            color = QColor("#94a3b8")
-        else:
-            color = QColor("#e5e7eb")
-        format = cursor.charFormat()
-        format.setForeground(color)
-        cursor.setCharFormat(format)
-        cursor.insertText(text + "\n")
-        self.log_text.setTextCursor(cursor)
-        self.log_text.ensureCursorVisible()
-        self.log_text.repaint()
+        self.log_text.append_log(text, log_type)
 
     def set_last_downloaded_file(self, file_path):
         self.last_downloaded_file = file_path
 
     def open_folder(self):
-        if self.last_downloaded_file and os.path.exists(self.last_downloaded_file):
-            if sys.platform.startswith("win"):
-                subprocess.run(
-                    [
-                        "explorer",
-                        "/select,",
-                        os.path.normpath(self.last_downloaded_file),
-                    ]
-                )
-            elif sys.platform.startswith("darwin"):
-                subprocess.run(["open", "-R", self.last_downloaded_file])
-            else:
-                subprocess.run(["xdg-open", os.path.dirname(self.last_downloaded_file)])
-        elif os.path.exists(self.save_path):
-            if sys.platform.startswith("win"):
-                os.startfile(self.save_path)
-            else:
-                subprocess.run(["xdg-open", self.save_path])
+        reveal_file(self.last_downloaded_file, self.save_path)
 
     def closeEvent(self, event):
         # Завершаем поток загрузки, если он активен
-        if hasattr(self, "worker") and self.worker and self.worker.isRunning():
-            if hasattr(self.worker, "cancel"):
-                self.worker.cancel()
-            self.worker.quit()
-            self.worker.wait(3000)  # Ждем до 3 секунд
-            if self.worker.isRunning():
-                self.worker.terminate()
-                self.worker.wait(1000)
+        if self.owns_worker and self.worker and self.worker.isRunning():
+            # Поток остановится сам и удалит недокачанный файл, окно не ждет дольше
+            self.worker.cancel()
+            wait_threads([self.worker])
 
         self.settings["download_dialog_size"] = [
             self.size().width(),
             self.size().height(),
         ]
-        save_settings(self.settings)
         super().closeEvent(event)
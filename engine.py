@@ -0,0 +1,501 @@
+import glob
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+from archive import archive_key, get_download_archive
+from bandwidth import PRIORITY_NORMAL, get_bandwidth_scheduler
+from cache import get_metadata_cache
+from formats import FormatIndex, constraint_selector, get_format_policy
+from logs import LOG_LEVELS, YTDLLogger, is_verbose, resolve_log_level
+from metrics import (
+    OUTCOME_ARCHIVED,
+    OUTCOME_CANCELLED,
+    OUTCOME_DONE,
+    OUTCOME_ERROR,
+    JobMetrics,
+    get_metrics_recorder,
+)
+from postprocess import (
+    DeferredPostprocess,
+    get_postprocess_policy,
+    get_postprocess_pool,
+    postprocess_options,
+)
+from progress import DEFAULT_MAX_RATE, ProgressReporter
+from segmented import (
+    ENGINE_SEGMENTED,
+    SegmentedDownload,
+    get_download_engine,
+    get_segmented_policy,
+    segmented_files,
+)
+from sessions import NETWORK_OPTIONS, get_session_pool
+from storage import (
+    AlreadyDownloaded,
+    SpaceCheck,
+    get_storage_policy,
+    job_staging_dir,
+    preallocate,
+    remove_empty_dir,
+    storage_options,
+)
+from utils import get_settings, host_setting, media_urls_expired
+
+DEFAULT_CONCURRENT_FRAGMENTS = 4
+SUCCESS_MESSAGE = "Загрузка завершена успешно!"
+ARCHIVED_MESSAGE = "Файл уже был скачан."
+# Как часто ожидание обработки проверяет отмену, секунды
+POSTPROCESS_POLL = 0.2
+
+
+def partial_files(filename):
+    """Временные файлы yt-dlp для недокачанного filename"""
+    part = filename + ".part"
+    paths = [part, filename + ".ytdl", *segmented_files(filename)]
+    # Фрагменты HLS/DASH скачиваются в отдельные файлы рядом с .part
+    paths.extend(glob.glob(glob.escape(part) + "-Frag*"))
+    return [path for path in paths if os.path.exists(path)]
+
+
+def remove_partial_files(filenames):
+    """Удаляет временные файлы загрузок и возвращает число удаленных"""
+    removed = 0
+    for filename in filenames:
+        for path in partial_files(filename):
+            try:
+                os.remove(path)
+                removed += 1
+            except OSError:
+                pass
+    return removed
+
+
+def concurrent_fragments(url):
+    """Число параллельно скачиваемых фрагментов HLS/DASH для хоста URL"""
+    settings = get_settings()
+    return host_setting(
+        settings.get("concurrent_fragments_hosts", {}),
+        url,
+        settings.get("concurrent_fragments", DEFAULT_CONCURRENT_FRAGMENTS),
+    )
+
+
+def build_ydl_opts(url, save_path, format_id, progress_hook, logger, storage=None):
+    """Параметры YoutubeDL; save_path - каталог, куда пишутся файлы при загрузке"""
+    if storage is None:
+        storage = get_storage_policy()
+    return {
+        "format": format_id if format_id else "best",
+        "outtmpl": os.path.join(save_path, "%(title)s.%(ext)s"),
+        "progress_hooks": [progress_hook],
+        "logger": logger,
+        "noprogress": False,
+        "ignoreerrors": True,
+        "no_warnings": False,
+        "extract_flat": False,
+        "quiet": False,
+        # Без verbose yt-dlp даже не формирует отладочные сообщения
+        "verbose": is_verbose(logger.level),
+        "geo_bypass": True,
+        "geo_bypass_country": "RU",
+        "retries": 10,  # Добавлено: количество попыток
+        "fragment_retries": 10,  # Для фрагментированных видео
+        "concurrent_fragment_downloads": concurrent_fragments(url),
+        # Те же заголовки и таймауты, что при поиске: соединения общие
+        **NETWORK_OPTIONS,
+        **postprocess_options(get_postprocess_policy()),
+        **storage_options(storage),
+    }
+
+
+class DownloadJob:
+    """Загрузка одного видео без зависимости от Qt.
+
+    Колбэки вызываются из потока загрузки: on_progress(percent, text,
+    downloaded_bytes, total_bytes), on_log(message, type) и on_file(path)
+    при смене файла. run() возвращает True после успешной загрузки или если
+    видео уже есть в архиве загрузок (тогда skipped = True), False при
+    отмене и выбрасывает исключение при ошибке. При отмене недокачанные
+    файлы удаляются, если только cancel() не вызван с keep_partial=True.
+
+    Если скачанному файлу нужна обработка ffmpeg (слияние дорожек,
+    перепаковка, обложка), run() возвращается, как только байты на диске, а
+    обработка идет в пуле процессов: тогда postprocessing - ее Future, и
+    результат нужно дождаться через wait_postprocess().
+    """
+
+    def __init__(
+        self,
+        url,
+        save_path,
+        format_id=None,
+        info=None,
+        on_progress=None,
+        on_log=None,
+        on_file=None,
+        use_archive=True,
+        priority=PRIORITY_NORMAL,
+        max_height=None,
+        max_size=None,
+        log_level=None,
+        engine=None,
+    ):
+        self.url = url
+        self.save_path = save_path
+        self.format_id = format_id
+        # Ограничения для автоматического выбора формата, если он не задан явно
+        self.max_height = max_height
+        self.max_size = max_size  # байты
+        if format_id is None and (max_height or max_size):
+            self.archive_format = constraint_selector(max_height, max_size)
+        else:
+            self.archive_format = format_id
+        self.info = info  # Уже извлеченная информация, если есть
+        self.on_progress = on_progress or (lambda *args: None)
+        self.on_log = on_log or (lambda *args: None)
+        self.on_file = on_file
+        # Сообщения ниже уровня не передаются в on_log; None - из настроек
+        self.log_level = resolve_log_level(log_level)
+        # Загрузчик прямых файлов: yt-dlp или частями в несколько соединений
+        self.engine = get_download_engine(engine)
+        self.use_archive = use_archive
+        # Видео найдено в архиве загрузок и не скачивалось повторно
+        self.skipped = False
+        self.archived_path = None
+        self.priority = priority
+        # Доля общей полосы, выделяется с первыми скачанными байтами
+        self.share = None
+        self._share_lock = threading.Lock()
+        self._share_counted = 0
+        self._cancel_event = threading.Event()
+        self._is_cancelled = False
+        self.keep_partial = False
+        # Итоговые имена файлов, которые начали скачиваться
+        self._filenames = set()
+        self._last_filename = None
+        # Настройки записи на диск и промежуточный каталог, задаются в run()
+        self._storage = None
+        self._staging = None
+        self._allocated = set()
+        # Замеры фаз текущего запуска, создаются в run()
+        self.metrics = None
+        # Обработка скачанного файла в пуле процессов, если она нужна
+        self.postprocessing = None
+        self._result = None
+        self._archive = None
+        self._retries = 0
+        self.reporter = ProgressReporter(
+            self._report_progress,
+            self._log,
+            max_rate=get_settings().get("progress_rate", DEFAULT_MAX_RATE),
+        )
+
+    @property
+    def is_cancelled(self):
+        return self._is_cancelled
+
+    def cancel(self, keep_partial=False):
+        """Отменяет загрузку.
+
+        С keep_partial=True (пауза, выход из приложения) файлы .part остаются,
+        и следующая загрузка того же видео продолжит их.
+        """
+        self.keep_partial = keep_partial
+        self._is_cancelled = True
+        self._cancel_event.set()
+
+    def discard_partial(self):
+        """Удаляет недокачанные файлы уже остановленной загрузки"""
+        removed = remove_partial_files(self._filenames)
+        if removed:
+            self._log(f"Удалено временных файлов: {removed}", "info")
+        return removed
+
+    def set_priority(self, priority):
+        self.priority = priority
+        if self.share:
+            self.share.set_priority(priority)
+
+    def _report_progress(self, percent, text, downloaded_bytes, total_bytes):
+        self.on_progress(percent, text, downloaded_bytes, total_bytes)
+
+    def _log(self, message, log_type="info"):
+        if LOG_LEVELS[log_type] >= self.log_level:
+            self.on_log(message, log_type)
+
+    def run(self):
+        self.metrics = JobMetrics(self.url)
+        self.postprocessing = None
+        logger = YTDLLogger(self._log, lambda: self._is_cancelled, self.log_level)
+        self._storage = get_storage_policy()
+        # Файл пишется на быстрый локальный диск и переносится после загрузки
+        self._staging = job_staging_dir(self._storage, self.url, self.format_id)
+        ydl_opts = build_ydl_opts(
+            self.url,
+            self._staging or self.save_path,
+            self.format_id,
+            self._progress_hook,
+            logger,
+            self._storage,
+        )
+        self.reporter.reset()
+        self._log("Начинаем загрузку...", "info")
+        archive = get_download_archive() if self.use_archive else None
+        error = None
+        try:
+            # Проверяем архив до любых запросов к сети
+            if archive and self._skip_archived(
+                archive.find(
+                    self.url, archive_key(self.info or {}), self.archive_format
+                )
+            ):
+                return True
+            return self._download(ydl_opts, logger, archive)
+        except Exception as e:
+            error = str(e)
+            raise
+        finally:
+            if self.share:
+                self.share.release()
+                self.share = None
+            if self._is_cancelled and not self.keep_partial:
+                self.discard_partial()
+            if self.postprocessing is None or error is not None:
+                self._record_metrics(error, logger.retries)
+                self._remove_staging()
+            else:
+                # Замер закончится вместе с обработкой
+                self._retries = logger.retries
+
+    def _record_metrics(self, error, retries):
+        if self._is_cancelled:
+            outcome, error = OUTCOME_CANCELLED, None
+        elif error is not None:
+            outcome = OUTCOME_ERROR
+        elif self.skipped:
+            outcome = OUTCOME_ARCHIVED
+        else:
+            outcome = OUTCOME_DONE
+        self.metrics.finish(outcome, error, retries)
+        get_metrics_recorder().record(
+            self.metrics, lambda message: self._log(message, "warning")
+        )
+
+    def _download(self, ydl_opts, logger, archive):
+        cache = get_metadata_cache()
+        # Готовый экземпляр YoutubeDL и уже открытые соединения из пула
+        with get_session_pool().lease(ydl_opts) as ydl:
+            deferred = DeferredPostprocess(
+                ydl, move_to=self.save_path if self._staging else None
+            )
+            SpaceCheck(
+                ydl,
+                [self._staging or self.save_path, self.save_path],
+                self._storage["free_space_margin_mb"] * 1024**2,
+                final_dir=self.save_path if self._staging else None,
+            )
+            if self.engine == ENGINE_SEGMENTED:
+                SegmentedDownload(ydl, get_segmented_policy())
+            # Без переданной информации (задание из демона, очереди заданий)
+            # пригодится результат недавнего разбора той же ссылки
+            info = self.info or self._cached_info(cache)
+            if info and media_urls_expired(info, cache.media_ttl):
+                self._log(
+                    "Ссылки на форматы устарели, получаем информацию заново...",
+                    "info",
+                )
+                info = None
+            self.metrics.info_reused = info is not None
+            if info is None:
+                self._log("Получаем информацию о видео...", "info")
+                self.metrics.mark("extract_start")
+                info = ydl.extract_info(self.url, download=False)
+                self.metrics.mark("extract_end")
+                if info:
+                    info.setdefault("epoch", int(time.time()))
+                    self._cache_info(cache, info)
+            if self._is_cancelled:
+                return False
+            if not info:
+                raise Exception("Не удалось получить информацию о видео")
+            key = archive_key(info)
+            if key:
+                self.metrics.extractor, self.metrics.video_id = key
+            # URL мог не совпасть ни с одним экстрактором, но id видео уже известен
+            if archive and self._skip_archived(
+                archive.find(key=key, format_id=self.archive_format)
+            ):
+                return True
+            title = info.get("title", "Без названия")
+            duration = info.get("duration", 0)
+            duration_str = f"{duration // 60}:{duration % 60:02d}"
+            self._log(f"Название: {title}", "info")
+            self._log(f"Длительность: {duration_str}", "info")
+            index = FormatIndex(info, get_format_policy())
+            if index.options:
+                self._log(f"Доступно форматов: {len(index.options)}", "info")
+                best_format = index.best()
+                if best_format.height:
+                    self._log(f"Лучшее качество: {best_format.height}p", "info")
+            if self.format_id is None and (self.max_height or self.max_size):
+                option = index.best(self.max_height, self.max_size)
+                if option is None:
+                    raise Exception("Нет формата, подходящего под ограничения")
+                self._log(f"Выбран формат: {option.label()}", "info")
+                # Формат в параметрах уже разобран при создании YoutubeDL
+                ydl.format_selector = ydl.build_format_selector(option.format_id)
+            self._log("Начинаем скачивание...", "info")
+            logger.last_error = None
+            # Скачиваем по уже полученной информации, без повторного извлечения
+            self.metrics.mark("download_start")
+            try:
+                result = ydl.process_ie_result(info, download=True)
+            except AlreadyDownloaded as e:
+                # Как yt-dlp без промежуточного каталога: файл не скачивается
+                self._log(str(e), "info")
+                if self.on_file:
+                    self.on_file(e.path)
+                self.metrics.mark("download_end")
+                self._complete(info, archive, e.path)
+                return True
+            self.metrics.format_id = (result or {}).get("format_id")
+            if self._is_cancelled:
+                return False
+            # С ignoreerrors yt-dlp не выбрасывает исключение, а только пишет ошибку
+            if logger.last_error:
+                raise Exception(logger.last_error)
+        if deferred.task:
+            # Слот загрузки освобождается сразу, ffmpeg работает в пуле
+            self._result, self._archive = result, archive
+            self.postprocessing = get_postprocess_pool().submit(deferred.task)
+            self._log("Файл скачан, обработка идет в фоне...", "info")
+            return True
+        self.metrics.mark("download_end")
+        downloads = (result or {}).get("requested_downloads") or [{}]
+        self._complete(result, archive, downloads[0].get("filepath"))
+        return True
+
+    def wait_postprocess(self):
+        """Ждет обработки скачанного файла в пуле.
+
+        Возвращает True, когда файл готов, False при отмене (начатая
+        обработка при этом доводится до конца в пуле) и выбрасывает
+        исключение при ошибке ffmpeg.
+        """
+        error = None
+        try:
+            while True:
+                if self._cancel_event.is_set():
+                    self.postprocessing.cancel()
+                    return False
+                try:
+                    outcome = self.postprocessing.result(POSTPROCESS_POLL)
+                    break
+                except FutureTimeoutError:
+                    continue
+            for message, log_type in outcome["log"]:
+                self._log(message, log_type)
+            if outcome["error"]:
+                raise Exception(outcome["error"])
+            if outcome["filepath"] and self.on_file:
+                self.on_file(outcome["filepath"])
+            self.metrics.mark("download_end")
+            self._complete(self._result, self._archive, outcome["filepath"])
+            return True
+        except Exception as e:
+            error = str(e)
+            raise
+        finally:
+            self._record_metrics(error, self._retries)
+            self._remove_staging()
+
+    def _remove_staging(self):
+        # Подкаталог остается, только пока в нем есть недокачанные файлы
+        if self._staging:
+            remove_empty_dir(self._staging)
+
+    def _complete(self, result, archive, filepath):
+        if archive and result:
+            archive.add(
+                result,
+                self.archive_format,
+                filepath or self._last_filename,
+                urls=(self.url,),
+            )
+        self._log(SUCCESS_MESSAGE, "success")
+
+    def _cached_info(self, cache):
+        # Кэш необязателен: занятая другим процессом база не прерывает загрузку
+        try:
+            return cache.get(self.url)
+        except sqlite3.Error as e:
+            self._log(f"Кэш метаданных недоступен: {e}", "warning")
+            return None
+
+    def _cache_info(self, cache, info):
+        try:
+            cache.put(self.url, info)
+        except sqlite3.Error as e:
+            self._log(f"Не удалось сохранить информацию в кэш: {e}", "warning")
+
+    def _skip_archived(self, entry):
+        if entry is None:
+            return False
+        self.skipped = True
+        self.archived_path = entry["path"]
+        if entry["path"] and self.on_file:
+            self.on_file(entry["path"])
+        self._log(ARCHIVED_MESSAGE, "success")
+        return True
+
+    def _progress_hook(self, d):
+        if d.get("filename") and d.get("status") == "downloading":
+            self._filenames.add(d["filename"])
+            if self._storage["preallocate"]:
+                self._preallocate(d)
+        if self._is_cancelled:
+            # Прерываем загрузку yt-dlp; что делать с .part, решает run()
+            import yt_dlp
+
+            raise yt_dlp.utils.DownloadCancelled()
+        try:
+            self.reporter.hook(d)
+        except Exception as e:
+            self._log(f"Ошибка при обновлении прогресса: {str(e)}", "error")
+            self._log(f"Данные прогресса: {d}", "debug")
+        if self.reporter.downloaded:
+            self.metrics.transfer(self.reporter.downloaded)
+        self._throttle()
+        filename = d.get("filename")
+        if filename and filename != self._last_filename:
+            self._last_filename = filename
+            if self.on_file:
+                self.on_file(filename)
+
+    def _preallocate(self, d):
+        # Место под файл выделяется один раз, когда известен точный размер;
+        # у фрагментов HLS/DASH есть только оценка, и их это не касается
+        path, total = d.get("tmpfilename"), d.get("total_bytes")
+        if not path or not total or path in self._allocated:
+            return
+        self._allocated.add(path)
+        if preallocate(path, total):
+            self._log(f"Выделено место под файл: {total / 1024**2:.1f} МБ", "debug")
+
+    def _throttle(self):
+        # Хук вызывается на каждый прочитанный блок, поэтому пауза здесь
+        # замедляет чтение из сокета; при параллельных фрагментах - в каждом потоке
+        with self._share_lock:
+            if self.share is None:
+                self.share = get_bandwidth_scheduler().register(self.priority, self.url)
+            downloaded = self.reporter.downloaded
+            delta = max(downloaded - self._share_counted, 0)
+            self._share_counted = max(self._share_counted, downloaded)
+        delay = self.share.consume(delta)
+        # Ждем частями, пока долг ведра не погашен, чтобы заметить отмену
+        # и смену выделенной полосы
+        while delay and not self._cancel_event.wait(delay):
+            delay = self.share.consume(0)
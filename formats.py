@@ -0,0 +1,258 @@
+import bisect
+import shutil
+
+from utils import get_settings
+
+# Порядок предпочтения видеокодеков при равном разрешении и частоте кадров
+DEFAULT_CODECS = ("avc1", "vp9", "av01", "hevc")
+DEFAULT_POLICY = {
+    "codecs": list(DEFAULT_CODECS),
+    "ext": "mp4",
+    # Объединять отдельные видео и аудио дорожки (нужен ffmpeg)
+    "merge": None,
+}
+# Совместимые контейнеры для объединения видео и аудио без перекодирования
+AUDIO_EXT_FOR_VIDEO = {"mp4": "m4a", "webm": "webm"}
+
+
+def codec_family(codec):
+    codec = (codec or "").lower()
+    for family, prefixes in (
+        ("avc1", ("avc", "h264")),
+        ("hevc", ("hev", "hvc", "h265")),
+        ("vp9", ("vp9", "vp09")),
+        ("av01", ("av01", "av1")),
+    ):
+        if codec.startswith(prefixes):
+            return family
+    return codec.split(".")[0]
+
+
+def has_video(f):
+    return f.get("vcodec") != "none"
+
+
+def has_audio(f):
+    return f.get("acodec") != "none"
+
+
+def estimate_size(f, duration):
+    """Точный или примерный размер формата в байтах и признак точности"""
+    if f.get("filesize"):
+        return f["filesize"], True
+    if f.get("filesize_approx"):
+        return f["filesize_approx"], False
+    if f.get("tbr") and duration:
+        return int(f["tbr"] * 1000 / 8 * duration), False
+    return None, False
+
+
+class FormatOption:
+    """Вариант загрузки: готовый формат или пара видео + аудио"""
+
+    def __init__(self, video, audio, duration):
+        self.video = video
+        self.audio = audio
+        main = video or audio
+        if video is not None and audio is not None and video is not audio:
+            self.format_id = f"{video['format_id']}+{audio['format_id']}"
+            self.merged = True
+        else:
+            self.format_id = main["format_id"]
+            self.merged = False
+        self.height = (video or {}).get("height") or 0
+        self.width = (video or {}).get("width") or 0
+        self.fps = (video or {}).get("fps") or 0
+        self.vcodec = codec_family((video or {}).get("vcodec")) if video else ""
+        self.acodec = codec_family((audio or {}).get("acodec")) if audio else ""
+        self.ext = "mkv" if self.merged and not self._same_container() else main["ext"]
+        # Для готового формата video и audio - один и тот же словарь
+        tracks = [video] if video is audio else [f for f in (video, audio) if f]
+        self.tbr = sum(f.get("tbr") or 0 for f in tracks)
+        sizes = [estimate_size(f, duration) for f in tracks]
+        if all(size is not None for size, _ in sizes):
+            self.filesize = sum(size for size, _ in sizes)
+            self.size_exact = all(exact for _, exact in sizes)
+        else:
+            self.filesize = None
+            self.size_exact = False
+
+    def _same_container(self):
+        return AUDIO_EXT_FOR_VIDEO.get(self.video.get("ext")) == self.audio.get("ext")
+
+    def label(self):
+        parts = []
+        if self.height:
+            fps = f"{int(self.fps)}" if self.fps and self.fps > 30 else ""
+            parts.append(f"{self.height}p{fps}")
+        if self.width and self.height:
+            parts.append(f"{self.width}x{self.height}")
+        elif not self.video:
+            parts.append("только аудио")
+        parts.append(self.ext.upper())
+        codecs = "+".join(codec for codec in (self.vcodec, self.acodec) if codec)
+        if codecs:
+            parts.append(codecs)
+        if self.filesize:
+            approx = "" if self.size_exact else "~"
+            parts.append(f"{approx}{self.filesize / (1024 * 1024):.1f}MB")
+        return " | ".join(parts)
+
+    def as_dict(self):
+        """Словарь для сигналов и очереди; исходные форматы info не изменяются"""
+        return {
+            "format_id": self.format_id,
+            "height": self.height,
+            "fps": self.fps,
+            "ext": self.ext,
+            "vcodec": self.vcodec,
+            "acodec": self.acodec,
+            "filesize": self.filesize,
+            "label": self.label(),
+        }
+
+
+class FormatIndex:
+    """Ранжированные варианты загрузки видео и быстрый выбор по ограничениям.
+
+    Индекс строится один раз по info["formats"] (сам info не изменяется).
+    Для каждого ограничения по высоте заранее строится граница Парето
+    "размер - качество", поэтому запрос "лучшее не больше X МБ и Y p" -
+    два двоичных поиска по коротким таблицам, а повторные запросы берутся
+    из словаря.
+    """
+
+    def __init__(self, info, policy=None):
+        self.policy = {**DEFAULT_POLICY, **(policy or {})}
+        merge = self.policy["merge"]
+        self.merge = shutil.which("ffmpeg") is not None if merge is None else merge
+        self.duration = info.get("duration") or 0
+        ranked = sorted(
+            self._candidates(info.get("formats") or []),
+            key=self.rank_key,
+            reverse=True,
+        )
+        # Для показа убираем повторы, а запросы по размеру видят все варианты
+        self.options = self._unique(ranked)
+        self._build_tables(ranked)
+        self._queries = {}
+
+    def _candidates(self, formats):
+        formats = [f for f in formats if f.get("format_id")]
+        complete = [f for f in formats if has_video(f) and has_audio(f)]
+        video_only = [f for f in formats if has_video(f) and not has_audio(f)]
+        audio_only = [f for f in formats if has_audio(f) and not has_video(f)]
+        options = [FormatOption(f, f, self.duration) for f in complete]
+        best_audio = sorted(audio_only, key=self._audio_key, reverse=True)
+        if self.merge and best_audio:
+            for video in video_only:
+                # Сначала аудио в том же контейнере, чтобы обойтись без mkv
+                wanted = AUDIO_EXT_FOR_VIDEO.get(video.get("ext"))
+                audio = next(
+                    (a for a in best_audio if a.get("ext") == wanted), best_audio[0]
+                )
+                options.append(FormatOption(video, audio, self.duration))
+        elif not complete:
+            # Без ffmpeg раздельные дорожки можно скачать только по одной
+            options.extend(FormatOption(f, None, self.duration) for f in video_only)
+        options.extend(FormatOption(None, f, self.duration) for f in audio_only)
+        return options
+
+    def _audio_key(self, f):
+        return (f.get("abr") or f.get("tbr") or 0, f.get("asr") or 0)
+
+    def _codec_rank(self, codec):
+        codecs = self.policy["codecs"]
+        return len(codecs) - codecs.index(codec) if codec in codecs else 0
+
+    def rank_key(self, option):
+        return (
+            bool(option.video),
+            option.height,
+            option.fps,
+            self._codec_rank(option.vcodec),
+            option.ext == self.policy["ext"],
+            option.tbr,
+            option.filesize or 0,
+        )
+
+    def _unique(self, options):
+        # Одинаковые по виду варианты (разные CDN, протоколы) показываем один раз
+        seen = set()
+        unique = []
+        for option in options:
+            key = (
+                bool(option.video),
+                option.height,
+                round(option.fps),
+                option.vcodec,
+                option.acodec,
+                option.ext,
+            )
+            if key not in seen:
+                seen.add(key)
+                unique.append(option)
+        return unique
+
+    def _build_tables(self, ranked):
+        videos = [option for option in ranked if option.video]
+        self.heights = sorted({option.height for option in videos})
+        # Для каждого ограничения по высоте: лучший вариант и граница Парето
+        self._best_by_height = []
+        self._frontiers = []
+        for height in self.heights:
+            allowed = [option for option in videos if option.height <= height]
+            self._best_by_height.append(allowed[0])
+            self._frontiers.append(self._frontier(allowed))
+        self._any_frontier = self._frontier(ranked)
+
+    def _frontier(self, ranked):
+        """Варианты с известным размером, где каждый следующий крупнее и лучше"""
+        sized = sorted(
+            (option for option in ranked if option.filesize),
+            key=lambda option: (option.filesize, [-x for x in self.rank_key(option)]),
+        )
+        sizes, options = [], []
+        for option in sized:
+            if options and self.rank_key(option) <= self.rank_key(options[-1]):
+                continue
+            sizes.append(option.filesize)
+            options.append(option)
+        return sizes, options
+
+    def best(self, max_height=None, max_size=None):
+        """Лучший вариант не выше max_height и не больше max_size байт или None"""
+        query = (max_height, max_size)
+        if query not in self._queries:
+            self._queries[query] = self._best(max_height, max_size)
+        return self._queries[query]
+
+    def _best(self, max_height, max_size):
+        if max_height is None:
+            if max_size is None:
+                return self.options[0] if self.options else None
+            frontier = self._any_frontier
+        else:
+            position = bisect.bisect_right(self.heights, max_height) - 1
+            if position < 0:
+                return None
+            if max_size is None:
+                return self._best_by_height[position]
+            frontier = self._frontiers[position]
+        sizes, options = frontier
+        position = bisect.bisect_right(sizes, max_size) - 1
+        return options[position] if position >= 0 else None
+
+
+def get_format_policy():
+    return get_settings().get("format_policy", DEFAULT_POLICY)
+
+
+def constraint_selector(max_height=None, max_size=None):
+    """Описание ограничений для архива загрузок, например best[height<=720]"""
+    parts = []
+    if max_height:
+        parts.append(f"[height<={max_height}]")
+    if max_size:
+        parts.append(f"[filesize<={max_size}]")
+    return "best" + "".join(parts)
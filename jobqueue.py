@@ -0,0 +1,704 @@
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import signal
+import socket
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+
+from bandwidth import PRIORITY_NAMES, PRIORITY_NORMAL
+from cli import EventPrinter, read_urls
+from engine import DownloadJob
+from logs import LOG_LEVELS
+from postprocess import shutdown_postprocess_pool
+from segmented import ENGINES
+from sessions import close_session_pool
+from utils import get_settings, user_config_dir
+
+QUEUE_FILE = "jobs.sqlite3"
+DEFAULT_JOB_QUEUE = {
+    # Файл очереди; null - jobs.sqlite3 рядом с настройками
+    "path": None,
+    # Сколько загрузок одновременно ведет один процесс-обработчик
+    "workers": 2,
+    # Аренда, которую не продлили за это время, считается брошенной упавшим
+    # процессом, и загрузку может взять другой обработчик
+    "lease_seconds": 60,
+    "heartbeat_seconds": 15,
+    # После стольких брошенных аренд загрузка считается ошибочной, чтобы
+    # ссылка, роняющая процесс, не роняла обработчики по кругу
+    "max_attempts": 3,
+    # Как часто свободный обработчик проверяет очередь, секунды
+    "poll_seconds": 2,
+}
+# Случайная добавка к паузе опроса, чтобы процессы не обращались к базе разом
+POLL_JITTER = 0.5
+
+STATUS_QUEUED = "queued"
+STATUS_LEASED = "leased"
+STATUS_DONE = "done"
+STATUS_ERROR = "error"
+STATUS_CANCELLED = "cancelled"
+FINISHED_STATUSES = (STATUS_DONE, STATUS_ERROR, STATUS_CANCELLED)
+STATUSES = (STATUS_QUEUED, STATUS_LEASED, *FINISHED_STATUSES)
+
+
+def get_job_queue_policy():
+    return {**DEFAULT_JOB_QUEUE, **get_settings().get("job_queue", {})}
+
+
+def job_queue_path(policy=None):
+    policy = policy or get_job_queue_policy()
+    return policy.get("path") or os.path.join(user_config_dir(), QUEUE_FILE)
+
+
+class Lease:
+    """Загрузка, выданная обработчику. token отличает эту аренду от следующих
+    аренд той же загрузки: продлить или завершить ее может только владелец"""
+
+    def __init__(self, job_id, url, request, token, attempt):
+        self.id = job_id
+        self.url = url
+        self.request = request
+        self.token = token
+        self.attempt = attempt
+        # Аренда потеряна: загрузку отменили или ее взял другой обработчик
+        self.lost = False
+        self.cancelled = False
+        self.file = None
+
+
+class JobStore:
+    """Очередь загрузок в SQLite (WAL), общая для процессов на этой машине.
+
+    Загрузка выдается через claim() в аренду на lease_seconds и должна
+    продлеваться heartbeat(). Выдача идет в транзакции BEGIN IMMEDIATE,
+    поэтому два процесса не получат одну загрузку; продление и завершение
+    проверяют token аренды, поэтому обработчик, у которого аренду уже
+    забрали, не может ни продлить ее, ни записать результат. Аренды упавших
+    процессов истекают, и загрузки возвращаются в очередь при следующей
+    выдаче.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        # Транзакции открываются явно; timeout - ожидание блокировки записи
+        # другим процессом
+        self._conn = sqlite3.connect(
+            path, timeout=30, isolation_level=None, check_same_thread=False
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                url TEXT NOT NULL,
+                request TEXT NOT NULL,
+                priority INTEGER NOT NULL,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                owner TEXT,
+                token TEXT,
+                lease_expires REAL,
+                archived INTEGER NOT NULL DEFAULT 0,
+                file TEXT,
+                error TEXT,
+                created REAL NOT NULL,
+                updated REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS jobs_claim ON jobs (status, priority DESC, id);
+            """
+        )
+        self.recovered = 0
+
+    def _transaction(self):
+        return _Transaction(self._conn)
+
+    def add(self, urls, request=None, priority=PRIORITY_NORMAL):
+        """Ставит ссылки в очередь и возвращает номера загрузок"""
+        now = time.time()
+        data = json.dumps(request or {})
+        with self._lock, self._transaction():
+            return [
+                self._conn.execute(
+                    "INSERT INTO jobs (url, request, priority, status, created, "
+                    "updated) VALUES (?, ?, ?, ?, ?, ?)",
+                    (url, data, priority, STATUS_QUEUED, now, now),
+                ).lastrowid
+                for url in urls
+            ]
+
+    def claim(self, owner, lease_seconds, max_attempts):
+        """Выдает следующую загрузку в аренду или возвращает None"""
+        now = time.time()
+        with self._lock, self._transaction():
+            self._recover(now, max_attempts)
+            row = self._conn.execute(
+                "SELECT id, url, request, attempts FROM jobs WHERE status = ? "
+                "ORDER BY priority DESC, id LIMIT 1",
+                (STATUS_QUEUED,),
+            ).fetchone()
+            if row is None:
+                return None
+            job_id, url, request, attempts = row
+            token = uuid.uuid4().hex
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, owner = ?, token = ?, lease_expires = ?, "
+                "attempts = attempts + 1, updated = ? WHERE id = ?",
+                (STATUS_LEASED, owner, token, now + lease_seconds, now, job_id),
+            )
+        return Lease(job_id, url, json.loads(request), token, attempts + 1)
+
+    def _recover(self, now, max_attempts):
+        # Аренды, которые никто не продлил: процесс упал или завис
+        expired = self._conn.execute(
+            "SELECT id, attempts FROM jobs WHERE status = ? AND lease_expires < ?",
+            (STATUS_LEASED, now),
+        ).fetchall()
+        for job_id, attempts in expired:
+            if attempts >= max_attempts:
+                self._conn.execute(
+                    "UPDATE jobs SET status = ?, token = NULL, error = ?, updated = ? "
+                    "WHERE id = ?",
+                    (
+                        STATUS_ERROR,
+                        f"Обработчик не завершил загрузку за {attempts} попыток",
+                        now,
+                        job_id,
+                    ),
+                )
+            else:
+                self._conn.execute(
+                    "UPDATE jobs SET status = ?, token = NULL, owner = NULL, "
+                    "updated = ? WHERE id = ?",
+                    (STATUS_QUEUED, now, job_id),
+                )
+        self.recovered += len(expired)
+
+    def heartbeat(self, leases, lease_seconds):
+        """Продлевает аренды и возвращает {id: статус} для потерянных"""
+        now = time.time()
+        lost = {}
+        with self._lock, self._transaction():
+            for lease in leases:
+                updated = self._conn.execute(
+                    "UPDATE jobs SET lease_expires = ?, updated = ? "
+                    "WHERE id = ? AND token = ? AND status = ?",
+                    (now + lease_seconds, now, lease.id, lease.token, STATUS_LEASED),
+                ).rowcount
+                if not updated:
+                    row = self._conn.execute(
+                        "SELECT status FROM jobs WHERE id = ?", (lease.id,)
+                    ).fetchone()
+                    lost[lease.id] = row[0] if row else None
+        return lost
+
+    def finish(self, lease, status, file=None, archived=False, error=None):
+        """Записывает результат, если аренда еще принадлежит обработчику"""
+        with self._lock, self._transaction():
+            return bool(
+                self._conn.execute(
+                    "UPDATE jobs SET status = ?, token = NULL, lease_expires = NULL, "
+                    "file = ?, archived = ?, error = ?, updated = ? "
+                    "WHERE id = ? AND token = ? AND status = ?",
+                    (
+                        status,
+                        file,
+                        int(archived),
+                        error,
+                        time.time(),
+                        lease.id,
+                        lease.token,
+                        STATUS_LEASED,
+                    ),
+                ).rowcount
+            )
+
+    def release(self, lease):
+        """Возвращает загрузку в очередь при остановке обработчика; попытка
+        не засчитывается"""
+        with self._lock, self._transaction():
+            return bool(
+                self._conn.execute(
+                    "UPDATE jobs SET status = ?, owner = NULL, token = NULL, "
+                    "lease_expires = NULL, attempts = MAX(attempts - 1, 0), "
+                    "updated = ? WHERE id = ? AND token = ? AND status = ?",
+                    (STATUS_QUEUED, time.time(), lease.id, lease.token, STATUS_LEASED),
+                ).rowcount
+            )
+
+    def cancel(self, job_id):
+        """Отменяет загрузку; обработчик узнает об этом при продлении аренды"""
+        with self._lock, self._transaction():
+            return bool(
+                self._conn.execute(
+                    "UPDATE jobs SET status = ?, token = NULL, updated = ? "
+                    "WHERE id = ? AND status IN (?, ?)",
+                    (
+                        STATUS_CANCELLED,
+                        time.time(),
+                        job_id,
+                        STATUS_QUEUED,
+                        STATUS_LEASED,
+                    ),
+                ).rowcount
+            )
+
+    def retry(self, job_ids=None):
+        """Возвращает в очередь загрузки с ошибкой и отмененные"""
+        query = (
+            "UPDATE jobs SET status = ?, attempts = 0, error = NULL, owner = NULL, "
+            "updated = ? WHERE status IN (?, ?)"
+        )
+        params = [STATUS_QUEUED, time.time(), STATUS_ERROR, STATUS_CANCELLED]
+        if job_ids:
+            query += f" AND id IN ({', '.join('?' * len(job_ids))})"
+            params.extend(job_ids)
+        with self._lock, self._transaction():
+            return self._conn.execute(query, params).rowcount
+
+    def purge(self):
+        """Удаляет завершенные загрузки"""
+        with self._lock, self._transaction():
+            return self._conn.execute(
+                "DELETE FROM jobs WHERE status IN (?, ?, ?)", FINISHED_STATUSES
+            ).rowcount
+
+    def stats(self):
+        with self._lock:
+            counts = dict(
+                self._conn.execute(
+                    "SELECT status, COUNT(*) FROM jobs GROUP BY status"
+                ).fetchall()
+            )
+        return {status: counts.get(status, 0) for status in STATUSES}
+
+    def jobs(self, status=None, limit=None):
+        query = (
+            "SELECT id, url, priority, status, attempts, owner, archived, file, "
+            "error, created, updated FROM jobs"
+        )
+        params = []
+        if status:
+            query += " WHERE status = ?"
+            params.append(status)
+        query += " ORDER BY id"
+        if limit:
+            query += " LIMIT ?"
+            params.append(limit)
+        names = (
+            "id",
+            "url",
+            "priority",
+            "status",
+            "attempts",
+            "owner",
+            "archived",
+            "file",
+            "error",
+            "created",
+            "updated",
+        )
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        return [dict(zip(names, row)) for row in rows]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class _Transaction:
+    """BEGIN IMMEDIATE сразу берет блокировку записи: между чтением и
+    записью внутри транзакции другой процесс не может изменить очередь"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+
+
+class QueueWorker:
+    """Обработчик очереди в одном процессе.
+
+    workers потоков берут загрузки из JobStore и ведут их через DownloadJob,
+    а отдельный поток продлевает все аренды процесса. Если аренду продлить
+    не удалось (загрузку отменили или процесс так долго не отвечал, что ее
+    взял другой обработчик), загрузка останавливается, и результат не
+    записывается. Файл, которому нужна обработка ffmpeg, дожидается ее в
+    отдельном потоке, а поток загрузки сразу берет следующую.
+    """
+
+    def __init__(self, store, printer, policy=None, workers=None, log_level=None):
+        self.store = store
+        self.printer = printer
+        self.policy = policy or get_job_queue_policy()
+        self.workers = max(1, workers or self.policy["workers"])
+        self.log_level = log_level
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self.until_empty = False
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._active = {}  # id загрузки -> (Lease, DownloadJob)
+        # Потоки загрузки и ожидания обработки; последний завершившийся
+        # выставляет _idle
+        self._running = 0
+        self._idle = threading.Event()
+
+    def run(self, until_empty=False):
+        """Обрабатывает очередь до stop(); с until_empty - пока в ней есть загрузки"""
+        self.until_empty = until_empty
+        threading.Thread(target=self._heartbeat, daemon=True).start()
+        for _ in range(self.workers):
+            self._start_thread(self._work)
+        try:
+            self._wait()
+        except KeyboardInterrupt:
+            # Потоки вернут загрузки в очередь, как только те остановятся
+            self.stop()
+            self._wait()
+        self._stop.set()
+
+    def _wait(self):
+        # Event.wait, а не Thread.join: join, прерванный Ctrl+C, в Python 3.11
+        # может счесть работающий поток завершенным. Таймаут нужен, чтобы
+        # Ctrl+C доходил и на Windows
+        while not self._idle.wait(0.5):
+            pass
+
+    def _start_thread(self, target, *args):
+        with self._lock:
+            self._running += 1
+            self._idle.clear()
+        threading.Thread(
+            target=self._run_thread, args=(target, *args), daemon=True
+        ).start()
+
+    def _run_thread(self, target, *args):
+        try:
+            target(*args)
+        finally:
+            with self._lock:
+                self._running -= 1
+                if not self._running:
+                    self._idle.set()
+
+    def stop(self):
+        """Останавливает загрузки, оставляя .part, и возвращает их в очередь"""
+        self._stop.set()
+        with self._lock:
+            active = list(self._active.values())
+        for _lease, job in active:
+            job.cancel(keep_partial=True)
+
+    def _work(self):
+        policy = self.policy
+        while not self._stop.is_set():
+            recovered = self.store.recovered
+            lease = self.store.claim(
+                self.owner, policy["lease_seconds"], policy["max_attempts"]
+            )
+            if self.store.recovered > recovered:
+                self.printer.emit("recovered", count=self.store.recovered - recovered)
+            if lease is None:
+                if self.until_empty and self._drained():
+                    return
+                self._stop.wait(policy["poll_seconds"] + random.random() * POLL_JITTER)
+                continue
+            self._process(lease)
+
+    def _drained(self):
+        stats = self.store.stats()
+        return not stats[STATUS_QUEUED] and not stats[STATUS_LEASED]
+
+    def _process(self, lease):
+        job = self._make_job(lease)
+        with self._lock:
+            self._active[lease.id] = (lease, job)
+        self.printer.emit(
+            "start",
+            job=lease.id,
+            url=lease.url,
+            attempt=lease.attempt,
+            worker=self.owner,
+        )
+        try:
+            done = job.run()
+        except Exception as e:
+            self._failed(lease, job, e)
+            return
+        if done and job.postprocessing is not None:
+            # Слот свободен для следующей загрузки, аренда продлевается
+            self.printer.emit("downloaded", job=lease.id, url=lease.url)
+            self._start_thread(self._finish_postprocess, lease, job)
+            return
+        self._complete(lease, job, done)
+
+    def _finish_postprocess(self, lease, job):
+        try:
+            done = job.wait_postprocess()
+        except Exception as e:
+            self._failed(lease, job, e)
+            return
+        self._complete(lease, job, done)
+
+    def _complete(self, lease, job, done):
+        with self._lock:
+            self._active.pop(lease.id, None)
+        if done:
+            if self.store.finish(lease, STATUS_DONE, lease.file, job.skipped):
+                event = "archived" if job.skipped else "done"
+                self.printer.emit(event, job=lease.id, url=lease.url, path=lease.file)
+            else:
+                self._lost(lease)
+        else:
+            self._stopped(lease)
+
+    def _failed(self, lease, job, error):
+        with self._lock:
+            self._active.pop(lease.id, None)
+        if job.is_cancelled:
+            self._stopped(lease)
+            return
+        if self.store.finish(lease, STATUS_ERROR, error=str(error)):
+            self.printer.emit("error", job=lease.id, url=lease.url, message=str(error))
+        else:
+            self._lost(lease)
+
+    def _stopped(self, lease):
+        if lease.lost:
+            self._lost(lease)
+        elif self.store.release(lease):
+            self.printer.emit("released", job=lease.id, url=lease.url)
+
+    def _lost(self, lease):
+        event = "cancelled" if lease.cancelled else "lost"
+        self.printer.emit(event, job=lease.id, url=lease.url)
+
+    def _heartbeat(self):
+        policy = self.policy
+        while not self._stop.wait(policy["heartbeat_seconds"]):
+            with self._lock:
+                active = dict(self._active)
+            if not active:
+                continue
+            try:
+                lost = self.store.heartbeat(
+                    [lease for lease, _job in active.values()], policy["lease_seconds"]
+                )
+            except sqlite3.Error as e:
+                # База занята дольше таймаута: аренда еще действует, повторим
+                self.printer.emit("log", level="warning", message=str(e))
+                continue
+            for job_id, status in lost.items():
+                lease, job = active[job_id]
+                lease.lost = True
+                lease.cancelled = status == STATUS_CANCELLED
+                # Отмененная загрузка удаляет .part, взятая другим
+                # обработчиком - оставляет его новому владельцу
+                job.cancel(keep_partial=not lease.cancelled)
+
+    def _make_job(self, lease):
+        request = lease.request
+        printer = self.printer
+
+        def on_progress(percent, text, downloaded_bytes, total_bytes):
+            printer.emit(
+                "progress",
+                job=lease.id,
+                percent=percent,
+                downloaded=downloaded_bytes,
+                total=total_bytes,
+                speed=job.reporter.speed,
+                eta=job.reporter.eta,
+            )
+
+        def on_log(message, log_type):
+            printer.emit("log", job=lease.id, level=log_type, message=message)
+
+        def on_file(path):
+            lease.file = path
+            printer.emit("file", job=lease.id, path=path)
+
+        job = DownloadJob(
+            lease.url,
+            request["output"],
+            request.get("format"),
+            on_progress=on_progress,
+            on_log=on_log,
+            on_file=on_file,
+            use_archive=request.get("archive", True),
+            priority=request.get("priority", PRIORITY_NORMAL),
+            max_height=request.get("max_height"),
+            max_size=request.get("max_size"),
+            log_level=self.log_level or "error",
+            engine=request.get("engine"),
+        )
+        return job
+
+
+def run_worker(path, workers, log_level, until_empty):
+    """Процесс-обработчик: ведет загрузки из очереди до остановки"""
+    store = JobStore(path)
+    worker = QueueWorker(
+        store, EventPrinter(sys.stdout), workers=workers, log_level=log_level
+    )
+    # SIGTERM от systemd или kill останавливает так же, как Ctrl+C
+    signal.signal(signal.SIGTERM, lambda *args: worker.stop())
+    try:
+        worker.run(until_empty)
+    finally:
+        shutdown_postprocess_pool()
+        close_session_pool()
+        store.close()
+
+
+def main(argv=None):
+    settings = get_settings()
+    policy = get_job_queue_policy()
+    parser = argparse.ArgumentParser(
+        description="Очередь загрузок в SQLite, общая для нескольких "
+        "процессов-обработчиков. События выводятся в stdout построчно в "
+        "формате JSON."
+    )
+    parser.add_argument(
+        "--db",
+        default=job_queue_path(policy),
+        help="файл очереди (по умолчанию jobs.sqlite3 рядом с настройками)",
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    add = commands.add_parser("add", help="поставить ссылки в очередь")
+    add.add_argument(
+        "input",
+        nargs="?",
+        default="-",
+        help="файл со ссылками (можно несколько в строке); - или пусто для stdin",
+    )
+    add.add_argument(
+        "-o",
+        "--output",
+        default=settings.get("save_path", os.path.expanduser("~/Downloads")),
+        help="папка для сохранения",
+    )
+    add.add_argument("-f", "--format", help="формат yt-dlp (по умолчанию best)")
+    add.add_argument("--max-height", type=int, metavar="P")
+    add.add_argument("--max-size", type=float, metavar="MB")
+    add.add_argument("--engine", choices=ENGINES)
+    add.add_argument("--priority", choices=PRIORITY_NAMES, default="normal")
+    add.add_argument(
+        "--no-archive",
+        action="store_true",
+        help="не пропускать видео из архива загрузок и не записывать их в него",
+    )
+
+    work = commands.add_parser(
+        "work",
+        help="обрабатывать очередь; можно запускать в нескольких процессах",
+    )
+    work.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=policy["workers"],
+        help="одновременных загрузок в одном процессе",
+    )
+    work.add_argument(
+        "-p",
+        "--processes",
+        type=int,
+        default=1,
+        help="запустить столько процессов-обработчиков",
+    )
+    work.add_argument(
+        "--until-empty",
+        action="store_true",
+        help="завершиться, когда в очереди не останется загрузок",
+    )
+    work.add_argument("--log-level", choices=LOG_LEVELS)
+
+    commands.add_parser("status", help="число загрузок по состояниям")
+    list_parser = commands.add_parser("list", help="загрузки в очереди")
+    list_parser.add_argument("--status", choices=STATUSES)
+    list_parser.add_argument("--limit", type=int)
+    cancel = commands.add_parser("cancel", help="отменить загрузки")
+    cancel.add_argument("ids", type=int, nargs="+")
+    retry = commands.add_parser(
+        "retry", help="вернуть в очередь загрузки с ошибкой и отмененные"
+    )
+    retry.add_argument("ids", type=int, nargs="*")
+    commands.add_parser("purge", help="удалить завершенные загрузки")
+    args = parser.parse_args(argv)
+
+    if args.command == "work":
+        return work_command(args)
+
+    printer = EventPrinter(sys.stdout)
+    store = JobStore(args.db)
+    try:
+        if args.command == "add":
+            request = {
+                "output": os.path.abspath(args.output),
+                "format": args.format,
+                "engine": args.engine,
+                "priority": PRIORITY_NAMES[args.priority],
+                "archive": not args.no_archive,
+                "max_height": args.max_height,
+                "max_size": int(args.max_size * 1024**2) if args.max_size else None,
+            }
+            os.makedirs(request["output"], exist_ok=True)
+            urls = read_urls(args.input)
+            ids = store.add(urls, request, request["priority"])
+            for job_id, url in zip(ids, urls):
+                printer.emit("queued", job=job_id, url=url)
+        elif args.command == "status":
+            printer.emit("status", **store.stats())
+        elif args.command == "list":
+            for job in store.jobs(args.status, args.limit):
+                printer.emit("job", **job)
+        elif args.command == "cancel":
+            for job_id in args.ids:
+                printer.emit("cancelled", job=job_id, ok=store.cancel(job_id))
+        elif args.command == "retry":
+            printer.emit("retried", count=store.retry(args.ids))
+        elif args.command == "purge":
+            printer.emit("purged", count=store.purge())
+    finally:
+        store.close()
+    return 0
+
+
+def work_command(args):
+    worker_args = (args.db, args.workers, args.log_level, args.until_empty)
+    # Каждый процесс со своим GIL, пулами и соединением с базой; spawn не
+    # копирует потоки и открытые соединения родителя
+    context = multiprocessing.get_context("spawn")
+    processes = [
+        context.Process(target=run_worker, args=worker_args)
+        for _ in range(max(1, args.processes) - 1)
+    ]
+    for process in processes:
+        process.start()
+    try:
+        run_worker(*worker_args)
+    finally:
+        for process in processes:
+            process.join()
+    return 0
+
+
+if __name__ == "__main__":
+    # Пул обработки и обработчики запускают процессы, в том числе из exe
+    multiprocessing.freeze_support()
+    sys.exit(main())
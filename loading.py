@@ -1,68 +1,125 @@
 import os
+import sqlite3
+import time
 
-import yt_dlp
 from PySide6.QtCore import QThread, QTime, QTimer, Signal
 from PySide6.QtGui import QIcon
-from PySide6.QtWidgets import QDialog, QLabel, QTextEdit, QVBoxLayout
+from PySide6.QtWidgets import QDialog, QLabel, QVBoxLayout
 
-from utils import load_settings, save_settings
+from cache import get_metadata_cache
+from log_view import DEFAULT_MAX_LINES, LogView
+from logs import YTDLSearchLogger, is_verbose, resolve_log_level
+from playlist import is_playlist, iter_playlist_pages, resolve_playlist
+from sessions import NETWORK_OPTIONS, get_session_pool
+from utils import get_settings
 
 ICON_PATH = "app.ico"
 
 
+def info_ydl_opts(logger=None, level=None):
+    """Параметры YoutubeDL для получения информации о ссылке"""
+    level = resolve_log_level(level)
+    return {
+        "quiet": True,
+        "no_warnings": False,
+        # Записи плейлистов не извлекаются целиком при перечислении
+        "extract_flat": "in_playlist",
+        "ignoreerrors": True,
+        "verbose": is_verbose(level),
+        "logger": logger,
+        **NETWORK_OPTIONS,
+    }
+
+
 class VideoInfoWorker(QThread):
     finished = Signal(object, str)  # info, error
     log = Signal(str)
+    # Для плейлистов вместо finished приходят эти сигналы
+    playlist_found = Signal(object)  # info плейлиста без записей
+    entries_found = Signal(list)  # очередная страница записей
+    playlist_finished = Signal(str)  # error
 
-    def __init__(self, url):
+    def __init__(self, url, use_cache=True):
         super().__init__()
         self.url = url
+        self.use_cache = use_cache
         self._is_cancelled = False
 
     def run(self):
         try:
-            ydl_opts = {
-                "quiet": True,
-                "no_warnings": False,
-                "extract_flat": False,
-                "ignoreerrors": True,
-                "verbose": True,
-                "logger": YTDLSearchLogger(self.log.emit),
-            }
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(self.url, download=False)
+            cache = get_metadata_cache()
+            if self.use_cache:
+                info = self._cached_info(cache)
+                if info:
+                    self.log.emit("Информация взята из кэша")
+                    self.finished.emit(info, None)
+                    return
+            level = resolve_log_level()
+            ydl_opts = info_ydl_opts(
+                YTDLSearchLogger(self.log.emit, lambda: self._is_cancelled, level),
+                level,
+            )
+            # yt-dlp импортируется пулом лениво, чтобы не замедлять запуск
+            with get_session_pool().lease(ydl_opts) as ydl:
+                info = resolve_playlist(ydl, self.url)
+                if self._is_cancelled:
+                    return
+                if is_playlist(info):
+                    self.stream_playlist(ydl, info)
+                    return
+                if info:
+                    info = ydl.process_ie_result(info, download=False)
                 if self._is_cancelled:
                     return
                 if not info:
                     raise Exception("Не удалось получить информацию о видео")
+                # Запоминаем время извлечения, чтобы при скачивании понять,
+                # не истекли ли ссылки на форматы
+                info.setdefault("epoch", int(time.time()))
+                try:
+                    cache.put(self.url, info)
+                except sqlite3.Error as e:
+                    self.log.emit(f"Не удалось сохранить информацию в кэш: {e}")
                 self.finished.emit(info, None)
         except Exception as e:
             if not self._is_cancelled:
                 self.finished.emit(None, str(e))
 
+    def _cached_info(self, cache):
+        # Кэш необязателен: занятая другим процессом база не мешает запросу
+        try:
+            return cache.get(self.url)
+        except sqlite3.Error as e:
+            self.log.emit(f"Кэш метаданных недоступен: {e}")
+            return None
+
+    def stream_playlist(self, ydl, info):
+        """Передает записи плейлиста страницами, пока они перечисляются"""
+        self.playlist_found.emit(
+            {key: value for key, value in info.items() if key != "entries"}
+        )
+        error = ""
+        count = 0
+        try:
+            for page in iter_playlist_pages(
+                ydl, info, is_cancelled=lambda: self._is_cancelled
+            ):
+                count += len(page)
+                self.entries_found.emit(page)
+        except Exception as e:
+            error = str(e)
+        self.log.emit(f"Найдено записей в плейлисте: {count}")
+        self.playlist_finished.emit(error)
+
     def cancel(self):
         """Отменяет выполнение потока"""
         self._is_cancelled = True
 
 
-class YTDLSearchLogger:
-    def __init__(self, log_callback):
-        self.log_callback = log_callback
-
-    def debug(self, msg):
-        self.log_callback(f"[debug] {msg}")
-
-    def warning(self, msg):
-        self.log_callback(f"[warning] {msg}")
-
-    def error(self, msg):
-        self.log_callback(f"[error] {msg}")
-
-
 class LoadingDialog(QDialog):
     def __init__(self, parent=None):
         super().__init__(parent)
-        self.settings = load_settings()
+        self.settings = get_settings()
         size = self.settings.get("loading_dialog_size")
         if size:
             self.resize(size[0], size[1])
@@ -75,8 +132,9 @@ class LoadingDialog(QDialog):
         layout.addWidget(self.label)
         self.time_label = QLabel("Время поиска: 00:00")
         layout.addWidget(self.time_label)
-        self.log_text = QTextEdit()
-        self.log_text.setReadOnly(True)
+        self.log_text = LogView(
+            max_lines=self.settings.get("log_max_lines", DEFAULT_MAX_LINES)
+        )
         self.log_text.setMinimumHeight(60)
         layout.addWidget(self.log_text)
         self._timer = QTimer(self)
@@ -89,7 +147,7 @@ class LoadingDialog(QDialog):
         self.time_label.setText(f"Время поиска: {self._elapsed.toString('mm:ss')}")
 
     def append_log(self, text):
-        self.log_text.append(text)
+        self.log_text.append_log(text)
 
     def closeEvent(self, event):
         # Останавливаем таймер
@@ -100,6 +158,5 @@ class LoadingDialog(QDialog):
             self.size().width(),
             self.size().height(),
         ]
-        save_settings(self.settings)
 
         super().closeEvent(event)
@@ -0,0 +1,66 @@
+from collections import deque
+
+from PySide6.QtCore import QTimer
+from PySide6.QtGui import QColor, QTextCharFormat, QTextCursor
+from PySide6.QtWidgets import QPlainTextEdit
+
+DEFAULT_MAX_LINES = 5000
+# Как часто накопленные строки выводятся в виджет, мс
+FLUSH_INTERVAL = 100
+
+LOG_COLORS = {
+    "error": "#ef4444",
+    "warning": "#f59e0b",
+    "success": "#22c55e",
+    "debug": "#94a3b8",
+    "info": "#e5e7eb",
+}
+
+
+class LogView(QPlainTextEdit):
+    """Лог с ограниченным числом строк и пакетным выводом по таймеру"""
+
+    def __init__(self, parent=None, max_lines=DEFAULT_MAX_LINES):
+        super().__init__(parent)
+        self.setReadOnly(True)
+        self.setMaximumBlockCount(max_lines)
+        # Кольцевой буфер: строки, вытесненные до вывода, все равно не поместились бы
+        self._pending = deque(maxlen=max_lines)
+        self._formats = {}
+        for log_type, color in LOG_COLORS.items():
+            char_format = QTextCharFormat()
+            char_format.setForeground(QColor(color))
+            self._formats[log_type] = char_format
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.setInterval(FLUSH_INTERVAL)
+        self._timer.timeout.connect(self.flush)
+        self.success_shown = False
+
+    def append_log(self, text, log_type="info"):
+        if log_type == "success":
+            # Сообщение об успехе показываем только один раз
+            if self.success_shown:
+                return
+            self.success_shown = True
+        self._pending.append((text, log_type))
+        if not self._timer.isActive():
+            self._timer.start()
+
+    def flush(self):
+        if not self._pending:
+            return
+        scrollbar = self.verticalScrollBar()
+        at_bottom = scrollbar.value() >= scrollbar.maximum()
+        cursor = QTextCursor(self.document())
+        cursor.movePosition(QTextCursor.MoveOperation.End)
+        cursor.beginEditBlock()
+        while self._pending:
+            text, log_type = self._pending.popleft()
+            cursor.insertText(
+                text + "\n", self._formats.get(log_type, self._formats["info"])
+            )
+        cursor.endEditBlock()
+        # Прокручиваем вниз, только если пользователь не листает лог
+        if at_bottom:
+            scrollbar.setValue(scrollbar.maximum())
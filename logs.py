@@ -0,0 +1,139 @@
+import re
+from collections import namedtuple
+
+from utils import get_settings
+
+# Типы сообщений лога упорядочены по важности; success - итог загрузки
+LOG_LEVELS = {"debug": 10, "info": 20, "success": 25, "warning": 30, "error": 40}
+DEFAULT_LOG_LEVEL = "info"
+
+# Разобранное сообщение yt-dlp: тип (ключ LOG_LEVELS) и текст для лога
+LogRecord = namedtuple("LogRecord", ["type", "message"])
+
+# Правила разбора сообщений yt-dlp компилируются один раз при импорте; без
+# IGNORECASE поиск заметно быстрее, а регистр в yt-dlp постоянный
+DEBUG_SKIP = re.compile(r"Looking for embeds|Formats sorted by|[Dd]ownloading format")
+RETRY = re.compile(r"\[retry\]|[Rr]etrying")
+GENERIC_FALLBACK = "Falling back on generic information extractor"
+UNTESTED_VERSION = "Untested major version"
+
+
+def resolve_log_level(level=None):
+    """Числовой уровень лога по имени, числу или из настройки log_level"""
+    if level is None:
+        level = get_settings().get("log_level", DEFAULT_LOG_LEVEL)
+    if isinstance(level, str):
+        return LOG_LEVELS.get(level.lower(), LOG_LEVELS[DEFAULT_LOG_LEVEL])
+    return level
+
+
+def is_verbose(level):
+    """Нужны ли отладочные сообщения yt-dlp (параметр verbose)"""
+    return level <= LOG_LEVELS["debug"]
+
+
+class LevelLogger:
+    """Основа логгеров yt-dlp: сообщения ниже уровня отбрасываются сразу.
+
+    Проверка уровня идет до разбора и форматирования текста и до вызова
+    колбэка, который в приложении отправляет сигнал Qt в другой поток.
+    """
+
+    def __init__(self, is_cancelled=None, level=None):
+        self.is_cancelled = is_cancelled
+        self.level = resolve_log_level(level)
+
+    def enabled(self, log_type):
+        return LOG_LEVELS[log_type] >= self.level
+
+    def check_cancelled(self):
+        # yt-dlp пишет в лог между запросами при извлечении, и исключение
+        # отсюда прерывает его так же, как из хука прогресса
+        if self.is_cancelled and self.is_cancelled():
+            import yt_dlp
+
+            raise yt_dlp.utils.DownloadCancelled()
+
+    def emit(self, record):
+        """Передает сообщение дальше; наследники задают, куда именно"""
+
+
+class YTDLLogger(LevelLogger):
+    """Логгер загрузки: переводит сообщения yt-dlp и считает повторы"""
+
+    def __init__(self, log_callback, is_cancelled=None, level=None):
+        super().__init__(is_cancelled, level)
+        self.log_callback = log_callback
+        self.last_error = None
+        self.retries = 0
+
+    def emit(self, record):
+        self.log_callback(record.message, record.type)
+
+    def debug(self, msg):
+        self.check_cancelled()
+        # Прогресс выводится отдельно, через хук
+        if msg.startswith("[download]"):
+            return
+        if msg.startswith("[debug]"):
+            if self.enabled("debug") and not DEBUG_SKIP.search(msg):
+                clean_msg = msg.replace("[debug]", "").strip()
+                self.emit(LogRecord("debug", f"Отладка: {clean_msg}"))
+        elif RETRY.search(msg):
+            self.retries += 1
+            if self.enabled("warning"):
+                self.emit(LogRecord("warning", f"Повторная попытка: {msg}"))
+        elif self.enabled("info"):
+            self.emit(LogRecord("info", msg))
+
+    def warning(self, msg):
+        self.check_cancelled()
+        if RETRY.search(msg):
+            self.retries += 1
+        if not self.enabled("warning"):
+            return
+        if "[generic]" in msg:
+            clean_msg = msg.replace("[generic]", "").strip()
+            if GENERIC_FALLBACK in clean_msg:
+                clean_msg = "Используем стандартный метод получения информации"
+            elif UNTESTED_VERSION in clean_msg:
+                clean_msg = "Внимание: используется новая версия плеера"
+            else:
+                clean_msg = f"Предупреждение: {clean_msg}"
+        else:
+            clean_msg = f"Предупреждение: {msg}"
+        self.emit(LogRecord("warning", clean_msg))
+
+    def error(self, msg):
+        # Текст ошибки нужен для исключения даже при выключенном логе
+        clean_msg = msg.replace("[error]", "").strip()
+        self.last_error = clean_msg
+        if self.enabled("error"):
+            self.emit(LogRecord("error", f"Ошибка: {clean_msg}"))
+
+
+class YTDLSearchLogger(LevelLogger):
+    """Логгер получения информации о видео для окна загрузки"""
+
+    def __init__(self, log_callback, is_cancelled=None, level=None):
+        super().__init__(is_cancelled, level)
+        self.log_callback = log_callback
+
+    def emit(self, record):
+        self.log_callback(record.message)
+
+    def debug(self, msg):
+        self.check_cancelled()
+        # Отладочные сообщения yt-dlp уже начинаются с [debug]
+        log_type = "debug" if msg.startswith("[debug]") else "info"
+        if self.enabled(log_type):
+            self.emit(LogRecord(log_type, msg))
+
+    def warning(self, msg):
+        self.check_cancelled()
+        if self.enabled("warning"):
+            self.emit(LogRecord("warning", f"[warning] {msg}"))
+
+    def error(self, msg):
+        if self.enabled("error"):
+            self.emit(LogRecord("error", f"[error] {msg}"))
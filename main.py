@@ -1,7 +1,9 @@
+import multiprocessing
 import os
+import sqlite3
 import sys
 
-from PySide6.QtCore import Qt
+from PySide6.QtCore import Qt, QTimer
 from PySide6.QtGui import QDragEnterEvent, QDropEvent, QIcon
 from PySide6.QtWidgets import (
     QApplication,
@@ -16,23 +18,31 @@ from PySide6.QtWidgets import (
     QWidget,
 )
 
-from downloader import DownloadDialog
+from bandwidth import PRIORITY_HIGH, PRIORITY_LOW
+from batch import BatchDialog
+from cache import get_metadata_cache
+from daemon import DaemonClient, daemon_url
+from download_queue import DEFAULT_SLOTS, DownloadQueue, QueueWindow, RemoteQueue
 from loading import LoadingDialog, VideoInfoWorker
+from playlist import PlaylistDialog
+from postprocess import shutdown_postprocess_pool
+from sessions import close_session_pool
+from startup import StartupTimer, YtDlpWarmup
 from styles import APP_STYLE
-from utils import load_settings, save_settings
+from utils import get_settings, parse_urls, wait_threads
 from video_info import VideoInfoDialog
 
 ICON_PATH = "app.ico"
 
 
 class MainWindow(QMainWindow):
-    def __init__(self):
+    def __init__(self, startup_timer=None, daemon=None):
         super().__init__()
         self.setWindowTitle("Видео Загрузчик")
         self.setMinimumSize(600, 220)
         if os.path.exists(ICON_PATH):
             self.setWindowIcon(QIcon(ICON_PATH))
-        self.settings = load_settings()
+        self.settings = get_settings()
         size = self.settings.get("main_window_size")
         if size:
             self.resize(size[0], size[1])
@@ -55,6 +65,10 @@ class MainWindow(QMainWindow):
         self.info_button = QPushButton("Найти")
         self.info_button.clicked.connect(self.show_video_info)
         url_layout.addWidget(self.info_button)
+        self.batch_button = QPushButton("Список…")
+        self.batch_button.setToolTip("Несколько ссылок или файл со ссылками")
+        self.batch_button.clicked.connect(lambda: self.show_batch_dialog())
+        url_layout.addWidget(self.batch_button)
         layout.addLayout(url_layout)
 
         folder_layout = QHBoxLayout()
@@ -65,6 +79,9 @@ class MainWindow(QMainWindow):
         self.folder_label.setObjectName("StatusLabel")
         folder_layout.addWidget(self.folder_label)
         folder_layout.addStretch(1)
+        self.queue_button = QPushButton("Очередь")
+        self.queue_button.clicked.connect(self.show_queue_window)
+        folder_layout.addWidget(self.queue_button)
         layout.addLayout(folder_layout)
 
         self.status_label = QLabel("")
@@ -75,9 +92,49 @@ class MainWindow(QMainWindow):
             "save_path", os.path.expanduser("~/Downloads")
         )
         self.selected_format = None
+        self.video_info = None
         self.worker = None
+        if daemon:
+            # Загрузки идут в демоне (daemon.py), окно только ставит их в
+            # очередь и показывает их ход
+            self.download_queue = RemoteQueue(DaemonClient(daemon), self)
+            self.download_queue.connection_changed.connect(self.on_daemon_connection)
+        else:
+            self.download_queue = DownloadQueue(
+                self.settings.get("download_slots", DEFAULT_SLOTS), self
+            )
+        self.queue_window = None
+        self.playlist_dialog = None
+        self.playlist_workers = []
+        self.batch_dialog = None
+        self.startup_timer = startup_timer
+        self.warmup = None
+        self.running_threads = []
         self.setStyleSheet(APP_STYLE)
         self.update_folder_label()
+        # Прогреваем yt-dlp, когда окно уже показано и цикл событий запущен
+        QTimer.singleShot(0, self.start_warmup)
+
+    def start_warmup(self):
+        if self.startup_timer:
+            self.startup_timer.mark("окно показано")
+        self.warmup = YtDlpWarmup()
+        self.warmup.ready.connect(self.on_warmup_ready)
+        self.warmup.start()
+
+    def on_warmup_ready(self, seconds):
+        if self.startup_timer:
+            self.startup_timer.mark("yt-dlp готов")
+            report = f"Время запуска: {self.startup_timer.report()}"
+            print(report, file=sys.stderr)
+            self.status_label.setText(report)
+
+    def on_daemon_connection(self, connected, message):
+        url = self.download_queue.client.url
+        if connected:
+            self.status_label.setText(f"Подключено к демону {url}")
+        else:
+            self.status_label.setText(f"Нет связи с демоном {url}: {message}")
 
     def select_folder(self):
         folder = QFileDialog.getExistingDirectory(
@@ -86,17 +143,38 @@ class MainWindow(QMainWindow):
         if folder:
             self.save_path = folder
             self.settings["save_path"] = folder
-            save_settings(self.settings)
             self.update_folder_label()
 
     def update_folder_label(self):
         self.folder_label.setText(f"Папка сохранения: {self.save_path}")
 
+    def update_cache_status(self):
+        stats = get_metadata_cache().stats()
+        self.status_label.setText(
+            f"Кэш: попаданий {stats['hits']}, промахов {stats['misses']}"
+        )
+
     def show_video_info(self):
         url = self.url_input.text().strip()
         if not url:
             QMessageBox.warning(self, "Ошибка", "Пожалуйста, введите URL видео")
             return
+        urls = parse_urls(url)
+        if len(urls) > 1:
+            self.url_input.clear()
+            self.show_batch_dialog(urls)
+            return
+        # При попадании в кэш открываем диалог сразу, без окна загрузки
+        cache = get_metadata_cache()
+        try:
+            info = cache.get(url)
+        except sqlite3.Error:
+            # Кэш занят другим процессом: информация будет получена заново
+            info = None
+        self.update_cache_status()
+        if info:
+            self.open_video_info_dialog(info)
+            return
         self.info_button.setEnabled(False)
         self.url_input.setEnabled(False)
         self.info_button.setText("Поиск...")
@@ -105,35 +183,124 @@ class MainWindow(QMainWindow):
         self.loading_dialog.append_log("Запрос к YouTube...")
         self.loading_dialog.show()
         QApplication.processEvents()
-        self.worker = VideoInfoWorker(url)
+        self.worker = VideoInfoWorker(url, use_cache=False)
         self.worker.log.connect(self.loading_dialog.append_log)
         self.worker.finished.connect(self.on_video_info_ready)
+        # Страницы записей подключаются заранее: они могут прийти раньше,
+        # чем будет создано окно плейлиста
+        self.worker.playlist_found.connect(self.on_playlist_found)
+        self.worker.entries_found.connect(self.on_playlist_entries)
+        self.worker.playlist_finished.connect(self.on_playlist_finished)
         self.worker.start()
 
-    def on_video_info_ready(self, info, error):
+    def finish_search(self):
         self.loading_dialog.close()
         self.info_button.setEnabled(True)
         self.url_input.setEnabled(True)
         self.info_button.setText("Найти")
+
+    def on_video_info_ready(self, info, error):
+        self.finish_search()
         if error:
             QMessageBox.critical(
                 self, "Ошибка", f"Не удалось получить информацию о видео:\n{error}"
             )
             return
+        self.open_video_info_dialog(info)
+
+    def on_playlist_found(self, info):
+        # Записи продолжают поступать в фоне, поэтому окно плейлиста
+        # показывается сразу, а поиск нового URL снова доступен
+        self.finish_search()
+        if self.playlist_dialog:
+            self.playlist_dialog.close()
+        if self.batch_dialog:
+            self.batch_dialog.close()
+        worker = self.worker
+        # Поток держим, пока он не закончит перечисление, даже если начат новый поиск
+        self.playlist_workers = [w for w in self.playlist_workers if w.isRunning()]
+        self.playlist_workers.append(worker)
+        dialog = PlaylistDialog(self, info)
+        worker.playlist_dialog = dialog
+        dialog.entries_selected.connect(self.queue_playlist_entries)
+        dialog.finished.connect(lambda _: worker.cancel())
+        self.playlist_dialog = dialog
+        dialog.show()
+
+    def on_playlist_entries(self, entries):
+        self.sender().playlist_dialog.add_entries(entries)
+
+    def on_playlist_finished(self, error):
+        self.sender().playlist_dialog.enumeration_finished(error)
+
+    def queue_playlist_entries(self, entries, selected_format):
+        # Полное извлечение каждого видео выполняется, когда очередь его запускает;
+        # плейлист докачивается в фоне, не мешая отдельным загрузкам
+        # Записи уходят в очередь демона одним запросом
+        self.download_queue.add_many(
+            {
+                "url": entry["url"],
+                "save_path": self.save_path,
+                "selected_format": selected_format,
+                "title": entry["title"],
+                "priority": PRIORITY_LOW,
+                "thumbnail": entry.get("thumbnail"),
+            }
+            for entry in entries
+        )
+        self.show_queue_window()
+
+    def show_batch_dialog(self, urls=()):
+        if self.batch_dialog is None:
+            self.batch_dialog = BatchDialog(self)
+            self.batch_dialog.entries_selected.connect(self.queue_batch_entries)
+        self.batch_dialog.add_urls(urls)
+        self.batch_dialog.show()
+        self.batch_dialog.raise_()
+        self.batch_dialog.activateWindow()
+
+    def queue_batch_entries(self, entries, selected_format):
+        self.download_queue.add_many(
+            {
+                "url": entry["url"],
+                "save_path": self.save_path,
+                "selected_format": selected_format,
+                "info": entry["info"],
+                "title": entry["title"],
+                "priority": entry["priority"],
+            }
+            for entry in entries
+        )
+        self.show_queue_window()
+
+    def open_video_info_dialog(self, info):
+        self.video_info = info
         dialog = VideoInfoDialog(self)
         dialog.load_video_info_from_info(info)
         dialog.format_selected.connect(self.on_format_selected)
         dialog.exec()
+        dialog.deleteLater()
 
     def on_format_selected(self, format_info):
         self.selected_format = format_info
         self.open_download_dialog()
 
     def open_download_dialog(self):
-        dialog = DownloadDialog(
-            self, self.url_input.text().strip(), self.save_path, self.selected_format
+        self.download_queue.add(
+            self.url_input.text().strip(),
+            self.save_path,
+            self.selected_format,
+            self.video_info,
+            priority=PRIORITY_HIGH,
         )
-        dialog.exec()
+        self.show_queue_window()
+
+    def show_queue_window(self):
+        if self.queue_window is None:
+            self.queue_window = QueueWindow(self.download_queue, self)
+        self.queue_window.show()
+        self.queue_window.raise_()
+        self.queue_window.activateWindow()
 
     def dragEnterEvent(self, event: QDragEnterEvent):
         if event.mimeData().hasUrls() or event.mimeData().hasText():
@@ -142,35 +309,81 @@ class MainWindow(QMainWindow):
             event.ignore()
 
     def dropEvent(self, event: QDropEvent):
+        urls = []
         if event.mimeData().hasUrls():
-            urls = event.mimeData().urls()
-            if urls:
-                self.url_input.setText(urls[0].toString())
+            for url in event.mimeData().urls():
+                if url.isLocalFile():
+                    urls.extend(self.read_url_file(url.toLocalFile()))
+                else:
+                    urls.append(url.toString())
         elif event.mimeData().hasText():
-            self.url_input.setText(event.mimeData().text())
+            urls = parse_urls(event.mimeData().text())
+        urls = list(dict.fromkeys(urls))
+        if len(urls) > 1:
+            self.show_batch_dialog(urls)
+        elif urls:
+            self.url_input.setText(urls[0])
+
+    def read_url_file(self, path):
+        """Ссылки из перетащенного текстового файла"""
+        try:
+            with open(path, encoding="utf-8") as f:
+                return parse_urls(f.read())
+        except (OSError, UnicodeDecodeError) as e:
+            QMessageBox.warning(self, "Ошибка", f"Не удалось прочитать файл:\n{e}")
+            return []
 
     def closeEvent(self, event):
-        # Завершаем все активные потоки
-        if hasattr(self, "worker") and self.worker and self.worker.isRunning():
-            if hasattr(self.worker, "cancel"):
-                self.worker.cancel()
-            self.worker.quit()
-            self.worker.wait(3000)  # Ждем до 3 секунд
-            if self.worker.isRunning():
-                self.worker.terminate()
-                self.worker.wait(1000)
+        # Сначала просим остановиться все потоки, потом ждем их с общим сроком
+        threads = self.download_queue.shutdown()
+        for worker in [self.worker, *self.playlist_workers]:
+            if worker and worker.isRunning() and worker not in threads:
+                worker.cancel()
+                threads.append(worker)
+        if self.batch_dialog:
+            threads.extend(self.batch_dialog.pool.cancel())
+        if self.warmup:
+            threads.append(self.warmup)
+        # Поток, застрявший в чтении из сокета, не прерываем: процесс
+        # завершится без него (см. __main__), .part останется для продолжения
+        self.running_threads = wait_threads(threads)
+        # Незавершенная обработка ffmpeg прерывается, исходные дорожки остаются
+        shutdown_postprocess_pool()
+        close_session_pool()
 
         # Закрываем диалоги, если они открыты
         if hasattr(self, "loading_dialog") and self.loading_dialog:
             self.loading_dialog.close()
+        if self.queue_window:
+            self.queue_window.close()
+        if self.playlist_dialog:
+            self.playlist_dialog.close()
 
         self.settings["main_window_size"] = [self.size().width(), self.size().height()]
-        save_settings(self.settings)
         super().closeEvent(event)
 
 
 if __name__ == "__main__":
+    # Пул обработки запускает процессы, в том числе из собранного exe
+    multiprocessing.freeze_support()
+    timer = None
+    if "--startup-timing" in sys.argv or os.environ.get("VD_STARTUP_TIMING"):
+        timer = StartupTimer()
+    # --attach [URL] или настройка daemon_attach: подключиться к демону
+    daemon = None
+    if "--attach" in sys.argv:
+        index = sys.argv.index("--attach") + 1
+        daemon = sys.argv[index] if index < len(sys.argv) else None
+        if not daemon or daemon.startswith("-"):
+            daemon = daemon_url()
+    elif get_settings().get("daemon_attach"):
+        daemon = daemon_url()
     app = QApplication(sys.argv)
-    window = MainWindow()
+    window = MainWindow(timer, daemon)
     window.show()
-    sys.exit(app.exec())
+    exit_code = app.exec()
+    get_settings().flush()
+    if window.running_threads:
+        # Уничтожение работающего QThread аварийно завершает процесс
+        os._exit(exit_code)
+    sys.exit(exit_code)
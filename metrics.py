@@ -0,0 +1,274 @@
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+from utils import get_settings, user_cache_dir
+
+METRICS_FILE = "metrics.jsonl"
+
+OUTCOME_DONE = "done"
+OUTCOME_ARCHIVED = "archived"
+OUTCOME_CANCELLED = "cancelled"
+OUTCOME_ERROR = "error"
+
+# Фаза: (начальная отметка, конечная отметка)
+PHASES = {
+    "extract": ("extract_start", "extract_end"),
+    "ttfb": ("download_start", "first_byte"),
+    "transfer": ("first_byte", "transfer_end"),
+    "postprocess": ("transfer_end", "download_end"),
+    "total": ("start", "finished"),
+}
+# Окно, по которому считается пиковая скорость, секунды
+PEAK_WINDOW = 1.0
+PHASE_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900, 3600)
+# От 128 КБ/с до 64 МБ/с
+SPEED_BUCKETS = tuple(128 * 1024 * 2**n for n in range(10))
+
+
+class JobMetrics:
+    """Замеры одной загрузки: время фаз, объем, скорость, повторы и результат.
+
+    Фазы: extract - получение информации о видео, ttfb - от начала
+    скачивания до первых байт, transfer - передача данных, postprocess -
+    от последних байт до готового файла (слияние, исправления), total - вся
+    загрузка. transfer() можно вызывать из нескольких потоков.
+    """
+
+    def __init__(self, url, clock=time.monotonic):
+        self.url = url
+        self.clock = clock
+        self.started_at = time.time()
+        self._marks = {"start": clock()}
+        self._lock = threading.Lock()
+        self.info_reused = False
+        self.extractor = None
+        self.video_id = None
+        self.format_id = None
+        self.bytes = 0
+        self._first_bytes = None
+        self._window = None
+        self.peak_speed = 0.0
+        self.retries = 0
+        self.outcome = None
+        self.error = None
+
+    def mark(self, name):
+        self._marks[name] = self.clock()
+
+    def transfer(self, downloaded):
+        """Учитывает общий объем скачанного на текущий момент"""
+        now = self.clock()
+        with self._lock:
+            if self._first_bytes is None:
+                # Первый блок уже прочитан; при продолжении загрузки в объем
+                # входит и скачанное раньше, поэтому скорость считаем от него
+                self._first_bytes = downloaded
+                self._window = (now, downloaded)
+                self._marks["first_byte"] = now
+            self.bytes = max(self.bytes, downloaded)
+            self._marks["transfer_end"] = now
+            start, counted = self._window
+            if now - start >= PEAK_WINDOW:
+                speed = (downloaded - counted) / (now - start)
+                self.peak_speed = max(self.peak_speed, speed)
+                self._window = (now, downloaded)
+
+    def finish(self, outcome, error=None, retries=0):
+        self.mark("finished")
+        self.outcome = outcome
+        self.error = error
+        self.retries = retries
+
+    def phase(self, name):
+        start, end = PHASES[name]
+        if start in self._marks and end in self._marks:
+            return max(self._marks[end] - self._marks[start], 0.0)
+        return None
+
+    @property
+    def avg_speed(self):
+        transfer = self.phase("transfer")
+        if not transfer or self._first_bytes is None:
+            return None
+        return (self.bytes - self._first_bytes) / transfer
+
+    def as_dict(self):
+        avg_speed = self.avg_speed
+        # Загрузка короче окна замера: пиковая скорость не меньше средней
+        peak_speed = max(self.peak_speed, avg_speed or 0.0)
+        phases = {name: self.phase(name) for name in PHASES}
+        return {
+            "time": datetime.fromtimestamp(self.started_at).isoformat(
+                timespec="seconds"
+            ),
+            "url": self.url,
+            "outcome": self.outcome,
+            "error": self.error,
+            "extractor": self.extractor,
+            "id": self.video_id,
+            "format": self.format_id,
+            "info_reused": self.info_reused,
+            "bytes": self.bytes,
+            "avg_speed": round(avg_speed) if avg_speed is not None else None,
+            "peak_speed": round(peak_speed) if peak_speed else None,
+            "retries": self.retries,
+            "phases": {
+                name: round(value, 3) if value is not None else None
+                for name, value in phases.items()
+            },
+        }
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.sum += value
+        self.count += 1
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+    def lines(self, name, labels=""):
+        sep = "," if labels else ""
+        lines = [
+            f'{name}_bucket{{{labels}{sep}le="{bound}"}} {count}'
+            for bound, count in zip(self.buckets, self.counts)
+        ]
+        lines.append(f'{name}_bucket{{{labels}{sep}le="+Inf"}} {self.count}')
+        suffix = f"{{{labels}}}" if labels else ""
+        lines.append(f"{name}_sum{suffix} {self.sum:.3f}")
+        lines.append(f"{name}_count{suffix} {self.count}")
+        return lines
+
+
+class MetricsRecorder:
+    """Записывает замеры загрузок.
+
+    Каждая загрузка - строка JSON в path; если задан prometheus_path, туда
+    после каждой загрузки атомарно записываются счетчики и гистограммы за
+    время работы процесса в текстовом формате Prometheus (для textfile
+    collector node_exporter). Пустой путь отключает соответствующий вывод.
+    """
+
+    def __init__(self, path=None, prometheus_path=None):
+        self.path = path
+        self.prometheus_path = prometheus_path
+        self._lock = threading.Lock()
+        self.jobs = {}
+        self.bytes_total = 0
+        self.retries_total = 0
+        self.phases = {name: Histogram(PHASE_BUCKETS) for name in PHASES}
+        self.speed = Histogram(SPEED_BUCKETS)
+
+    def configure(self, path=None, prometheus_path=None):
+        with self._lock:
+            if path is not None:
+                self.path = path
+            if prometheus_path is not None:
+                self.prometheus_path = prometheus_path
+
+    def record(self, metrics, on_error=None):
+        """Учитывает завершенную загрузку; ошибка записи передается в
+        on_error(message), а не в stdout, где cli.py выводит события JSON"""
+        data = metrics.as_dict()
+        error = None
+        with self._lock:
+            self.jobs[data["outcome"]] = self.jobs.get(data["outcome"], 0) + 1
+            self.retries_total += data["retries"]
+            if data["outcome"] == OUTCOME_DONE:
+                self.bytes_total += data["bytes"]
+                if data["avg_speed"]:
+                    self.speed.observe(data["avg_speed"])
+            for name, value in data["phases"].items():
+                if value is not None:
+                    self.phases[name].observe(value)
+            try:
+                if self.path:
+                    with open(self.path, "a", encoding="utf-8") as f:
+                        f.write(json.dumps(data, ensure_ascii=False) + "\n")
+                if self.prometheus_path:
+                    self._write_prometheus()
+            except OSError as e:
+                error = f"Не удалось записать метрики: {e}"
+        if error is not None:
+            if on_error is not None:
+                on_error(error)
+            else:
+                print(error, file=sys.stderr)
+        return data
+
+    def prometheus_text(self):
+        lines = [
+            "# HELP videodownloader_jobs_total Завершенные загрузки по результату",
+            "# TYPE videodownloader_jobs_total counter",
+        ]
+        for outcome, count in sorted(self.jobs.items()):
+            lines.append(f'videodownloader_jobs_total{{outcome="{outcome}"}} {count}')
+        lines += [
+            "# HELP videodownloader_downloaded_bytes_total Скачано байт",
+            "# TYPE videodownloader_downloaded_bytes_total counter",
+            f"videodownloader_downloaded_bytes_total {self.bytes_total}",
+            "# HELP videodownloader_retries_total Повторные попытки запросов",
+            "# TYPE videodownloader_retries_total counter",
+            f"videodownloader_retries_total {self.retries_total}",
+            "# HELP videodownloader_phase_seconds Длительность фаз загрузки",
+            "# TYPE videodownloader_phase_seconds histogram",
+        ]
+        for name, histogram in self.phases.items():
+            lines += histogram.lines("videodownloader_phase_seconds", f'phase="{name}"')
+        lines += [
+            "# HELP videodownloader_speed_bytes Средняя скорость загрузки, байт/с",
+            "# TYPE videodownloader_speed_bytes histogram",
+        ]
+        lines += self.speed.lines("videodownloader_speed_bytes")
+        return "\n".join(lines) + "\n"
+
+    def _write_prometheus(self):
+        # Сборщик читает файл в любой момент, поэтому подменяем его целиком
+        directory = os.path.dirname(self.prometheus_path) or "."
+        fd, tmp_path = tempfile.mkstemp(prefix=".metrics-", dir=directory)
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(self.prometheus_text())
+            os.replace(tmp_path, self.prometheus_path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+
+_recorder = None
+_recorder_lock = threading.Lock()
+
+
+def get_metrics_recorder():
+    """Возвращает общий регистратор замеров, настроенный из настроек"""
+    global _recorder
+    with _recorder_lock:
+        if _recorder is None:
+            settings = get_settings()
+            path = settings.get("metrics_file")
+            if path is None:
+                path = os.path.join(user_cache_dir(), METRICS_FILE)
+            _recorder = MetricsRecorder(
+                path, settings.get("metrics_prometheus_file") or ""
+            )
+
+            def on_setting_changed(key, value):
+                if key == "metrics_file":
+                    _recorder.configure(path=value or "")
+                elif key == "metrics_prometheus_file":
+                    _recorder.configure(prometheus_path=value or "")
+
+            settings.subscribe(on_setting_changed)
+        return _recorder
@@ -0,0 +1,321 @@
+import os
+import time
+
+from PySide6.QtCore import Qt, Signal
+from PySide6.QtGui import QIcon
+from PySide6.QtWidgets import (
+    QAbstractItemView,
+    QComboBox,
+    QDialog,
+    QHBoxLayout,
+    QHeaderView,
+    QLabel,
+    QLineEdit,
+    QMessageBox,
+    QPushButton,
+    QTableWidget,
+    QTableWidgetItem,
+    QVBoxLayout,
+)
+
+from thumbnails import ICON_SIZE, TableThumbnails, thumbnail_url
+from utils import PLAYLIST_TYPES, get_settings
+
+ICON_PATH = "app.ico"
+# Сколько записей плейлиста передавать в интерфейс за раз
+PAGE_SIZE = 50
+# Как долго копить неполную страницу, если сайт отдает записи медленно, секунды
+PAGE_INTERVAL = 0.5
+PLAYLIST_FORMATS = (
+    # Отдельные видео и аудио, как при выборе формата одного видео: готовые
+    # файлы со звуком на YouTube обычно не выше 360p
+    ("Лучшее качество", "bv*+ba/b"),
+    ("Не выше 1080p", "bv*[height<=1080]+ba/b[height<=1080]"),
+    ("Не выше 720p", "bv*[height<=720]+ba/b[height<=720]"),
+    ("Только аудио", "bestaudio/best"),
+)
+
+
+def resolve_playlist(ydl, url):
+    """Извлекает URL без обработки записей и проходит по перенаправлениям.
+
+    Для плейлистов и каналов записи остаются ленивыми, а с extract_flat
+    "in_playlist" сами видео не извлекаются, пока их не поставят в очередь.
+    """
+    info = ydl.extract_info(url, download=False, process=False)
+    # Ссылки вида youtube.com/@channel сначала перенаправляют на вкладку
+    while info and info.get("_type") in ("url", "url_transparent"):
+        info = ydl.extract_info(
+            info["url"], download=False, ie_key=info.get("ie_key"), process=False
+        )
+    return info
+
+
+def is_playlist(info):
+    return bool(info) and info.get("_type") in PLAYLIST_TYPES
+
+
+def playlist_entry(index, entry):
+    """Оставляет от записи плейлиста только то, что нужно интерфейсу и очереди"""
+    url = entry.get("url") or entry.get("webpage_url")
+    if entry.get("_type") not in ("url", "url_transparent"):
+        url = entry.get("webpage_url") or url
+    return {
+        "index": index,
+        "url": url,
+        "id": entry.get("id"),
+        "title": entry.get("title") or url,
+        "duration": entry.get("duration"),
+        "thumbnail": thumbnail_url(entry, ICON_SIZE[0]),
+    }
+
+
+def iter_playlist_pages(
+    ydl, info, page_size=PAGE_SIZE, interval=PAGE_INTERVAL, is_cancelled=None
+):
+    """Перебирает записи плейлиста и отдает их страницами по мере получения"""
+    from yt_dlp.utils import PlaylistEntries
+
+    page = []
+    last_yield = time.monotonic()
+    for index, entry in PlaylistEntries(ydl, info)[:]:
+        if is_cancelled and is_cancelled():
+            return
+        if entry:
+            page.append(playlist_entry(index, entry))
+        if page and (
+            len(page) >= page_size or time.monotonic() - last_yield >= interval
+        ):
+            yield page
+            page = []
+            last_yield = time.monotonic()
+    if page:
+        yield page
+
+
+def parse_ranges(text):
+    """Разбирает диапазоны вида "1-10,15,20-" (синтаксис --playlist-items yt-dlp)"""
+    from yt_dlp.utils import PlaylistEntries
+
+    text = text.replace(" ", "")
+    if not text:
+        return None
+    return list(PlaylistEntries.parse_playlist_items(text))
+
+
+def index_in_ranges(index, ranges, count):
+    """Проверяет, попадает ли номер записи (с 1) в диапазоны из parse_ranges"""
+    if ranges is None:
+        return True
+    for item in ranges:
+        if isinstance(item, int):
+            if index == (item if item > 0 else count + item + 1):
+                return True
+            continue
+        step = item.step or 1
+        start = item.start or (1 if step > 0 else count)
+        stop = item.stop if item.stop is not None else float("inf")
+        if start < 0:
+            start = count + start + 1
+        if stop < 0:
+            stop = count + stop + 1
+        low, high = (start, stop) if step > 0 else (stop, start)
+        if low <= index <= high and (index - start) % step == 0:
+            return True
+    return False
+
+
+def format_duration(seconds):
+    if not seconds:
+        return ""
+    seconds = int(seconds)
+    hours, rest = divmod(seconds, 3600)
+    if hours:
+        return f"{hours}:{rest // 60:02d}:{rest % 60:02d}"
+    return f"{rest // 60}:{rest % 60:02d}"
+
+
+class PlaylistDialog(QDialog):
+    """Список записей плейлиста, который заполняется по мере перечисления"""
+
+    entries_selected = Signal(list, object)  # записи, формат
+
+    def __init__(self, parent, info):
+        super().__init__(parent)
+        self.settings = get_settings()
+        size = self.settings.get("playlist_dialog_size")
+        if size:
+            self.resize(size[0], size[1])
+        self.setWindowTitle("Плейлист")
+        self.setMinimumSize(600, 420)
+        if os.path.exists(ICON_PATH):
+            self.setWindowIcon(QIcon(ICON_PATH))
+        self.title = info.get("title") or info.get("id") or ""
+        self.entries = []
+        self.queued = set()
+        self.ranges = None
+        self.loading = True
+        self.setup_ui()
+        self.update_status()
+
+    def setup_ui(self):
+        layout = QVBoxLayout(self)
+        self.info_label = QLabel()
+        self.info_label.setWordWrap(True)
+        layout.addWidget(self.info_label)
+
+        range_layout = QHBoxLayout()
+        range_layout.addWidget(QLabel("Диапазон:"))
+        self.range_input = QLineEdit()
+        self.range_input.setPlaceholderText("Например: 1-10,15,20-")
+        self.range_input.returnPressed.connect(self.apply_range)
+        range_layout.addWidget(self.range_input, stretch=1)
+        for text, handler in (
+            ("Выбрать", self.apply_range),
+            ("Все", self.select_all),
+            ("Ничего", self.select_none),
+        ):
+            button = QPushButton(text)
+            button.clicked.connect(handler)
+            range_layout.addWidget(button)
+        layout.addLayout(range_layout)
+
+        self.table = QTableWidget(0, 3)
+        self.table.setHorizontalHeaderLabels(["№", "Название", "Длительность"])
+        self.table.setSelectionBehavior(QAbstractItemView.SelectionBehavior.SelectRows)
+        self.table.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+        self.table.verticalHeader().setVisible(False)
+        header = self.table.horizontalHeader()
+        header.setSectionResizeMode(0, QHeaderView.ResizeMode.ResizeToContents)
+        header.setSectionResizeMode(1, QHeaderView.ResizeMode.Stretch)
+        header.setSectionResizeMode(2, QHeaderView.ResizeMode.ResizeToContents)
+        self.table.itemChanged.connect(lambda _: self.update_status())
+        layout.addWidget(self.table)
+        self.thumbnails = TableThumbnails(self.table, 1, self.thumbnail_for_row)
+
+        button_layout = QHBoxLayout()
+        button_layout.addWidget(QLabel("Формат:"))
+        self.format_combo = QComboBox()
+        for text, format_id in PLAYLIST_FORMATS:
+            self.format_combo.addItem(text, format_id)
+        button_layout.addWidget(self.format_combo)
+        button_layout.addStretch(1)
+        self.queue_button = QPushButton("Добавить в очередь")
+        self.queue_button.clicked.connect(self.accept_selection)
+        button_layout.addWidget(self.queue_button)
+        self.close_button = QPushButton("Закрыть")
+        self.close_button.clicked.connect(self.close)
+        button_layout.addWidget(self.close_button)
+        layout.addLayout(button_layout)
+
+    def add_entries(self, entries):
+        """Добавляет очередную страницу записей, не перестраивая таблицу"""
+        self.table.blockSignals(True)
+        self.table.setUpdatesEnabled(False)
+        row = self.table.rowCount()
+        self.table.setRowCount(row + len(entries))
+        for entry in entries:
+            self.entries.append(entry)
+            index_item = QTableWidgetItem(str(entry["index"]))
+            index_item.setFlags(
+                Qt.ItemFlag.ItemIsUserCheckable | Qt.ItemFlag.ItemIsEnabled
+            )
+            index_item.setCheckState(self.check_state(entry["index"]))
+            self.table.setItem(row, 0, index_item)
+            self.table.setItem(row, 1, QTableWidgetItem(entry["title"]))
+            self.table.setItem(
+                row, 2, QTableWidgetItem(format_duration(entry["duration"]))
+            )
+            row += 1
+        self.table.setUpdatesEnabled(True)
+        self.table.blockSignals(False)
+        self.update_status()
+        self.thumbnails.refresh()
+
+    def thumbnail_for_row(self, row):
+        if row >= len(self.entries):
+            return None
+        return self.entries[row].get("thumbnail")
+
+    def enumeration_finished(self, error):
+        self.loading = False
+        self.update_status()
+        # Диапазоны с отрицательными номерами считаются от конца списка,
+        # который теперь известен
+        if self.ranges is not None:
+            self.set_checked(self.check_state)
+        if error and not self.entries:
+            QMessageBox.critical(
+                self, "Ошибка", f"Не удалось получить список видео:\n{error}"
+            )
+
+    def check_state(self, index):
+        if index_in_ranges(index, self.ranges, len(self.entries)):
+            return Qt.CheckState.Checked
+        return Qt.CheckState.Unchecked
+
+    def set_checked(self, state_for_index):
+        self.table.blockSignals(True)
+        for row, entry in enumerate(self.entries):
+            item = self.table.item(row, 0)
+            if item.flags() & Qt.ItemFlag.ItemIsEnabled:
+                item.setCheckState(state_for_index(entry["index"]))
+        self.table.blockSignals(False)
+        self.update_status()
+
+    def apply_range(self):
+        try:
+            self.ranges = parse_ranges(self.range_input.text())
+        except ValueError as e:
+            QMessageBox.warning(self, "Ошибка", f"Неверный диапазон: {e}")
+            return
+        self.set_checked(self.check_state)
+
+    def select_all(self):
+        self.range_input.clear()
+        self.ranges = None
+        self.set_checked(lambda _: Qt.CheckState.Checked)
+
+    def select_none(self):
+        self.range_input.clear()
+        self.ranges = []
+        self.set_checked(lambda _: Qt.CheckState.Unchecked)
+
+    def checked_entries(self):
+        return [
+            entry
+            for row, entry in enumerate(self.entries)
+            if entry["index"] not in self.queued
+            and self.table.item(row, 0).checkState() == Qt.CheckState.Checked
+        ]
+
+    def update_status(self):
+        state = "идет получение списка..." if self.loading else "список получен"
+        self.info_label.setText(
+            f"<b>{self.title}</b><br>Найдено видео: {len(self.entries)}, "
+            f"выбрано: {len(self.checked_entries())} ({state})"
+        )
+
+    def accept_selection(self):
+        entries = self.checked_entries()
+        if not entries:
+            QMessageBox.warning(self, "Ошибка", "Не выбрано ни одного видео")
+            return
+        format_id = self.format_combo.currentData()
+        selected_format = {"format_id": format_id} if format_id else None
+        # Уже добавленные записи отключаем, чтобы не поставить их дважды
+        self.queued.update(entry["index"] for entry in entries)
+        self.table.blockSignals(True)
+        for row, entry in enumerate(self.entries):
+            if entry["index"] in self.queued:
+                self.table.item(row, 0).setFlags(Qt.ItemFlag.ItemIsUserCheckable)
+        self.table.blockSignals(False)
+        self.update_status()
+        self.entries_selected.emit(entries, selected_format)
+
+    def closeEvent(self, event):
+        self.settings["playlist_dialog_size"] = [
+            self.size().width(),
+            self.size().height(),
+        ]
+        super().closeEvent(event)
@@ -0,0 +1,194 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from utils import get_settings
+
+DEFAULT_POSTPROCESS_WORKERS = 2
+DEFAULT_POSTPROCESS = {
+    # Контейнер, в который перепаковать готовый файл, например "mp4" или "mkv"
+    "remux": None,
+    "embed_thumbnail": False,
+    "embed_metadata": False,
+}
+# Параметры YoutubeDL, которые нужны обработке в отдельном процессе
+POSTPROCESS_PARAMS = (
+    "postprocessors",
+    "postprocessor_args",
+    "ffmpeg_location",
+    "keepvideo",
+    "merge_output_format",
+    "paths",
+    "verbose",
+)
+
+
+def get_postprocess_policy():
+    return {**DEFAULT_POSTPROCESS, **get_settings().get("postprocess", {})}
+
+
+def postprocess_options(policy):
+    """Параметры YoutubeDL для перепаковки, обложки и метаданных"""
+    postprocessors = []
+    if policy.get("remux"):
+        postprocessors.append(
+            {"key": "FFmpegVideoRemuxer", "preferedformat": policy["remux"]}
+        )
+    if policy.get("embed_metadata"):
+        postprocessors.append(
+            {"key": "FFmpegMetadata", "add_metadata": True, "add_chapters": True}
+        )
+    if policy.get("embed_thumbnail"):
+        postprocessors.append({"key": "EmbedThumbnail"})
+    return {
+        "postprocessors": postprocessors,
+        # Обложка скачивается вместе с видео, а встраивается при обработке
+        "writethumbnail": bool(policy.get("embed_thumbnail")),
+    }
+
+
+class DeferredPostprocess:
+    """Откладывает обработку скачанного файла yt-dlp.
+
+    Подменяет YoutubeDL.post_process: если после скачивания нужно что-то
+    кроме переноса файла (слияние дорожек, исправления ffmpeg, перепаковка,
+    обложка, метаданные), вместо обработки в потоке загрузки сохраняет
+    задание для пула процессов в self.task. С move_to файл скачан в
+    промежуточный каталог, и задание нужно всегда: перенос в move_to тоже
+    идет в пуле.
+    """
+
+    def __init__(self, ydl, move_to=None):
+        self.ydl = ydl
+        self.move_to = move_to
+        self.task = None
+        self._post_process = ydl.post_process
+        ydl.post_process = self
+
+    def __call__(self, filename, info, files_to_move=None):
+        postprocessors = info.pop("__postprocessors", None) or []
+        if (
+            not postprocessors
+            and not self.ydl.params.get("postprocessors")
+            and not self.move_to
+        ):
+            # Остается только перенести готовый файл, это быстро
+            return self._post_process(filename, info, files_to_move)
+        params = {
+            key: self.ydl.params[key]
+            for key in POSTPROCESS_PARAMS
+            if key in self.ydl.params
+        }
+        self.task = {
+            "params": params,
+            "filename": filename,
+            "info": self.ydl.sanitize_info(dict(info)),
+            "files_to_move": dict(files_to_move or {}),
+            # Слияние и исправления yt-dlp создает сам; в другой процесс
+            # передаем только их имена и создаем заново
+            "postprocessors": [type(pp).__name__ for pp in postprocessors],
+            "move_to": self.move_to,
+        }
+        return info
+
+
+def run_postprocess(task):
+    """Выполняет отложенную обработку в процессе пула.
+
+    Возвращает {"filepath", "log", "error"}; сообщения yt-dlp собираются в
+    log и выводятся в лог загрузки после завершения.
+    """
+    import yt_dlp
+    from yt_dlp import postprocessor
+
+    from logs import YTDLLogger
+    from storage import move_file
+
+    log = []
+    # Уровень лога задан параметром verbose; остальное отфильтрует DownloadJob
+    logger = YTDLLogger(
+        lambda message, log_type: log.append((message, log_type)),
+        level="debug" if task["params"].get("verbose") else "info",
+    )
+    params = {**task["params"], "logger": logger, "quiet": True}
+    try:
+        with yt_dlp.YoutubeDL(params) as ydl:
+            info = task["info"]
+            info["__postprocessors"] = [
+                getattr(postprocessor, name)(ydl) for name in task["postprocessors"]
+            ]
+            info = ydl.post_process(task["filename"], info, task["files_to_move"])
+        filepath = info.get("filepath")
+        error = logger.last_error
+        if filepath and task["move_to"] and not error:
+            try:
+                filepath = move_file(filepath, task["move_to"])
+            except FileExistsError as e:
+                # Как и yt-dlp без промежуточного каталога, оставляем
+                # прежний файл, а скачанную копию удаляем
+                os.remove(filepath)
+                filepath = e.filename
+                log.append(
+                    (f"Файл уже существует, оставлен прежний: {filepath}", "warning")
+                )
+    except Exception as e:
+        filepath, error = None, str(e)
+    return {"filepath": filepath, "log": log, "error": error}
+
+
+class PostprocessPool:
+    """Пул процессов для обработки скачанных файлов.
+
+    Слияние и перепаковка занимают процессор и диск, а не сеть, поэтому
+    выполняются отдельно от слотов загрузки и ограничиваются своим числом
+    процессов.
+    """
+
+    def __init__(self, workers=DEFAULT_POSTPROCESS_WORKERS):
+        self.workers = max(1, workers)
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def submit(self, task):
+        with self._lock:
+            if self._executor is None:
+                # spawn: fork процесса с потоками Qt и yt-dlp небезопасен
+                self._executor = ProcessPoolExecutor(
+                    self.workers, mp_context=multiprocessing.get_context("spawn")
+                )
+            return self._executor.submit(run_postprocess, task)
+
+    def shutdown(self):
+        """Отменяет ожидающие задания и завершает процессы, не дожидаясь ffmpeg"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is None:
+            return
+        # Публичного способа прервать работающие задания нет; исходные
+        # дорожки при этом остаются на диске
+        processes = list((getattr(executor, "_processes", None) or {}).values())
+        executor.shutdown(wait=False, cancel_futures=True)
+        for process in processes:
+            process.terminate()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_postprocess_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = PostprocessPool(
+                get_settings().get("postprocess_workers", DEFAULT_POSTPROCESS_WORKERS)
+            )
+        return _pool
+
+
+def shutdown_postprocess_pool():
+    with _pool_lock:
+        pool = _pool
+    if pool is not None:
+        pool.shutdown()
@@ -0,0 +1,150 @@
+import math
+import os
+import threading
+import time
+
+# Не чаще стольких обновлений прогресса в секунду
+DEFAULT_MAX_RATE = 10
+# Шаг в процентах, с которым прогресс пишется в лог
+DEFAULT_LOG_STEP = 10
+# Постоянная времени сглаживания скорости, секунды
+SPEED_TIME_CONSTANT = 3.0
+
+
+def format_speed(speed):
+    return f"{speed / 1024 / 1024:.2f} МБ/с" if speed else "N/A"
+
+
+def format_eta(eta):
+    if eta is None:
+        return "N/A"
+    eta = int(eta)
+    return f"{eta // 60}:{eta % 60:02d}"
+
+
+class ProgressReporter:
+    """Сводит частые события прогресса yt-dlp к обновлениям с ограниченной частотой.
+
+    Принимает словари из progress_hooks (в том числе из нескольких потоков
+    при параллельной загрузке фрагментов), суммирует прогресс по форматам,
+    сглаживает скорость и оценку оставшегося времени. on_progress получает
+    (percent, text, downloaded_bytes, total_bytes), on_log - (message, type).
+    """
+
+    def __init__(
+        self,
+        on_progress,
+        on_log=None,
+        max_rate=DEFAULT_MAX_RATE,
+        log_step=DEFAULT_LOG_STEP,
+        clock=time.monotonic,
+    ):
+        self.on_progress = on_progress
+        self.on_log = on_log
+        self.min_interval = 1.0 / max_rate if max_rate else 0.0
+        self.log_step = log_step
+        self.clock = clock
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        # Прогресс по каждому формату: format_id -> [скачано, всего]
+        self._formats = {}
+        self._percent = 0
+        self._logged_step = 0
+        self._last_emit = None
+        self._last_sample = None
+        self.speed = None
+        self.eta = None
+        self.downloaded = 0
+        self.total = 0
+        self.updates = 0
+        self.emitted = 0
+
+    def hook(self, d):
+        """Обрабатывает словарь из progress_hooks yt-dlp"""
+        status = d.get("status")
+        if status not in ("downloading", "finished"):
+            return
+        with self._lock:
+            self.updates += 1
+            now = self.clock()
+            downloaded, total = self._aggregate(d)
+            self._update_speed(now, downloaded)
+            self.downloaded, self.total = downloaded, total
+            if total and self.speed:
+                self.eta = max(total - downloaded, 0) / self.speed
+            percent = min(int(downloaded / total * 100), 100) if total else 0
+            # Размер фрагментированных форматов yt-dlp только оценивает, поэтому
+            # не даем индикатору откатываться назад при уточнении оценки
+            self._percent = max(self._percent, percent)
+            finished = status == "finished"
+            if (
+                finished
+                or self._last_emit is None
+                or now - self._last_emit >= self.min_interval
+            ):
+                self._last_emit = now
+                self._emit(d.get("filename", ""))
+            self._log_threshold()
+            if finished and self.on_log:
+                self.on_log("Загрузка завершена, обрабатываем файл...", "info")
+
+    def _aggregate(self, d):
+        # Фрагменты одного формата yt-dlp уже суммирует сам, но при слиянии
+        # форматов каждый из них начинает отсчет с нуля, а при параллельной
+        # загрузке фрагментов их обновления приходят вперемешку
+        info = d.get("info_dict") or {}
+        if not self._formats:
+            for f in info.get("requested_formats") or []:
+                size = f.get("filesize") or f.get("filesize_approx") or 0
+                self._formats[f.get("format_id")] = [0, size]
+        key = info.get("format_id") or d.get("filename")
+        downloaded = d.get("downloaded_bytes") or 0
+        total = d.get("total_bytes") or d.get("total_bytes_estimate") or 0
+        if d["status"] == "finished":
+            total = downloaded = total or downloaded
+        entry = self._formats.setdefault(key, [0, 0])
+        entry[0] = downloaded
+        entry[1] = total or entry[1]
+        overall_downloaded = sum(down for down, _ in self._formats.values())
+        overall_total = sum(max(down, size) for down, size in self._formats.values())
+        return overall_downloaded, int(overall_total)
+
+    def _update_speed(self, now, downloaded):
+        if self._last_sample is None:
+            self._last_sample = (now, downloaded)
+            return
+        last_time, last_downloaded = self._last_sample
+        dt = now - last_time
+        if dt < 0.05:
+            return
+        sample = max(downloaded - last_downloaded, 0) / dt
+        if self.speed is None:
+            self.speed = sample
+        else:
+            # Экспоненциальное сглаживание с учетом интервала между замерами
+            alpha = 1 - math.exp(-dt / SPEED_TIME_CONSTANT)
+            self.speed += alpha * (sample - self.speed)
+        self._last_sample = (now, downloaded)
+
+    def _emit(self, filename):
+        self.emitted += 1
+        text = (
+            f"Файл: {os.path.basename(filename)}\n"
+            f"Прогресс: {self._percent}% | Скорость: {format_speed(self.speed)}"
+            f" | Осталось: {format_eta(self.eta)}"
+        )
+        self.on_progress(self._percent, text, self.downloaded, self.total)
+
+    def _log_threshold(self):
+        if not self.on_log or not self.log_step:
+            return
+        step = self._percent // self.log_step
+        if step > self._logged_step:
+            self._logged_step = step
+            self.on_log(
+                f"Прогресс: {self._percent}% | Скорость: {format_speed(self.speed)}"
+                f" | Осталось: {format_eta(self.eta)}",
+                "info",
+            )
@@ -0,0 +1,433 @@
+import json
+import os
+import threading
+import time
+
+from utils import get_settings
+
+ENGINE_YTDLP = "yt-dlp"
+ENGINE_SEGMENTED = "segmented"
+ENGINES = (ENGINE_YTDLP, ENGINE_SEGMENTED)
+DEFAULT_ENGINE = ENGINE_YTDLP
+DEFAULT_SEGMENTED = {
+    # Сколько соединений открыть сразу и до скольких добавлять
+    "connections": 4,
+    "max_connections": 8,
+    # Файлы меньше скачиваются обычным загрузчиком yt-dlp
+    "min_size_mb": 8,
+    # Остаток части меньше двух таких кусков свободному соединению не делится
+    "min_segment_mb": 1,
+}
+# Файл частей и их состояние; отдельно от .part yt-dlp, потому что файл
+# частей сразу имеет полный размер и обычная докачка приняла бы его за готовый
+PART_SUFFIX = ".segmented.part"
+STATE_SUFFIX = ".segmented.json"
+# Как часто замеряется общая скорость и решается, добавить ли соединение
+ADJUST_INTERVAL = 2.0
+# Новое соединение остается, если прибавило к скорости хотя бы 10%
+SPEEDUP_THRESHOLD = 1.1
+STATE_SAVE_INTERVAL = 1.0
+MONITOR_POLL = 0.5
+MAX_RETRY_DELAY = 10
+# Первый блок чтения; дальше он подстраивается под скорость соединения
+MIN_BLOCK_SIZE = 64 * 1024
+
+
+def get_download_engine(engine=None):
+    """Загрузчик по имени или из настройки download_engine"""
+    if engine is None:
+        engine = get_settings().get("download_engine", DEFAULT_ENGINE)
+    return engine if engine in ENGINES else DEFAULT_ENGINE
+
+
+def get_segmented_policy():
+    return {**DEFAULT_SEGMENTED, **get_settings().get("segmented", {})}
+
+
+def segmented_files(filename):
+    """Временные файлы загрузки частями для итогового filename"""
+    return [filename + PART_SUFFIX, filename + STATE_SUFFIX]
+
+
+class Segment:
+    """Диапазон [start, end) файла.
+
+    pos - до какого байта диапазон уже занят чтением, written - до какого
+    записан на диск; продолжение после сбоя идет с written.
+    """
+
+    def __init__(self, start, end, written=None):
+        self.start = start
+        self.end = end
+        self.written = start if written is None else written
+        self.pos = self.written
+        self.active = False
+
+    @property
+    def remaining(self):
+        return self.end - self.pos
+
+
+class SegmentedDownload:
+    """Загрузка прямых HTTP-файлов частями в несколько соединений.
+
+    Подменяет YoutubeDL.dl: файлы по http(s) без фрагментов, для которых
+    сервер поддерживает Range, скачиваются SegmentedFile, остальное (HLS,
+    DASH, маленькие файлы, сервера без Range) - обычным загрузчиком yt-dlp.
+    """
+
+    def __init__(self, ydl, policy):
+        self.ydl = ydl
+        self.policy = policy
+        self._dl = ydl.dl
+        ydl.dl = self
+
+    def __call__(self, name, info, subtitle=False, test=False):
+        if subtitle or test or not self.suitable(name, info):
+            return self._dl(name, info, subtitle, test)
+        info = self.ydl._copy_infodict(info)
+        if info.get("http_headers") is None:
+            info["http_headers"] = self.ydl._calc_headers(info)
+        if "Range" in info["http_headers"]:
+            return self._dl(name, info, subtitle, test)
+        total = self.probe(info["url"], info["http_headers"])
+        if not total or total < self.policy["min_size_mb"] * 1024**2:
+            return self._dl(name, info, subtitle, test)
+        download = SegmentedFile(self.ydl, name, info, total, self.policy)
+        return download.run(), True
+
+    def suitable(self, name, info):
+        return (
+            name != "-"
+            and info.get("protocol") in ("http", "https")
+            and not info.get("fragments")
+            # Готовый файл пусть обработает yt-dlp: он сообщит, что файл уже есть
+            and not os.path.exists(name)
+        )
+
+    def probe(self, url, headers):
+        """Полный размер файла, если сервер отдает его частями, иначе None"""
+        from yt_dlp.networking import Request
+        from yt_dlp.networking.exceptions import RequestError
+        from yt_dlp.utils import parse_http_range
+
+        try:
+            response = self.ydl.urlopen(
+                Request(url, headers={**headers, "Range": "bytes=0-0"})
+            )
+        except RequestError:
+            # Ошибку доступа сообщит обычный загрузчик
+            return None
+        try:
+            if response.status != 206:
+                return None
+            _, _, total = parse_http_range(response.headers.get("Content-Range"))
+            # Дочитанный ответ оставляет соединение в пуле для первой части
+            response.read()
+            return total
+        finally:
+            response.close()
+
+
+class SegmentedFile:
+    """Скачивание одного файла частями с докачкой каждой части.
+
+    Файл сразу создается полного размера, и каждое соединение пишет свою
+    часть на ее место, поэтому собирать части после загрузки не нужно.
+    Освободившееся соединение забирает половину самой большой оставшейся
+    части. Раз в ADJUST_INTERVAL замеряется общая скорость: соединения
+    добавляются по одному, пока каждое новое ускоряет загрузку (при
+    ограничении скорости на соединение), а лишнее закрывается. Состояние
+    частей сохраняется на диск, и прерванная загрузка продолжается с места
+    остановки каждой части.
+    """
+
+    def __init__(self, ydl, filename, info, total, policy):
+        self.ydl = ydl
+        self.filename = filename
+        self.info = info
+        self.url = info["url"]
+        self.headers = info["http_headers"]
+        self.total = total
+        self.tmpfilename, self.state_path = segmented_files(filename)
+        self.max_connections = max(1, policy["max_connections"])
+        self.target = min(max(1, policy["connections"]), self.max_connections)
+        self.min_segment = max(int(policy["min_segment_mb"] * 1024**2), 1)
+        self.retries = ydl.params.get("retries", 10)
+        self.chunk_size = ydl.params.get("http_chunk_size") or (
+            info.get("downloader_options") or {}
+        ).get("http_chunk_size")
+        self.segments = []
+        self.downloaded = 0
+        self._resumed = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._exited = threading.Event()
+        self._workers = []
+        self._error = None
+        self._started = None
+
+    def run(self):
+        self._prepare()
+        self._started = time.monotonic()
+        self.ydl.to_screen(
+            f"[segmented] Загрузка частями: {self.total / 1024**2:.1f} МБ, "
+            f"соединений: {self.target}"
+        )
+        self._report("downloading")
+        for _ in range(self.target):
+            self._spawn()
+        try:
+            self._monitor()
+        finally:
+            self._stop.set()
+            for worker in self._workers:
+                worker.join()
+            if not self._complete():
+                self._save_state()
+        if self._error is not None:
+            raise self._error
+        if not self._complete():
+            raise Exception("Загрузка частями завершилась не полностью")
+        os.replace(self.tmpfilename, self.filename)
+        try:
+            os.remove(self.state_path)
+        except OSError:
+            pass
+        self._report("finished")
+        return True
+
+    def _prepare(self):
+        if os.path.exists(self.tmpfilename) and self._load_state():
+            self._resumed = self.downloaded
+            self.ydl.to_screen(
+                f"[segmented] Продолжаем с {self.downloaded / 1024**2:.1f} МБ"
+            )
+            return
+        with open(self.tmpfilename, "wb") as f:
+            f.truncate(self.total)
+        size = -(-self.total // self.target)
+        self.segments = [
+            Segment(start, min(start + size, self.total))
+            for start in range(0, self.total, size)
+        ]
+        self.downloaded = 0
+        self._save_state()
+
+    def _load_state(self):
+        try:
+            with open(self.state_path, encoding="utf-8") as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if state.get("size") != self.total:
+            return False
+        if os.path.getsize(self.tmpfilename) != self.total:
+            return False
+        self.segments = [Segment(*values) for values in state["segments"]]
+        self.downloaded = sum(s.written - s.start for s in self.segments)
+        return True
+
+    def _save_state(self):
+        with self._lock:
+            segments = [[s.start, s.end, s.written] for s in self.segments]
+        tmp_path = self.state_path + ".tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"size": self.total, "segments": segments}, f)
+            os.replace(tmp_path, self.state_path)
+        except OSError:
+            pass
+
+    def _complete(self):
+        with self._lock:
+            return all(s.written >= s.end for s in self.segments)
+
+    def _spawn(self):
+        worker = threading.Thread(target=self._work, daemon=True)
+        with self._lock:
+            self._workers.append(worker)
+        worker.start()
+
+    def _live_workers(self):
+        with self._lock:
+            return sum(worker.is_alive() for worker in self._workers)
+
+    def _monitor(self):
+        last_save = last_adjust = time.monotonic()
+        last_bytes = self.downloaded
+        baseline = None  # скорость до последнего добавленного соединения
+        growing = True
+        while self._live_workers():
+            self._exited.wait(MONITOR_POLL)
+            self._exited.clear()
+            if self._error is not None:
+                return
+            now = time.monotonic()
+            if now - last_save >= STATE_SAVE_INTERVAL:
+                self._save_state()
+                last_save = now
+            if now - last_adjust < ADJUST_INTERVAL:
+                continue
+            speed = (self.downloaded - last_bytes) / (now - last_adjust)
+            last_bytes, last_adjust = self.downloaded, now
+            if baseline is not None and speed < baseline * SPEEDUP_THRESHOLD:
+                # Соединение не помогло: канал или сервер уже загружены
+                growing = False
+                self.target -= 1
+                self.ydl.write_debug(
+                    f"[segmented] Скорость не выросла, соединений: {self.target}"
+                )
+            baseline = None
+            if growing and self.target < self.max_connections and self._spawn_allowed():
+                baseline = speed
+                self.target += 1
+                self._spawn()
+                self.ydl.write_debug(
+                    f"[segmented] Добавлено соединение, всего: {self.target}"
+                )
+
+    def _spawn_allowed(self):
+        with self._lock:
+            return any(
+                s.remaining >= 2 * self.min_segment or (not s.active and s.remaining)
+                for s in self.segments
+            )
+
+    def _work(self):
+        try:
+            while not self._stop.is_set():
+                segment = self._next_segment()
+                if segment is None:
+                    return
+                try:
+                    self._fetch(segment)
+                finally:
+                    with self._lock:
+                        segment.active = False
+                        segment.pos = segment.written
+                # Лишнее соединение закрывается после своей части
+                with self._lock:
+                    busy = sum(s.active for s in self.segments)
+                    if busy >= self.target:
+                        return
+        except BaseException as e:
+            with self._lock:
+                if self._error is None:
+                    self._error = e
+            self._stop.set()
+        finally:
+            self._exited.set()
+
+    def _next_segment(self):
+        with self._lock:
+            for segment in self.segments:
+                if not segment.active and segment.remaining > 0:
+                    segment.active = True
+                    return segment
+            # Делим пополам самую большую часть, которую еще читают
+            active = [s for s in self.segments if s.active]
+            largest = max(active, key=lambda s: s.remaining, default=None)
+            if largest is None or largest.remaining < 2 * self.min_segment:
+                return None
+            middle = largest.pos + largest.remaining // 2
+            segment = Segment(middle, largest.end)
+            segment.active = True
+            largest.end = middle
+            self.segments.append(segment)
+            return segment
+
+    def _fetch(self, segment):
+        from yt_dlp.networking.exceptions import HTTPError, TransportError
+
+        retries = 0
+        with open(self.tmpfilename, "r+b", buffering=0) as f:
+            while not self._stop.is_set():
+                with self._lock:
+                    start, end = segment.pos, segment.end
+                if start >= end:
+                    return
+                if self.chunk_size:
+                    end = min(end, start + self.chunk_size)
+                try:
+                    if self._read_range(f, segment, start, end):
+                        retries = 0
+                except (TransportError, HTTPError) as e:
+                    if isinstance(e, HTTPError) and e.status < 500 and e.status != 429:
+                        raise
+                    retries += 1
+                    if retries > self.retries:
+                        raise
+                    with self._lock:
+                        segment.pos = segment.written
+                        position = segment.pos
+                    self.ydl.report_warning(
+                        f"[retry] Часть с {position} байта "
+                        f"({retries}/{self.retries}): {e}"
+                    )
+                    self._stop.wait(min(2 ** (retries - 1), MAX_RETRY_DELAY))
+
+    def _read_range(self, f, segment, start, end):
+        """Читает байты [start, end) части одним запросом; True, если что-то записано"""
+        from yt_dlp.downloader.common import FileDownloader
+        from yt_dlp.networking import Request
+        from yt_dlp.networking.exceptions import TransportError
+
+        headers = {**self.headers, "Range": f"bytes={start}-{end - 1}"}
+        block_size = max(self.ydl.params.get("buffersize", 0), MIN_BLOCK_SIZE)
+        written = False
+        response = self.ydl.urlopen(Request(self.url, headers=headers))
+        try:
+            if response.status != 206:
+                raise Exception("Сервер перестал отдавать файл частями")
+            f.seek(start)
+            while not self._stop.is_set():
+                with self._lock:
+                    wanted = min(segment.end, end) - segment.pos
+                if wanted <= 0:
+                    break
+                before = time.monotonic()
+                data = response.read(min(block_size, wanted))
+                if not data:
+                    raise TransportError("Соединение закрыто до конца части")
+                block_size = max(
+                    FileDownloader.best_block_size(
+                        time.monotonic() - before, len(data)
+                    ),
+                    MIN_BLOCK_SIZE,
+                )
+                # Пока блок читался, часть могли поделить
+                with self._lock:
+                    size = min(len(data), segment.end - segment.pos)
+                    segment.pos += size
+                view = memoryview(data)[:size]
+                while view:
+                    view = view[f.write(view) :]
+                with self._lock:
+                    segment.written += size
+                    self.downloaded += size
+                written = True
+                self._report("downloading")
+        finally:
+            response.close()
+        return written
+
+    def _report(self, status):
+        # Хуки вызываются из потоков частей, как при параллельных фрагментах
+        # yt-dlp, поэтому ограничение скорости в хуке действует на каждое соединение
+        elapsed = time.monotonic() - self._started
+        downloaded = self.downloaded
+        speed = (downloaded - self._resumed) / elapsed if elapsed > 0 else None
+        d = {
+            "status": status,
+            "filename": self.filename,
+            "tmpfilename": self.tmpfilename,
+            "downloaded_bytes": downloaded,
+            "total_bytes": self.total,
+            "elapsed": elapsed,
+            "speed": speed,
+            "eta": (self.total - downloaded) / speed if speed else None,
+            "info_dict": self.info,
+        }
+        for hook in self.ydl._progress_hooks:
+            hook(d)
@@ -0,0 +1,340 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+from utils import get_settings
+
+# Через сколько секунд простоя закрываются экземпляры YoutubeDL и соединения
+DEFAULT_IDLE_TIMEOUT = 300
+# Сколько свободных экземпляров хранить для одного набора параметров
+DEFAULT_MAX_IDLE = 4
+
+# Общие сетевые параметры поиска и загрузки: с одинаковыми параметрами
+# соединения с сайтом переиспользуются между получением информации и скачиванием
+NETWORK_OPTIONS = {
+    "nocheckcertificate": True,
+    "socket_timeout": 30,
+    "http_headers": {
+        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
+        "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+        "Accept-Language": "en-us,en;q=0.5",
+        "Sec-Fetch-Mode": "navigate",
+    },
+}
+# Параметры, от которых зависят соединения и cookies (см. build_request_director)
+NETWORK_PARAMS = (
+    "http_headers",
+    "proxy",
+    "socket_timeout",
+    "nocheckcertificate",
+    "source_address",
+    "cookiefile",
+    "cookiesfrombrowser",
+    "legacyserverconnect",
+    "client_certificate",
+    "client_certificate_key",
+    "client_certificate_password",
+    "enable_file_urls",
+    "debug_printtraffic",
+)
+# Параметры конкретного запроса: задаются при выдаче экземпляра и не делят
+# экземпляры на разные наборы
+LEASE_PARAMS = ("logger", "progress_hooks", "format", "outtmpl")
+
+
+class NullLogger:
+    """Логгер свободного экземпляра: без него yt-dlp печатал бы в консоль"""
+
+    def debug(self, msg):
+        pass
+
+    def warning(self, msg):
+        pass
+
+    def error(self, msg):
+        pass
+
+
+NULL_LOGGER = NullLogger()
+
+
+def options_key(opts, names=None):
+    """Ключ набора параметров: одинаковые параметры дают одинаковый ключ"""
+    if names is None:
+        items = {k: v for k, v in opts.items() if k not in LEASE_PARAMS}
+    else:
+        items = {k: opts[k] for k in names if k in opts}
+    return json.dumps(items, sort_keys=True, default=repr)
+
+
+class Network:
+    """Общие соединения и cookies для экземпляров с одинаковыми сетевыми параметрами"""
+
+    def __init__(self, ydl):
+        # Отдельный экземпляр без экстракторов владеет соединениями, поэтому
+        # они переживают закрытие любого из экземпляров, которые их используют
+        self.owner = ydl
+        self.cookiejar = ydl.cookiejar
+        self.director = ydl._request_director
+        self.sessions = 0
+        self.released_at = time.monotonic()
+
+    def attach(self, ydl):
+        # _request_director и cookiejar - кэшируемые свойства YoutubeDL
+        ydl.__dict__["cookiejar"] = self.cookiejar
+        ydl.__dict__["_request_director"] = self.director
+
+    def close(self):
+        self.owner.close()
+
+
+class Session:
+    def __init__(self, ydl, key, network):
+        self.ydl = ydl
+        self.key = key
+        self.network = network
+        self.released_at = None
+
+
+class SessionPool:
+    """Пул готовых экземпляров YoutubeDL с общими соединениями.
+
+    Экземпляр выдается одному потоку через lease() и после этого
+    возвращается в пул для того же набора параметров. Создание YoutubeDL
+    (реестр экстракторов, cookies) и TLS-соединения с сайтами повторно не
+    выполняются, а соединения общие для всех наборов с одинаковыми сетевыми
+    параметрами: получение информации сразу после загрузки с того же сайта
+    идет по уже открытым соединениям. Свободные экземпляры и соединения
+    закрываются после idle_timeout секунд простоя.
+    """
+
+    def __init__(self, idle_timeout=DEFAULT_IDLE_TIMEOUT, max_idle=DEFAULT_MAX_IDLE):
+        self.idle_timeout = idle_timeout
+        self.max_idle = max_idle
+        self._lock = threading.Lock()
+        self._idle = {}  # ключ набора -> свободные Session, последняя сверху
+        self._networks = {}  # ключ сетевых параметров -> Network
+        self._leased = {}  # id(ydl) -> Session
+        self._timer = None
+        self.created = 0
+        self.reused = 0
+
+    def configure(self, idle_timeout=None, max_idle=None):
+        with self._lock:
+            if idle_timeout is not None:
+                self.idle_timeout = idle_timeout
+            if max_idle is not None:
+                self.max_idle = max_idle
+
+    @contextmanager
+    def lease(self, opts):
+        """Выдает YoutubeDL с параметрами opts на время блока with.
+
+        Если блок завершился исключением (в том числе отменой загрузки),
+        экземпляр закрывается, а не возвращается в пул.
+        """
+        ydl = self.acquire(opts)
+        reuse = False
+        try:
+            yield ydl
+            reuse = True
+        finally:
+            self.release(ydl, reuse)
+
+    def acquire(self, opts):
+        key = options_key(opts)
+        network_key = options_key(opts, NETWORK_PARAMS)
+        with self._lock:
+            idle = self._idle.get(key)
+            session = idle.pop() if idle else None
+            network = self._networks.get(network_key)
+        if session is None:
+            session = self._create(opts, key, network_key, network)
+        else:
+            self.reused += 1
+        with self._lock:
+            self._leased[id(session.ydl)] = session
+        try:
+            self._prepare(session.ydl, opts)
+        except Exception:
+            # Например, ошибка в строке формата
+            self.release(session.ydl, reuse=False)
+            raise
+        return session.ydl
+
+    def release(self, ydl, reuse=True):
+        with self._lock:
+            session = self._leased.pop(id(ydl), None)
+        if session is None:
+            return
+        # Подмены на время запроса (DeferredPostprocess, SpaceCheck,
+        # SegmentedDownload) снимаем
+        for name in ("post_process", "pre_process", "dl"):
+            ydl.__dict__.pop(name, None)
+        ydl.params["logger"] = NULL_LOGGER
+        ydl._progress_hooks = []
+        closing = None
+        with self._lock:
+            idle = self._idle.setdefault(session.key, [])
+            if reuse and len(idle) < self.max_idle:
+                session.released_at = time.monotonic()
+                idle.append(session)
+            else:
+                closing = session
+                self._detach_locked(session)
+            self._schedule_eviction_locked()
+        if closing is not None:
+            self._close(closing)
+
+    def evict_idle(self):
+        """Закрывает экземпляры и соединения, простаивающие дольше idle_timeout"""
+        now = time.monotonic()
+        closing = []
+        with self._lock:
+            self._timer = None
+            for key, idle in list(self._idle.items()):
+                expired = [s for s in idle if now - s.released_at >= self.idle_timeout]
+                for session in expired:
+                    idle.remove(session)
+                    self._detach_locked(session)
+                closing.extend(expired)
+                if not idle:
+                    del self._idle[key]
+            networks = [
+                (key, network)
+                for key, network in self._networks.items()
+                if not network.sessions
+                and now - network.released_at >= self.idle_timeout
+            ]
+            for key, _network in networks:
+                del self._networks[key]
+            self._schedule_eviction_locked()
+        for session in closing:
+            self._close(session)
+        for _key, network in networks:
+            network.close()
+        return len(closing)
+
+    def close(self):
+        """Закрывает все свободные экземпляры и соединения (при выходе)"""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            closing = [session for idle in self._idle.values() for session in idle]
+            self._idle = {}
+            for session in closing:
+                self._detach_locked(session)
+            # Соединения экземпляров, которые еще выданы, закроются вместе с процессом
+            networks = [n for n in self._networks.values() if not n.sessions]
+            self._networks = {key: n for key, n in self._networks.items() if n.sessions}
+        for session in closing:
+            self._close(session)
+        for network in networks:
+            network.close()
+
+    def _create(self, opts, key, network_key, network):
+        import yt_dlp
+
+        if network is None:
+            network = Network(
+                yt_dlp.YoutubeDL(
+                    {
+                        **{k: opts[k] for k in NETWORK_PARAMS if k in opts},
+                        "quiet": True,
+                        "logger": NULL_LOGGER,
+                    },
+                    auto_init=False,
+                )
+            )
+            with self._lock:
+                # Другой поток мог успеть создать те же соединения
+                existing = self._networks.setdefault(network_key, network)
+            if existing is not network:
+                network.close()
+                network = existing
+        # YoutubeDL изменяет переданный словарь параметров
+        params = {k: v for k, v in opts.items() if k not in LEASE_PARAMS}
+        params["logger"] = NULL_LOGGER
+        ydl = yt_dlp.YoutubeDL(params)
+        network.attach(ydl)
+        with self._lock:
+            network.sessions += 1
+            self.created += 1
+        return Session(ydl, key, network)
+
+    def _prepare(self, ydl, opts):
+        # Параметры, которые YoutubeDL разбирает при создании, выставляем
+        # так же, как это делает его __init__
+        ydl.params["logger"] = opts.get("logger") or NULL_LOGGER
+        ydl._progress_hooks = list(opts.get("progress_hooks", ()))
+        format_spec = opts.get("format")
+        ydl.params["format"] = format_spec
+        ydl.format_selector = (
+            format_spec
+            if format_spec in (None, "-")
+            else ydl.build_format_selector(format_spec)
+        )
+        outtmpl = opts.get("outtmpl")
+        ydl.params["outtmpl"] = dict(outtmpl) if isinstance(outtmpl, dict) else {}
+        if isinstance(outtmpl, str):
+            ydl.params["outtmpl"]["default"] = outtmpl
+        ydl._parse_outtmpl()
+        # Счетчики предыдущего запроса
+        ydl._num_downloads = 0
+        ydl._download_retcode = 0
+        ydl._playlist_level = 0
+        ydl._playlist_urls = set()
+
+    def _detach_locked(self, session):
+        session.network.sessions -= 1
+        if not session.network.sessions:
+            session.network.released_at = time.monotonic()
+
+    def _close(self, session):
+        # Общие соединения закрываются вместе с Network, а не с экземпляром
+        session.ydl.__dict__.pop("_request_director", None)
+        try:
+            session.ydl.close()
+        except Exception:
+            pass
+
+    def _schedule_eviction_locked(self):
+        if self._timer is not None or not (self._idle or self._networks):
+            return
+        self._timer = threading.Timer(self.idle_timeout, self.evict_idle)
+        self._timer.daemon = True
+        self._timer.start()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_session_pool():
+    """Возвращает общий пул YoutubeDL, настроенный из настроек"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            settings = get_settings()
+            _pool = SessionPool(
+                settings.get("session_idle_timeout", DEFAULT_IDLE_TIMEOUT),
+                settings.get("session_max_idle", DEFAULT_MAX_IDLE),
+            )
+
+            def on_setting_changed(key, value):
+                if key == "session_idle_timeout":
+                    _pool.configure(idle_timeout=value)
+                elif key == "session_max_idle":
+                    _pool.configure(max_idle=value)
+
+            settings.subscribe(on_setting_changed)
+        return _pool
+
+
+def close_session_pool():
+    with _pool_lock:
+        pool = _pool
+    if pool is not None:
+        pool.close()
@@ -0,0 +1,83 @@
+import os
+import sys
+import time
+
+from PySide6.QtCore import QThread, Signal
+
+
+def process_uptime():
+    """Возвращает время в секундах с момента запуска процесса или None.
+
+    Отсчет идет от создания процесса операционной системой, поэтому в него
+    входят запуск интерпретатора и распаковка сборки PyInstaller.
+    """
+    try:
+        if sys.platform.startswith("linux"):
+            with open("/proc/self/stat", encoding="ascii") as f:
+                # Имя процесса в скобках может содержать пробелы
+                fields = f.read().rsplit(")", 1)[1].split()
+            start_ticks = int(fields[19])
+            boot_time = time.clock_gettime(time.CLOCK_BOOTTIME)
+            return boot_time - start_ticks / os.sysconf("SC_CLK_TCK")
+        if sys.platform.startswith("win"):
+            import ctypes
+            from ctypes import wintypes
+
+            creation = wintypes.FILETIME()
+            unused = [wintypes.FILETIME() for _ in range(3)]
+            kernel32 = ctypes.windll.kernel32
+            if not kernel32.GetProcessTimes(
+                kernel32.GetCurrentProcess(),
+                ctypes.byref(creation),
+                *(ctypes.byref(t) for t in unused),
+            ):
+                return None
+            # FILETIME - интервалы по 100 нс с 1601 года
+            created = (creation.dwHighDateTime << 32) | creation.dwLowDateTime
+            return time.time() - (created / 10**7 - 11644473600)
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+    return None
+
+
+class StartupTimer:
+    """Замеряет время до появления окна и до готовности yt-dlp"""
+
+    def __init__(self):
+        self._started = time.perf_counter()
+        uptime = process_uptime()
+        # Если время запуска процесса неизвестно, считаем от создания таймера
+        self._offset = uptime if uptime is not None else 0.0
+        self.marks = {}
+
+    def elapsed(self):
+        return self._offset + time.perf_counter() - self._started
+
+    def mark(self, name):
+        self.marks[name] = self.elapsed()
+        return self.marks[name]
+
+    def report(self):
+        return ", ".join(f"{name}: {value:.3f} с" for name, value in self.marks.items())
+
+
+class YtDlpWarmup(QThread):
+    """Импортирует yt-dlp и загружает реестр экстракторов в фоне"""
+
+    ready = Signal(float)  # длительность прогрева, секунды
+
+    def run(self):
+        started = time.perf_counter()
+        from yt_dlp.extractor import gen_extractor_classes
+
+        from loading import info_ydl_opts
+        from sessions import get_session_pool
+
+        # Реестр экстракторов и сетевой слой инициализируются при первом
+        # обращении, поэтому делаем его здесь, а не при первом поиске. Экземпляр
+        # YoutubeDL остается в пуле, и первый поиск получит его готовым
+        for _ in gen_extractor_classes():
+            pass
+        with get_session_pool().lease(info_ydl_opts()):
+            pass
+        self.ready.emit(time.perf_counter() - started)
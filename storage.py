@@ -0,0 +1,231 @@
+import errno
+import hashlib
+import os
+import shutil
+import sys
+
+from utils import get_settings, user_cache_dir
+
+STAGING_DIR = "staging"
+# Блок копирования при переносе из промежуточного каталога
+COPY_BLOCK_SIZE = 4 * 1024**2
+DEFAULT_STORAGE = {
+    # Локальный каталог для недокачанных файлов: "auto" - в кэше пользователя,
+    # null - писать сразу в папку сохранения
+    "staging_dir": None,
+    # Начальный размер блока чтения. Хук прогресса (и проверка отмены)
+    # вызывается на каждый блок, а yt-dlp подстраивает блок примерно под
+    # секунду передачи: на медленных соединениях блоки мелкие, на быстрых -
+    # крупные и дешевые
+    "read_buffer_kb": 64,
+    # Скачивать файл запросами Range по столько МБ; 0 - одним запросом
+    "http_chunk_mb": 0,
+    "preallocate": True,
+    # Сколько места оставить свободным сверх размера файла
+    "free_space_margin_mb": 50,
+}
+# fallocate: выделить место, не меняя размер файла
+FALLOC_FL_KEEP_SIZE = 1
+
+
+def get_storage_policy():
+    return {**DEFAULT_STORAGE, **get_settings().get("storage", {})}
+
+
+def staging_dir(policy):
+    """Промежуточный каталог или None, если файлы пишутся сразу на место"""
+    path = policy.get("staging_dir")
+    if not path:
+        return None
+    if path == "auto":
+        path = os.path.join(user_cache_dir(), STAGING_DIR)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def job_staging_dir(policy, url, format_id):
+    """Свой подкаталог промежуточного каталога для загрузки или None.
+
+    Одновременные загрузки с одинаковым именем файла не мешают друг другу, а
+    имя подкаталога зависит только от ссылки и формата: после паузы новое
+    задание найдет в нем свой .part и продолжит его.
+    """
+    root = staging_dir(policy)
+    if root is None:
+        return None
+    key = hashlib.sha1(f"{url}\n{format_id}".encode()).hexdigest()[:16]
+    path = os.path.join(root, key)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def remove_empty_dir(path):
+    """Удаляет каталог, если он пуст; недокачанные файлы остаются на месте"""
+    try:
+        os.rmdir(path)
+    except OSError:
+        pass
+
+
+def storage_options(policy):
+    """Параметры YoutubeDL для размеров блоков чтения и запросов"""
+    options = {"buffersize": int(policy["read_buffer_kb"] * 1024)}
+    if policy.get("http_chunk_mb"):
+        options["http_chunk_size"] = int(policy["http_chunk_mb"] * 1024**2)
+    return options
+
+
+def expected_size(info):
+    """Ожидаемый размер выбранного формата в байтах или None, если неизвестен"""
+    formats = info.get("requested_formats") or [info]
+    total = 0
+    for f in formats:
+        size = f.get("filesize") or f.get("filesize_approx")
+        if not size:
+            return None
+        total += size
+    return total
+
+
+def free_space(path):
+    """Свободное место в байтах на диске, где находится path"""
+    while not os.path.exists(path):
+        parent = os.path.dirname(path)
+        if parent == path:
+            break
+        path = parent
+    return shutil.disk_usage(path).free
+
+
+def check_free_space(directories, size, margin):
+    """Выбрасывает исключение, если в одном из каталогов не хватает места"""
+    for directory in dict.fromkeys(directories):
+        try:
+            available = free_space(directory)
+        except OSError:
+            continue
+        if available < size + margin:
+            raise Exception(
+                f"Недостаточно места в {directory}: нужно "
+                f"{(size + margin) / 1024**2:.0f} МБ, свободно "
+                f"{available / 1024**2:.0f} МБ"
+            )
+
+
+def preallocate(path, size):
+    """Заранее выделяет место под файл, не меняя его размер.
+
+    Видимый размер остается прежним, поэтому продолжение загрузки по
+    размеру .part работает как обычно. Поддерживается только Linux;
+    возвращает True, если место выделено.
+    """
+    if not sys.platform.startswith("linux") or not size:
+        return False
+    import ctypes
+
+    libc = ctypes.CDLL(None, use_errno=True)
+    fallocate = getattr(libc, "fallocate64", None) or getattr(libc, "fallocate", None)
+    if fallocate is None:
+        return False
+    fallocate.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_int64, ctypes.c_int64]
+    try:
+        fd = os.open(path, os.O_WRONLY)
+    except OSError:
+        return False
+    try:
+        return fallocate(fd, FALLOC_FL_KEEP_SIZE, 0, size) == 0
+    finally:
+        os.close(fd)
+
+
+def move_file(path, directory):
+    """Переносит готовый файл в directory и возвращает новый путь.
+
+    На другой диск файл копируется под временным именем и только потом
+    переименовывается, поэтому в папке сохранения не бывает недописанных
+    файлов под окончательным именем. Существующий файл не перезаписывается:
+    выбрасывается FileExistsError, а path остается на месте.
+    """
+    target = os.path.join(directory, os.path.basename(path))
+    os.makedirs(directory, exist_ok=True)
+    if os.path.exists(target):
+        raise FileExistsError(errno.EEXIST, "Файл уже существует", target)
+    try:
+        os.replace(path, target)
+        return target
+    except OSError:
+        pass
+    tmp_path = os.path.join(directory, f".{os.path.basename(path)}.moving")
+    try:
+        with open(path, "rb") as src, open(tmp_path, "wb") as dst:
+            shutil.copyfileobj(src, dst, COPY_BLOCK_SIZE)
+        shutil.copystat(path, tmp_path)
+        os.replace(tmp_path, target)
+    except OSError:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    os.remove(path)
+    return target
+
+
+class AlreadyDownloaded(Exception):
+    """Готовый файл уже лежит в папке сохранения; path - путь к нему"""
+
+    def __init__(self, path):
+        super().__init__(f"Файл уже скачан: {path}")
+        self.path = path
+
+
+def existing_target(filename, directory, ext=None, final_ext=None):
+    """Путь к уже готовому файлу с именем filename в directory или None.
+
+    Как и yt-dlp, проверяет имя с расширением после обработки и исходное.
+    """
+    name = os.path.join(directory, os.path.basename(filename))
+    candidates = [name]
+    if ext and final_ext:
+        base, real_ext = os.path.splitext(name)
+        if real_ext[1:] == ext:
+            candidates.insert(0, f"{base}.{final_ext}")
+    for path in candidates:
+        if os.path.exists(path):
+            return path
+    return None
+
+
+class SpaceCheck:
+    """Проверяет свободное место перед скачиванием выбранного формата.
+
+    Подменяет YoutubeDL.pre_process: на этапе before_dl формат уже выбран и
+    известен его размер (для пары видео + аудио - сумма), но ни один байт
+    еще не записан. Исключение прерывает загрузку.
+
+    С промежуточным каталогом yt-dlp не видит готовый файл в папке
+    сохранения, поэтому с final_dir он ищется там до проверки места, и
+    найденный прерывает загрузку исключением AlreadyDownloaded.
+    """
+
+    def __init__(self, ydl, directories, margin, final_dir=None):
+        self.directories = directories
+        self.margin = margin
+        self.final_dir = final_dir
+        self._ydl = ydl
+        self._pre_process = ydl.pre_process
+        ydl.pre_process = self
+
+    def __call__(self, info, key="pre_process", files_to_move=None):
+        if key == "before_dl":
+            if self.final_dir and info.get("_filename"):
+                path = existing_target(
+                    info["_filename"],
+                    self.final_dir,
+                    info.get("ext"),
+                    self._ydl.params.get("final_ext"),
+                )
+                if path:
+                    raise AlreadyDownloaded(path)
+            size = expected_size(info)
+            if size:
+                check_free_space(self.directories, size, self.margin)
+        return self._pre_process(info, key, files_to_move)
@@ -4,14 +4,14 @@ QWidget {
     background: #181a20;
     color: #e5e7eb;
 }
-QLineEdit, QTextEdit {
+QLineEdit, QTextEdit, QPlainTextEdit {
     background: #23272f;
     border-radius: 10px;
     padding: 10px;
     color: #e5e7eb;
     border: 1px solid #23272f;
 }
-QLineEdit:focus, QTextEdit:focus {
+QLineEdit:focus, QTextEdit:focus, QPlainTextEdit:focus {
     border: 1.5px solid #3b82f6;
 }
 QPushButton {
@@ -60,7 +60,7 @@ QLabel#ErrorLabel {
     font-size: 18px;
     margin-bottom: 8px;
 }
-QTextEdit {
+QTextEdit, QPlainTextEdit {
     font-family: 'Consolas', monospace;
     background: #181a20;
     border: 1.5px solid #23272f;
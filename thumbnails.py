@@ -0,0 +1,353 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import urllib.request
+from collections import OrderedDict
+
+from PySide6.QtCore import (
+    QBuffer,
+    QByteArray,
+    QIODevice,
+    QObject,
+    QSize,
+    Qt,
+    QTimer,
+    Signal,
+)
+from PySide6.QtGui import QIcon, QImage, QPixmap
+
+from sessions import NETWORK_OPTIONS
+from utils import get_settings, user_cache_dir
+
+CACHE_FILE = "thumbnails.sqlite3"
+DEFAULT_THUMBNAIL_WORKERS = 4
+DEFAULT_MEMORY_MB = 32
+DEFAULT_DISK_MB = 50
+# Размеры превью в окне информации о видео и значков в списках
+PREVIEW_SIZE = (320, 180)
+ICON_SIZE = (64, 36)
+FETCH_TIMEOUT = 15
+# Больше обложка не бывает; защищает от ссылки не на картинку
+MAX_IMAGE_BYTES = 5 * 1024**2
+JPEG_QUALITY = 85
+# Задержка перед запросом видимых строк после прокрутки, мс
+VISIBLE_DELAY = 100
+# Через сколько секунд снова пробовать обложку, которая не загрузилась
+FAILED_RETRY_DELAY = 60
+
+
+def thumbnail_url(info, width=None):
+    """Ссылка на обложку видео не уже width или None.
+
+    Из списка thumbnails берется самая маленькая подходящая картинка, чтобы
+    не скачивать обложку в полном разрешении ради значка в списке.
+    """
+    if not info:
+        return None
+    thumbnails = [t for t in info.get("thumbnails") or [] if t.get("url")]
+    if width and thumbnails:
+        sized = sorted(
+            (t for t in thumbnails if t.get("width")), key=lambda t: t["width"]
+        )
+        for thumbnail in sized:
+            if thumbnail["width"] >= width:
+                return thumbnail["url"]
+        if sized:
+            return sized[-1]["url"]
+    if info.get("thumbnail"):
+        return info["thumbnail"]
+    # yt-dlp сортирует thumbnails от худшей к лучшей
+    return thumbnails[-1]["url"] if thumbnails else None
+
+
+def thumbnail_key(url, size):
+    return f"{size[0]}x{size[1]}:{url}"
+
+
+class ThumbnailStore:
+    """Уменьшенные обложки на диске (JPEG в SQLite) с вытеснением LRU"""
+
+    def __init__(self, path, max_bytes=DEFAULT_DISK_MB * 1024**2):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS images (
+                key TEXT PRIMARY KEY,
+                data BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                accessed REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS images_accessed ON images (accessed);
+            """
+        )
+
+    @staticmethod
+    def _hash(key):
+        return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        key = self._hash(key)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data FROM images WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute(
+                "UPDATE images SET accessed = ? WHERE key = ?", (time.time(), key)
+            )
+            self._conn.commit()
+        return row[0]
+
+    def put(self, key, data):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO images (key, data, size, accessed) "
+                "VALUES (?, ?, ?, ?)",
+                (self._hash(key), data, len(data), time.time()),
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        total = self._conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM images"
+        ).fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self._conn.execute(
+            "SELECT key, size FROM images ORDER BY accessed"
+        ).fetchall():
+            self._conn.execute("DELETE FROM images WHERE key = ?", (key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+
+class ThumbnailLoader(QObject):
+    """Загружает обложки в фоновых потоках с кэшем в памяти и на диске.
+
+    request() сразу возвращает картинку из памяти или ставит ее в очередь и
+    возвращает None; готовая картинка приходит сигналом loaded в потоке
+    GUI. Картинка скачивается, декодируется и уменьшается один раз в
+    фоновом потоке, а на диске хранится уже уменьшенной. Очередь
+    обрабатывается с конца: последние запросы - обычно строки, которые
+    сейчас на экране, - выполняются первыми, а одинаковые запросы
+    объединяются.
+    """
+
+    loaded = Signal(str, QImage)  # ключ thumbnail_key, картинка
+    failed = Signal(str)
+
+    def __init__(
+        self,
+        store,
+        workers=DEFAULT_THUMBNAIL_WORKERS,
+        memory_bytes=DEFAULT_MEMORY_MB * 1024**2,
+        parent=None,
+    ):
+        super().__init__(parent)
+        self.store = store
+        self.workers = max(1, workers)
+        self.memory_bytes = memory_bytes
+        self._memory = OrderedDict()  # ключ -> QImage, последняя использованная в конце
+        self._memory_size = 0
+        self._failed = {}  # ключ -> время неудачной загрузки (monotonic)
+        self._pending = OrderedDict()  # ключ -> (url, size)
+        self._loading = set()
+        self._threads = []
+        self._condition = threading.Condition()
+        self.fetched = 0
+        self.disk_hits = 0
+
+    def get(self, url, size):
+        """Картинка из памяти или None"""
+        key = thumbnail_key(url, size)
+        with self._condition:
+            image = self._memory.get(key)
+            if image is not None:
+                self._memory.move_to_end(key)
+            return image
+
+    def request(self, url, size):
+        image = self.get(url, size)
+        if image is not None or not url:
+            return image
+        key = thumbnail_key(url, size)
+        with self._condition:
+            if key in self._loading:
+                return None
+            failed_at = self._failed.get(key)
+            # Сбой сети временный: после паузы обложку можно запросить снова
+            if failed_at is not None:
+                if time.monotonic() - failed_at < FAILED_RETRY_DELAY:
+                    return None
+                del self._failed[key]
+            self._pending[key] = (url, size)
+            self._pending.move_to_end(key)
+            if len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._work, daemon=True)
+                self._threads.append(thread)
+                thread.start()
+            self._condition.notify()
+        return None
+
+    def cancel(self, keys):
+        """Убирает из очереди запросы, которые больше не нужны"""
+        with self._condition:
+            for key in keys:
+                self._pending.pop(key, None)
+
+    def _work(self):
+        while True:
+            with self._condition:
+                while not self._pending:
+                    self._condition.wait()
+                key, (url, size) = self._pending.popitem()
+                self._loading.add(key)
+            try:
+                image = self._load(key, url, size)
+            except Exception:
+                image = None
+            with self._condition:
+                self._loading.discard(key)
+                if image is None:
+                    self._failed[key] = time.monotonic()
+                else:
+                    self._remember(key, image)
+            if image is None:
+                self.failed.emit(key)
+            else:
+                self.loaded.emit(key, image)
+
+    def _load(self, key, url, size):
+        data = self.store.get(key)
+        if data is not None:
+            image = QImage.fromData(data)
+            if not image.isNull():
+                self.disk_hits += 1
+                return image
+        request = urllib.request.Request(url, headers=NETWORK_OPTIONS["http_headers"])
+        with urllib.request.urlopen(request, timeout=FETCH_TIMEOUT) as response:
+            data = response.read(MAX_IMAGE_BYTES + 1)
+        if len(data) > MAX_IMAGE_BYTES:
+            return None
+        self.fetched += 1
+        image = QImage.fromData(data)
+        if image.isNull():
+            return None
+        image = image.scaled(
+            size[0],
+            size[1],
+            Qt.AspectRatioMode.KeepAspectRatio,
+            Qt.TransformationMode.SmoothTransformation,
+        )
+        encoded = QByteArray()
+        buffer = QBuffer(encoded)
+        buffer.open(QIODevice.OpenModeFlag.WriteOnly)
+        image.save(buffer, "JPEG", JPEG_QUALITY)
+        buffer.close()
+        self.store.put(key, encoded.data())
+        return image
+
+    def _remember(self, key, image):
+        self._memory[key] = image
+        self._memory_size += image.sizeInBytes()
+        while self._memory_size > self.memory_bytes and len(self._memory) > 1:
+            _, old = self._memory.popitem(last=False)
+            self._memory_size -= old.sizeInBytes()
+
+
+class TableThumbnails(QObject):
+    """Значки обложек в колонке QTableWidget только для видимых строк.
+
+    url_for_row(row) возвращает ссылку на обложку строки или None. После
+    прокрутки, изменения размера и refresh() запрашиваются только строки на
+    экране, а запросы ушедших с экрана строк снимаются с очереди, поэтому
+    длинный список не вызывает сотни загрузок и не тормозит прокрутку.
+    """
+
+    def __init__(self, table, column, url_for_row, size=ICON_SIZE):
+        super().__init__(table)
+        self.table = table
+        self.column = column
+        self.url_for_row = url_for_row
+        self.size = size
+        self.loader = get_thumbnail_loader()
+        self._requested = set()
+        table.setIconSize(QSize(*size))
+        table.verticalHeader().setDefaultSectionSize(size[1] + 4)
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.setInterval(VISIBLE_DELAY)
+        self._timer.timeout.connect(self.update_visible)
+        table.verticalScrollBar().valueChanged.connect(self.refresh)
+        self.loader.loaded.connect(self._on_loaded)
+
+    def refresh(self):
+        """Запрашивает обложки видимых строк с небольшой задержкой"""
+        self._timer.start()
+
+    def visible_rows(self):
+        if not self.table.rowCount():
+            return range(0)
+        viewport = self.table.viewport()
+        first = self.table.rowAt(0)
+        last = self.table.rowAt(viewport.height() - 1)
+        if last < 0:
+            last = self.table.rowCount() - 1
+        return range(max(first, 0), last + 1)
+
+    def update_visible(self):
+        requested = set()
+        for row in self.visible_rows():
+            url = self.url_for_row(row)
+            if not url:
+                continue
+            image = self.loader.request(url, self.size)
+            if image is not None:
+                self._set_icon(row, image)
+            else:
+                requested.add(thumbnail_key(url, self.size))
+        self.loader.cancel(self._requested - requested)
+        self._requested = requested
+
+    def _on_loaded(self, key, image):
+        if key not in self._requested:
+            return
+        for row in self.visible_rows():
+            url = self.url_for_row(row)
+            if url and thumbnail_key(url, self.size) == key:
+                self._set_icon(row, image)
+
+    def _set_icon(self, row, image):
+        item = self.table.item(row, self.column)
+        if item is not None:
+            item.setIcon(QIcon(QPixmap.fromImage(image)))
+
+
+_loader = None
+_loader_lock = threading.Lock()
+
+
+def get_thumbnail_loader():
+    """Общий загрузчик обложек; создается в потоке GUI"""
+    global _loader
+    with _loader_lock:
+        if _loader is None:
+            settings = get_settings()
+            _loader = ThumbnailLoader(
+                ThumbnailStore(
+                    os.path.join(user_cache_dir(), CACHE_FILE),
+                    settings.get("thumbnail_cache_mb", DEFAULT_DISK_MB) * 1024**2,
+                ),
+                settings.get("thumbnail_workers", DEFAULT_THUMBNAIL_WORKERS),
+                settings.get("thumbnail_memory_mb", DEFAULT_MEMORY_MB) * 1024**2,
+            )
+        return _loader
@@ -1,16 +1,244 @@
+import atexit
 import json
 import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import parse_qs, urlparse
 
+APP_NAME = "VideoDownloader"
 SETTINGS_FILE = "settings.json"
+# Задержка перед записью настроек, чтобы объединить частые изменения
+SETTINGS_SAVE_DELAY = 1.0
 
+# Подписанные ссылки на медиа живут ограниченное время; если сайт не указал
+# срок действия в ссылке, считаем info устаревшим через этот интервал
+MEDIA_URL_MAX_AGE = 60 * 60
+# Запас, чтобы ссылка не истекла прямо во время загрузки
+MEDIA_URL_EXPIRY_MARGIN = 5 * 60
+# Результаты extract_info, в которых вместо видео список записей
+PLAYLIST_TYPES = ("playlist", "multi_video")
+# Сколько секунд в сумме ждать остановки всех потоков при закрытии
+SHUTDOWN_TIMEOUT = 0.5
 
-def load_settings():
-    if os.path.exists(SETTINGS_FILE):
-        with open(SETTINGS_FILE, encoding="utf-8") as f:
-            return json.load(f)
-    return {}
 
+class SettingsStore:
+    """Настройки приложения в памяти с отложенной атомарной записью на диск.
 
-def save_settings(settings):
-    with open(SETTINGS_FILE, "w", encoding="utf-8") as f:
-        json.dump(settings, f, ensure_ascii=False, indent=2)
+    Изменения сразу видны всем окнам процесса, подписчики получают
+    (key, value), а файл перезаписывается не чаще раза в save_delay секунд.
+    """
+
+    def __init__(self, path, save_delay=SETTINGS_SAVE_DELAY, legacy_path=None):
+        self.path = path
+        self.save_delay = save_delay
+        self._lock = threading.RLock()
+        # Отдельная блокировка записи: снимок и замена файла идут по порядку
+        self._write_lock = threading.Lock()
+        self._listeners = []
+        self._timer = None
+        self._dirty = False
+        self._data = self._read(path)
+        if not self._data and legacy_path and not os.path.exists(path):
+            # Переносим настройки из старого расположения рядом с программой
+            self._data = self._read(legacy_path)
+            if self._data:
+                self._dirty = True
+                self._schedule_save()
+
+    @staticmethod
+    def _read(path):
+        try:
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        return data if isinstance(data, dict) else {}
+
+    def get(self, key, default=None):
+        with self._lock:
+            return self._data.get(key, default)
+
+    def __getitem__(self, key):
+        with self._lock:
+            return self._data[key]
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._data
+
+    def __setitem__(self, key, value):
+        self.set(key, value)
+
+    def set(self, key, value):
+        with self._lock:
+            if key in self._data and self._data[key] == value:
+                return
+            self._data[key] = value
+            self._dirty = True
+            self._schedule_save()
+            listeners = list(self._listeners)
+        for callback in listeners:
+            callback(key, value)
+
+    def subscribe(self, callback):
+        """Подписывает callback(key, value) на изменения настроек"""
+        with self._lock:
+            self._listeners.append(callback)
+
+    def unsubscribe(self, callback):
+        with self._lock:
+            if callback in self._listeners:
+                self._listeners.remove(callback)
+
+    def _schedule_save(self):
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = threading.Timer(self.save_delay, self.flush)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def flush(self):
+        """Немедленно записывает несохраненные изменения"""
+        with self._write_lock:
+            with self._lock:
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+                if not self._dirty:
+                    return
+                data = json.dumps(self._data, ensure_ascii=False, indent=2)
+                self._dirty = False
+            try:
+                self._write(data)
+            except OSError:
+                with self._lock:
+                    self._dirty = True
+                raise
+
+    def _write(self, data):
+        directory = os.path.dirname(self.path) or "."
+        os.makedirs(directory, exist_ok=True)
+        # Пишем во временный файл и подменяем им старый, чтобы сбой
+        # во время записи не оставил обрезанный файл настроек
+        fd, tmp_path = tempfile.mkstemp(prefix=".settings-", dir=directory)
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+
+_settings = None
+_settings_lock = threading.Lock()
+
+
+def get_settings():
+    """Возвращает общее для процесса хранилище настроек"""
+    global _settings
+    with _settings_lock:
+        if _settings is None:
+            _settings = SettingsStore(
+                os.path.join(user_config_dir(), SETTINGS_FILE),
+                legacy_path=SETTINGS_FILE,
+            )
+            atexit.register(_settings.flush)
+        return _settings
+
+
+def user_config_dir():
+    """Возвращает каталог настроек приложения для текущего пользователя"""
+    if sys.platform.startswith("win"):
+        base = os.environ.get("APPDATA") or os.path.expanduser("~\\AppData\\Roaming")
+    elif sys.platform.startswith("darwin"):
+        base = os.path.expanduser("~/Library/Application Support")
+    else:
+        base = os.environ.get("XDG_CONFIG_HOME") or os.path.expanduser("~/.config")
+    path = os.path.join(base, APP_NAME)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def user_cache_dir():
+    """Возвращает каталог кэша приложения для текущего пользователя"""
+    if sys.platform.startswith("win"):
+        base = os.environ.get("LOCALAPPDATA") or os.path.expanduser("~\\AppData\\Local")
+    elif sys.platform.startswith("darwin"):
+        base = os.path.expanduser("~/Library/Caches")
+    else:
+        base = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    path = os.path.join(base, APP_NAME)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def media_urls_expired(info, max_age=MEDIA_URL_MAX_AGE):
+    """Проверяет, истекли ли подписанные ссылки на форматы в info"""
+    now = time.time()
+    epoch = info.get("epoch")
+    if epoch is None or now - epoch > max_age:
+        return True
+    for f in info.get("formats") or []:
+        url = f.get("url")
+        if not url:
+            continue
+        expire = parse_qs(urlparse(url).query).get("expire")
+        if expire and expire[0].isdigit():
+            if int(expire[0]) - MEDIA_URL_EXPIRY_MARGIN < now:
+                return True
+    return False
+
+
+def host_setting(mapping, url, default=None):
+    """Ищет значение для хоста URL или его родительского домена в словаре"""
+    host = (urlparse(url).hostname or "").lower()
+    parts = host.split(".")
+    for i in range(len(parts) - 1):
+        value = mapping.get(".".join(parts[i:]))
+        if value is not None:
+            return value
+    return default
+
+
+def parse_urls(text):
+    """Ссылки из вставленного текста или файла: по одной или несколько в строке.
+
+    Строки, начинающиеся с #, пропускаются, повторы убираются с сохранением порядка.
+    """
+    urls = []
+    for line in text.splitlines():
+        if not line.lstrip().startswith("#"):
+            urls.extend(line.split())
+    return list(dict.fromkeys(urls))
+
+
+def wait_threads(threads, timeout=SHUTDOWN_TIMEOUT):
+    """Ждет потоки QThread с общим сроком и возвращает те, что еще работают"""
+    deadline = time.monotonic() + timeout
+    for thread in threads:
+        remaining = max(deadline - time.monotonic(), 0)
+        thread.wait(int(remaining * 1000))
+    return [thread for thread in threads if thread.isRunning()]
+
+
+def reveal_file(file_path, folder):
+    """Показывает скачанный файл в файловом менеджере, иначе открывает папку"""
+    if file_path and os.path.exists(file_path):
+        if sys.platform.startswith("win"):
+            subprocess.run(["explorer", "/select,", os.path.normpath(file_path)])
+        elif sys.platform.startswith("darwin"):
+            subprocess.run(["open", "-R", file_path])
+        else:
+            subprocess.run(["xdg-open", os.path.dirname(file_path)])
+    elif os.path.exists(folder):
+        if sys.platform.startswith("win"):
+            os.startfile(folder)
+        else:
+            subprocess.run(["xdg-open", folder])
@@ -1,9 +1,10 @@
 import os
+import time
 
-import yt_dlp
-from PySide6.QtCore import Signal
-from PySide6.QtGui import QIcon
+from PySide6.QtCore import Qt, Signal
+from PySide6.QtGui import QIcon, QPixmap
 from PySide6.QtWidgets import (
+    QCheckBox,
     QComboBox,
     QDialog,
     QHBoxLayout,
@@ -14,31 +15,28 @@ from PySide6.QtWidgets import (
     QVBoxLayout,
 )
 
-from utils import load_settings, save_settings
+from cache import get_metadata_cache
+from formats import FormatIndex, get_format_policy
+from logs import YTDLSearchLogger, is_verbose, resolve_log_level
+from segmented import ENGINE_SEGMENTED, ENGINE_YTDLP, get_download_engine
+from sessions import NETWORK_OPTIONS, get_session_pool
+from thumbnails import (
+    PREVIEW_SIZE,
+    get_thumbnail_loader,
+    thumbnail_key,
+    thumbnail_url,
+)
+from utils import get_settings
 
 ICON_PATH = "app.ico"
 
 
-class YTDLSearchLogger:
-    def __init__(self, log_callback):
-        self.log_callback = log_callback
-
-    def debug(self, msg):
-        self.log_callback(f"[debug] {msg}")
-
-    def warning(self, msg):
-        self.log_callback(f"[warning] {msg}")
-
-    def error(self, msg):
-        self.log_callback(f"[error] {msg}")
-
-
 class VideoInfoDialog(QDialog):
     format_selected = Signal(dict)
 
     def __init__(self, parent=None):
         super().__init__(parent)
-        self.settings = load_settings()
+        self.settings = get_settings()
         size = self.settings.get("video_info_size")
         if size:
             self.resize(size[0], size[1])
@@ -46,11 +44,22 @@ class VideoInfoDialog(QDialog):
         self.setMinimumSize(600, 400)
         if os.path.exists(ICON_PATH):
             self.setWindowIcon(QIcon(ICON_PATH))
+        self.thumbnail_key = None
+        self.thumbnails = get_thumbnail_loader()
+        self.thumbnails.loaded.connect(self.on_thumbnail_loaded)
+        self.thumbnails.failed.connect(self.on_thumbnail_failed)
         self.setup_ui()
 
     def setup_ui(self):
         layout = QVBoxLayout(self)
 
+        # Обложка загружается в фоне, окно открывается сразу
+        self.preview_label = QLabel()
+        self.preview_label.setFixedSize(*PREVIEW_SIZE)
+        self.preview_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
+        self.preview_label.hide()
+        layout.addWidget(self.preview_label, alignment=Qt.AlignmentFlag.AlignHCenter)
+
         # Основная информация
         self.info_label = QLabel("Загрузка информации...")
         self.info_label.setWordWrap(True)
@@ -64,6 +73,14 @@ class VideoInfoDialog(QDialog):
         format_layout.addWidget(self.format_combo)
         layout.addLayout(format_layout)
 
+        # Прямые файлы (не HLS/DASH) можно качать частями в несколько соединений
+        self.segmented_check = QCheckBox("Загрузка в несколько соединений")
+        self.segmented_check.setToolTip(
+            "Для сайтов, ограничивающих скорость одного соединения"
+        )
+        self.segmented_check.setChecked(get_download_engine() == ENGINE_SEGMENTED)
+        layout.addWidget(self.segmented_check)
+
         # Детальная информация
         self.details_text = QTextEdit()
         self.details_text.setReadOnly(True)
@@ -81,104 +98,29 @@ class VideoInfoDialog(QDialog):
 
     def load_video_info(self, url, log_callback=None):
         try:
+            level = resolve_log_level()
             ydl_opts = {
                 "quiet": True,
                 "no_warnings": False,
                 "extract_flat": False,
                 "ignoreerrors": True,
-                "verbose": True,
+                "verbose": is_verbose(level),
+                **NETWORK_OPTIONS,
             }
             if log_callback:
-                ydl_opts["logger"] = YTDLSearchLogger(log_callback)
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(url, download=False)
-
-                if not info:
-                    raise Exception("Не удалось получить информацию о видео")
-
-                # Основная информация
-                title = info.get("title", "Без названия")
-                duration = info.get("duration", 0)
-                duration_str = f"{duration // 60}:{duration % 60:02d}"
-
-                self.info_label.setText(
-                    f"Название: {title}\nДлительность: {duration_str}"
-                )
-
-                # Форматы
-                formats = info.get("formats", [])
-                if not formats:
-                    raise Exception("Не найдены доступные форматы")
-
-                self.format_combo.clear()
-
-                # Сортируем форматы по качеству
-                formats.sort(
-                    key=lambda x: (x.get("height", 0) or 0, x.get("filesize", 0) or 0),
-                    reverse=True,
-                )
-
-                # Убираем дублирующиеся форматы
-                seen = set()
-                unique_formats = []
-                for f in formats:
-                    height = f.get("height", 0)
-                    resolution = f.get("resolution", "")
-                    ext = f.get("ext", "").upper()
-                    filesize = f.get("filesize", 0)
-                    filesize_mb = round(filesize / (1024 * 1024), 1) if filesize else 0
-                    key = (height, resolution, ext, filesize_mb)
-                    if key in seen:
-                        continue
-                    seen.add(key)
-                    unique_formats.append(f)
-
-                for f in unique_formats:
-                    ext = f.get("ext", "")
-                    resolution = f.get("resolution", "")
-                    height = f.get("height", 0)
-                    filesize = f.get("filesize", 0)
-                    filesize_mb = filesize / (1024 * 1024) if filesize else 0
-                    format_desc = []
-                    if height:
-                        format_desc.append(f"{height}p")
-                    if resolution:
-                        format_desc.append(resolution)
-                    format_desc.append(ext.upper())
-                    if filesize_mb:
-                        format_desc.append(f"{filesize_mb:.1f}MB")
-                    format_str = " | ".join(format_desc)
-                    self.format_combo.addItem(format_str, f)
-
-                # Детальная информация
-                details = []
-                details.append(f"Заголовок: {title}")
-                details.append(f"Длительность: {duration_str}")
-                details.append(f"Автор: {info.get('uploader', 'Неизвестно')}")
-                details.append(f"Просмотры: {info.get('view_count', 'Неизвестно')}")
-                details.append(f"Доступно форматов: {len(unique_formats)}")
-
-                # Добавляем информацию о качестве
-                if unique_formats:
-                    best_format = unique_formats[0]
-                    details.append(
-                        f"\nЛучшее качество: {best_format.get('height', '?')}p"
-                    )
-                    if best_format.get("filesize"):
-                        details.append(
-                            f"Размер: {best_format['filesize'] / (1024 * 1024):.1f}MB"
-                        )
-
-                self.details_text.setText("\n".join(details))
-
-                return True
+                ydl_opts["logger"] = YTDLSearchLogger(log_callback, level=level)
+            cache = get_metadata_cache()
+            info = cache.get(url)
+            if info is None:
+                with get_session_pool().lease(ydl_opts) as ydl:
+                    info = ydl.extract_info(url, download=False)
+                if info:
+                    info.setdefault("epoch", int(time.time()))
+                    cache.put(url, info)
         except Exception as e:
-            error_msg = str(e)
-            self.info_label.setText(f"Ошибка при загрузке информации: {error_msg}")
-            QMessageBox.critical(
-                self, "Ошибка", f"Не удалось получить информацию о видео:\n{error_msg}"
-            )
+            self.show_error(str(e))
             return False
+        return self.load_video_info_from_info(info)
 
     def load_video_info_from_info(self, info):
         try:
@@ -189,74 +131,77 @@ class VideoInfoDialog(QDialog):
             duration = info.get("duration", 0)
             duration_str = f"{duration // 60}:{duration % 60:02d}"
             self.info_label.setText(f"Название: {title}\nДлительность: {duration_str}")
-            # Форматы
-            formats = info.get("formats", [])
-            if not formats:
+            self.show_thumbnail(thumbnail_url(info, PREVIEW_SIZE[0]))
+            # Форматы ранжируются индексом, сам info не изменяется
+            index = FormatIndex(info, get_format_policy())
+            if not index.options:
                 raise Exception("Не найдены доступные форматы")
             self.format_combo.clear()
-            formats.sort(
-                key=lambda x: (x.get("height", 0) or 0, x.get("filesize", 0) or 0),
-                reverse=True,
-            )
-            seen = set()
-            unique_formats = []
-            for f in formats:
-                height = f.get("height", 0)
-                resolution = f.get("resolution", "")
-                ext = f.get("ext", "").upper()
-                filesize = f.get("filesize", 0)
-                filesize_mb = round(filesize / (1024 * 1024), 1) if filesize else 0
-                key = (height, resolution, ext, filesize_mb)
-                if key in seen:
-                    continue
-                seen.add(key)
-                unique_formats.append(f)
-            for f in unique_formats:
-                ext = f.get("ext", "")
-                resolution = f.get("resolution", "")
-                height = f.get("height", 0)
-                filesize = f.get("filesize", 0)
-                filesize_mb = filesize / (1024 * 1024) if filesize else 0
-                format_desc = []
-                if height:
-                    format_desc.append(f"{height}p")
-                if resolution:
-                    format_desc.append(resolution)
-                format_desc.append(ext.upper())
-                if filesize_mb:
-                    format_desc.append(f"{filesize_mb:.1f}MB")
-                format_str = " | ".join(format_desc)
-                self.format_combo.addItem(format_str, f)
+            for option in index.options:
+                self.format_combo.addItem(option.label(), option.as_dict())
             details = []
             details.append(f"Заголовок: {title}")
             details.append(f"Длительность: {duration_str}")
             details.append(f"Автор: {info.get('uploader', 'Неизвестно')}")
             details.append(f"Просмотры: {info.get('view_count', 'Неизвестно')}")
-            details.append(f"Доступно форматов: {len(unique_formats)}")
-            if unique_formats:
-                best_format = unique_formats[0]
-                details.append(f"\nЛучшее качество: {best_format.get('height', '?')}p")
-                if best_format.get("filesize"):
-                    details.append(
-                        f"Размер: {best_format['filesize'] / (1024 * 1024):.1f}MB"
-                    )
+            details.append(f"Доступно форматов: {len(index.options)}")
+            best_format = index.best()
+            details.append(f"\nЛучшее качество: {best_format.height or '?'}p")
+            if best_format.filesize:
+                details.append(f"Размер: {best_format.filesize / (1024 * 1024):.1f}MB")
             self.details_text.setText("\n".join(details))
             return True
         except Exception as e:
-            error_msg = str(e)
-            self.info_label.setText(f"Ошибка при загрузке информации: {error_msg}")
-            QMessageBox.critical(
-                self, "Ошибка", f"Не удалось получить информацию о видео:\n{error_msg}"
-            )
+            self.show_error(str(e))
             return False
 
+    def show_thumbnail(self, url):
+        if not url:
+            self.thumbnail_key = None
+            self.preview_label.hide()
+            return
+        self.thumbnail_key = thumbnail_key(url, PREVIEW_SIZE)
+        self.preview_label.show()
+        image = self.thumbnails.request(url, PREVIEW_SIZE)
+        if image is not None:
+            self.preview_label.setPixmap(QPixmap.fromImage(image))
+        else:
+            self.preview_label.setText("Загрузка обложки...")
+
+    def on_thumbnail_loaded(self, key, image):
+        if key == self.thumbnail_key:
+            self.preview_label.setPixmap(QPixmap.fromImage(image))
+
+    def on_thumbnail_failed(self, key):
+        if key == self.thumbnail_key:
+            self.preview_label.hide()
+
+    def show_error(self, error_msg):
+        self.info_label.setText(f"Ошибка при загрузке информации: {error_msg}")
+        QMessageBox.critical(
+            self, "Ошибка", f"Не удалось получить информацию о видео:\n{error_msg}"
+        )
+
     def accept_selection(self):
         current_format = self.format_combo.currentData()
         if current_format:
-            self.format_selected.emit(current_format)
+            engine = (
+                ENGINE_SEGMENTED if self.segmented_check.isChecked() else ENGINE_YTDLP
+            )
+            # Выбор запоминается для следующих загрузок
+            self.settings["download_engine"] = engine
+            self.format_selected.emit({**current_format, "engine": engine})
             self.accept()
 
+    def done(self, result):
+        # Загрузчик обложек общий для приложения: закрытое окно отключается от
+        # него, иначе оно оставалось бы в памяти и получало чужие обложки
+        if self.thumbnails is not None:
+            self.thumbnails.loaded.disconnect(self.on_thumbnail_loaded)
+            self.thumbnails.failed.disconnect(self.on_thumbnail_failed)
+            self.thumbnails = None
+        super().done(result)
+
     def closeEvent(self, event):
         self.settings["video_info_size"] = [self.size().width(), self.size().height()]
-        save_settings(self.settings)
         super().closeEvent(event)